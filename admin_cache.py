@@ -0,0 +1,61 @@
+# per-chat cache of administrator user ids, so admin-only commands don't
+# need a getChatAdministrators round trip every time.
+import asyncio
+import time
+from collections import OrderedDict
+
+from constants import ADMIN_CACHE_SECONDS, ADMIN_CACHE_SIZE
+
+
+class AdminCache:
+    def __init__(self, ttl: float = ADMIN_CACHE_SECONDS, max_size: int = ADMIN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # chat_id -> (expires_at, admin user ids)
+        self._admins: OrderedDict[int, tuple[float, frozenset[int]]] = OrderedDict()
+        # chat_id -> in-flight lookup that concurrent callers share. invalidate drops it, so a lookup
+        # that's no longer the pending one started before the change and doesn't store what it got
+        self._pending: dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, chat) -> frozenset[int]:
+        """Admin user ids for a telegram Chat."""
+        entry = self._admins.get(chat.id)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            self._admins.move_to_end(chat.id)
+            return entry[1]
+        self.misses += 1
+        if chat.id not in self._pending:
+            self._pending[chat.id] = asyncio.get_running_loop().create_task(self._fetch(chat))
+        return await asyncio.shield(self._pending[chat.id])
+
+    async def _fetch(self, chat) -> frozenset[int]:
+        task = asyncio.current_task()
+        try:
+            admins = frozenset(admin.user.id for admin in await chat.get_administrators())
+        finally:
+            current = self._pending.get(chat.id) is task
+            if current:
+                del self._pending[chat.id]
+        if current:
+            self._admins[chat.id] = (time.monotonic() + self.ttl, admins)
+            self._admins.move_to_end(chat.id)
+            while len(self._admins) > self.max_size:
+                self._admins.popitem(last=False)
+        return admins
+
+    async def is_admin(self, chat, user_id: int) -> bool:
+        return user_id in await self.get(chat)
+
+    def invalidate(self, chat_id: int):
+        self._admins.pop(chat_id, None)
+        self._pending.pop(chat_id, None)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self._admins), "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate()}
@@ -1,308 +1,604 @@
+import asyncio
+import json
 import logging
 import re
-from datetime import time, timedelta, datetime
-from random import choice, randrange
+from datetime import time, timedelta, datetime, timezone
+from random import choice
+from time import perf_counter
 
-from telegram import Chat, Update
+from telegram import Chat, InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     ApplicationBuilder,
+    ApplicationHandlerStop,
+    CallbackQueryHandler,
+    ChatMemberHandler,
     CommandHandler,
     ContextTypes,
+    Job,
     MessageHandler,
+    TypeHandler,
     filters
 )
 
+import database
+import metrics
 import models as db
-from constants import PACIFIC_TZ, AWOO_PATTERN, BOT_NAME
+from chat_cache import ChatCache
+from constants import (
+    PACIFIC_TZ,
+    AWOO_BURST_CAP,
+    AWOO_WINDOW_SECONDS,
+    BOT_API_URL,
+    CHAT_CACHE_FLUSH_SECONDS,
+    CONCURRENT_UPDATES,
+    DATA_REFRESH_MINUTES,
+    FIRING_KEEP_DAYS,
+    FORWARD_POLL_SECONDS,
+    LEASE_RENEW_SECONDS,
+    LIST_LINE_LENGTH,
+    SWEEP_GRACE_MINUTES,
+    SWEEP_MINUTES,
+    MAX_AWOO_BURST_CAP,
+    MAX_AWOO_WINDOW_SECONDS,
+    MAX_TRIGGER_WORDS,
+    METRICS_PORT,
+    REMINDER_PAGE_MINUTES,
+    UPDATE_MODE
+)
+from debounce import BurstDebouncer
 from functions import *
+from outbox import PRIORITY_SCHEDULED, Outbox
+from profiling import HandlerProfiler, SlowQueryLog
+from scheduler import DailyBuckets, ReminderScheduler
+from sharding import ShardLeases
+from sheet_data import SheetData
+from webhook import run_forwarded, run_webhook
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-data = {}
+word_data = SheetData()
 chats = {}
 msg = get_system_messages()
-session = db.Session()
-
-
-def register_reminder(context: ContextTypes.DEFAULT_TYPE, reminder: db.Reminder):
+chat_cache = ChatCache()
+reminder_scheduler = ReminderScheduler()
+daily_buckets = DailyBuckets()
+# minute of day -> its repeating job, so registering doesn't scan the whole queue
+bucket_jobs: dict[int, Job] = {}
+outbox = Outbox()
+awoo_bursts = BurstDebouncer()
+leases = ShardLeases()
+metrics_server = metrics.MetricsServer()
+profiler = HandlerProfiler()
+slow_queries = SlowQueryLog()
+metrics.register_stats("outbox", outbox.stats)
+metrics.register_stats("chat_cache", chat_cache.stats)
+metrics.register_stats("admin_cache", admin_cache.stats)
+metrics.register_stats("daily_reminders", daily_buckets.stats)
+metrics.register_stats("awoo_bursts", awoo_bursts.stats)
+metrics.register_stats("profiler", profiler.stats)
+metrics.register_stats("db", slow_queries.stats)
+
+
+def register_reminder(context: ContextTypes.DEFAULT_TYPE, reminder: db.Reminder, reminder_offset: int = 0,
+                      tz: ZoneInfo = PACIFIC_TZ):
+    # next_fire is already utc, so nothing is converted between zones here or when the job runs
     if reminder.is_daily:
-        chat = get_chat_from_db(chat_id=reminder.chat_id)
-        offset = reminder.when
-        if chat:
-            if chat.reminder_offset:
-                offset -= timedelta(minutes=chat.reminder_offset)
-        return context.job_queue.run_repeating(
-            send_daily_reminder_job,
-            interval=timedelta(days=1),
-            first=time(hour=offset.hour, minute=offset.minute, tzinfo=PACIFIC_TZ),
-            chat_id=reminder.chat_id,
-            name=reminder.name,
-            data=reminder
-        )
+        minute = daily_buckets.add(reminder, offset=reminder_offset, tz=tz, now=datetime.now(tz=timezone.utc))
+        return ensure_bucket_job(context, minute, daily_buckets.get(reminder.name).fire_at)
     else:
         return context.job_queue.run_once(
             callback=send_onetime_reminder_job,
-            when=reminder.when.astimezone(tz=PACIFIC_TZ),
+            when=reminder.next_fire,
             chat_id=reminder.chat_id,
             name=reminder.name,
             data=reminder
         )
 
 
+def schedule_if_in_window(context: ContextTypes.DEFAULT_TYPE, reminder: db.Reminder) -> bool:
+    """Queues a one-time reminder that falls before the scheduler horizon. Returns False if that failed."""
+    if not reminder_scheduler.in_window(reminder.next_fire) or context.job_queue.get_jobs_by_name(reminder.name):
+        return True
+    return bool(register_reminder(context=context, reminder=reminder))
+
+
+def ensure_bucket_job(context: ContextTypes.DEFAULT_TYPE, minute: int, fire_at: datetime):
+    """Makes sure the repeating job for a minute of day exists and will run in time for fire_at."""
+    name = f"daily_bucket_{minute}"
+    job = bucket_jobs.get(minute)
+    if job is None or job.removed:
+        job = bucket_jobs[minute] = context.job_queue.run_repeating(
+            send_daily_bucket_job,
+            interval=timedelta(days=1),
+            first=time(hour=minute // 60, minute=minute % 60, tzinfo=timezone.utc),
+            name=name,
+            data=minute
+        )
+    # fire_at is in the current minute and the bucket's run for it has already gone by
+    if fire_at.replace(second=0, microsecond=0) <= datetime.now(tz=timezone.utc):
+        context.job_queue.run_once(send_daily_bucket_job, when=fire_at, name=f"{name}_late", data=minute)
+    return job
+
+
+def remove_bucket_job(minute: int):
+    job = bucket_jobs.pop(minute, None)
+    if job is not None:
+        job.schedule_removal()
+        logging.info(f"Removing job: {job.name}")
+
+
+async def page_in_reminders_job(context: ContextTypes.DEFAULT_TYPE):
+    start, end = reminder_scheduler.advance()
+    reminders = await database.run(database.get_onetime_reminders_between, start, end)
+    reminders = [r for r in reminders if leases.owns(r.chat_id)]
+    for reminder in reminders:
+        schedule_if_in_window(context=context, reminder=reminder)
+    logging.info(f"Paged in {len(reminders)} reminder(s) due before {end}")
+
+
+async def sweep_reminders_job(context: ContextTypes.DEFAULT_TYPE):
+    """Deletes the one-time reminders that are past, for every chat in one statement."""
+    started = perf_counter()
+    before = datetime.now(tz=timezone.utc) - timedelta(minutes=SWEEP_GRACE_MINUTES)
+    swept = await database.run(database.delete_past_reminders, before)
+    # a worker can stay up for weeks, so the firing claims are trimmed here too and not just at startup
+    firings = await database.run(database.purge_firings, before - timedelta(days=FIRING_KEEP_DAYS))
+    logging.info(f"Swept {swept} past reminder(s) and {firings} old firing(s) in "
+                 f"{(perf_counter() - started) * 1000:.1f}ms")
+
+
+async def renew_leases_job(context: ContextTypes.DEFAULT_TYPE):
+    gained, lost = await database.run(leases.renew)
+    if lost:
+        for job in context.job_queue.jobs():
+            if job.chat_id is not None and leases.shard_of(job.chat_id) in lost:
+                job.schedule_removal()
+        lost_chats = [chat_id for chat_id in daily_buckets.chat_ids() if leases.shard_of(chat_id) in lost]
+        for minute in daily_buckets.remove_chats(lost_chats):
+            remove_bucket_job(minute)
+    if gained:
+        await database.run(database.update_next_fires, datetime.now(tz=timezone.utc))
+        daily_reminders = await database.run(database.get_daily_reminders)
+        onetime_reminders = await database.run(database.get_onetime_reminders_between, None, reminder_scheduler.horizon)
+        for reminder in daily_reminders:
+            if leases.shard_of(reminder.chat_id) in gained:
+                register_reminder(context=context, reminder=reminder, reminder_offset=reminder.chat.reminder_offset,
+                                  tz=get_zone(reminder.chat.time_zone))
+        for reminder in onetime_reminders:
+            if leases.shard_of(reminder.chat_id) in gained:
+                schedule_if_in_window(context=context, reminder=reminder)
+    if gained or lost:
+        logging.info(f"Gained {len(gained)} and lost {len(lost)} shard(s), {len(leases.owned)} owned")
+
+
+async def forward_unowned_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # telegram only sent this to us, so the worker that owns the chat gets it through the db
+    if update.effective_chat and not leases.owns(update.effective_chat.id):
+        await database.run(leases.forward, update.effective_chat.id, update.to_json())
+        raise ApplicationHandlerStop
+
+
+async def take_forwarded_updates_job(context: ContextTypes.DEFAULT_TYPE):
+    for payload in await database.run(leases.take_forwarded):
+        await context.application.update_queue.put(Update.de_json(json.loads(payload), context.bot))
+
+
 def remove_scheduled_job(context: ContextTypes.DEFAULT_TYPE, job_name: str):
+    if job_name in daily_buckets:
+        logging.info(f"Removing daily reminder: {job_name}")
+        remove_bucket_job(daily_buckets.remove(job_name))
+        return
     current_jobs = context.job_queue.get_jobs_by_name(job_name)
     for job in current_jobs:
         job.schedule_removal()
         logging.info(f"Removing job: {job_name}")
 
 
-def reregister_scheduled_daily_jobs(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
-    chat = get_chat_from_db(chat_id=chat_id)
+def reregister_scheduled_daily_jobs(context: ContextTypes.DEFAULT_TYPE, chat: db.Chat):
     if chat:
         for reminder in chat.daily_reminders:
             remove_scheduled_job(context=context, job_name=reminder.name)
-            register_reminder(context=context, reminder=reminder)
+            register_reminder(context=context, reminder=reminder, reminder_offset=chat.reminder_offset,
+                              tz=get_zone(chat.time_zone))
 
 
-def get_chat_from_db(chat_id: int) -> db.Chat:
-    return session.query(db.Chat).filter(db.Chat.id == chat_id).first()
+async def get_chat_zone(chat_id: int) -> ZoneInfo:
+    chat = await chat_cache.get(chat_id)
+    return get_zone(chat.time_zone if chat else None)
 
 
-def add_chat_if_not_exist(chat: Chat) -> db.Chat:
-    the_chat = get_chat_from_db(chat_id=chat.id)
-    if not the_chat:
-        title = chat.title if chat.title else f"{chat.first_name} {chat.last_name}"
-        the_chat = db.Chat(
-            chat_id=chat.id,
-            title=title,
-            time_zone="America/Los_Angeles"
-        )
-        session.add(the_chat)
-        session.commit()
-    return the_chat
+async def get_chat_from_db(chat_id: int, reminders: bool = False) -> db.Chat:
+    if reminders:
+        chat = await database.run(database.get_chat, chat_id, reminders=True)
+        return chat_cache.overlay(chat)
+    return await chat_cache.get(chat_id)
 
 
-def set_stop_armed(chat_id, armed):
-    chat = get_chat_from_db(chat_id=chat_id)
-    if chat:
-        chat.stop_armed = armed
-        session.commit()
-    return chat
+async def add_chat_if_not_exist(chat: Chat) -> db.Chat:
+    title = chat.title if chat.title else f"{chat.first_name} {chat.last_name}"
+    return await chat_cache.add_if_not_exist(chat_id=chat.id, title=title)
 
 
-def load_chats(application):
-    chats: list[db.Chat] = session.query(db.Chat).all()
-    for chat in chats:
-        logging.info(repr(chat))
-        set_stop_armed(chat_id=chat.id, armed=False)
-        context = ContextTypes.DEFAULT_TYPE(application=application, chat_id=chat.id)
-        purge_past_reminders(chat.id)
-        for reminder in chat.reminders:
-            register_reminder(context=context, reminder=reminder)
-
-
-def purge_past_reminders(chat_id: int):
-    chat = get_chat_from_db(chat_id=chat_id)
-    if chat:
-        now = datetime.now(tz=PACIFIC_TZ)
-        for reminder in chat.onetime_reminders:
-            if reminder.when.astimezone(tz=PACIFIC_TZ) < now:
-                session.delete(reminder)
-        session.commit()
+async def set_stop_armed(chat_id, armed):
+    return await chat_cache.set_stop_armed(chat_id=chat_id, armed=armed)
 
 
-async def send_daily_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    job = context.job
-    logging.info(job.name)
-    chat = get_chat_from_db(job.chat_id)
-    if chat and not job.name.endswith("_delayed"):
-        if chat.reminder_offset:
-            offset = timedelta(
-                minutes=randrange(0, chat.reminder_offset * 2),
-                seconds=randrange(0, 60)
-            )
-            delayed = datetime.now(tz=PACIFIC_TZ) + offset
-            logging.info(f"Delaying job until: {delayed}")
-            return context.job_queue.run_once(
-                callback=send_daily_reminder_job,
-                when=delayed,
-                chat_id=job.chat_id,
-                name=job.name + "_delayed",
-                data=job.data
-            )
-    message = generate_message(data)
-    logging.info(f"Sending message via job: {message} at {get_current_time_string()}")
-    return await context.bot.send_message(chat_id=job.chat_id, text=message)
+async def flush_chat_cache(context: ContextTypes.DEFAULT_TYPE):
+    await chat_cache.flush()
+
+
+async def refresh_data_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if await word_data.refresh():
+            logging.info("Updated word data from the Google Sheet")
+    except Exception as e:
+        logging.info(f"Failed refreshing word data with the following error: {str(e)}")
+
+
+async def report_data_update(chat_id: int):
+    try:
+        changed = await word_data.refresh()
+    except Exception as e:
+        logging.info(f"Failed refreshing word data with the following error: {str(e)}")
+        return outbox.send_message(chat_id=chat_id, text=msg["err_update_failed"])
+    return outbox.send_message(chat_id=chat_id, text=msg["cmd_update"] if changed else msg["cmd_update_unchanged"])
+
+
+async def post_init(application):
+    outbox.start(application.bot)
+    awoo_bursts.on_burst = send_burst_reply
+    if METRICS_PORT:
+        await metrics_server.start()
+    profiler.add_signal_handlers(asyncio.get_running_loop())
+    if not word_data.load_snapshot():
+        # nothing to fall back on, so this first fetch has to finish before polling starts
+        await word_data.refresh()
+
+
+async def post_stop(application):
+    # the bot's connection is closed by the time post_shutdown runs, so queued messages go out here
+    await outbox.stop()
+
+
+async def post_shutdown(application):
+    await metrics_server.stop()
+    await chat_cache.flush()
+    # lets the other workers take over right away instead of waiting out the leases
+    await database.run(leases.release)
+
+
+def load_chats(application):
+    # runs before the event loop starts, so the db calls can stay synchronous
+    now = datetime.now(tz=PACIFIC_TZ)
+    database.run_sync(leases.renew)
+    with database.session_scope() as session:
+        disarmed = database.disarm_all_chats(session)
+        database.update_next_fires(session, now)
+        purged = database.delete_past_reminders(session, now)
+        database.purge_firings(session, now - timedelta(days=FIRING_KEEP_DAYS))
+        daily_reminders = [r for r in database.get_daily_reminders(session) if leases.owns(r.chat_id)]
+    logging.info(f"Disarmed {disarmed} chat(s), purged {purged} past reminder(s)")
+    context = ContextTypes.DEFAULT_TYPE(application=application)
+    for reminder in daily_reminders:
+        register_reminder(context=context, reminder=reminder, reminder_offset=reminder.chat.reminder_offset,
+                          tz=get_zone(reminder.chat.time_zone))
+    # one-time reminders past the horizon are left in the db for page_in_reminders_job
+    start, end = reminder_scheduler.advance(now)
+    reminders = database.run_sync(database.get_onetime_reminders_between, start, end)
+    reminders = [r for r in reminders if leases.owns(r.chat_id)]
+    for reminder in reminders:
+        schedule_if_in_window(context=context, reminder=reminder)
+    logging.info(f"Scheduled {len(daily_reminders)} daily and {len(reminders)} one-time reminder(s)")
+
+
+async def send_daily_bucket_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends every daily reminder filed under this minute that's due today."""
+    now = datetime.now(tz=timezone.utc)
+    due = daily_buckets.pop_due(context.job.data, now)
+    # keyed on the instant, two firings can share a utc date when the clocks go forward
+    firings = [(entry.reminder.name, database.firing_key(entry.reminder.next_fire)) for entry in due]
+    # tomorrow's instants are worked out and filed before anything goes out, each may land in another bucket
+    for entry in due:
+        entry.reminder.schedule_next(entry.tz, after=max(entry.reminder.next_fire, now))
+        minute = daily_buckets.add(entry.reminder, offset=entry.offset, tz=entry.tz, now=now)
+        ensure_bucket_job(context, minute, daily_buckets.get(entry.reminder.name).fire_at)
+    if context.job.data not in daily_buckets.minutes():
+        remove_bucket_job(context.job.data)
+    if not due:
+        return
+    await database.run(database.set_next_fires, [(entry.reminder.id, entry.reminder.next_fire) for entry in due])
+    claimed = await database.run(leases.claim_all, firings)
+    for entry, firing in zip(due, firings):
+        if firing not in claimed:
+            logging.info(f"Skipping {entry.reminder.name}, another worker already sent this firing")
+            continue
+        message = generate_message(word_data.data, entry.tz)
+        logging.info(f"Sending message via job: {message} at {get_current_time_string()}")
+        outbox.send_message(chat_id=entry.reminder.chat_id, text=message, priority=PRIORITY_SCHEDULED)
+    logging.info(f"Sent {len(claimed)} daily reminder(s) for minute {context.job.data}")
 
 
 async def send_onetime_reminder_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     job = context.job
+    # deleting the row is the claim, if it's already gone another worker sent it or it was removed
+    if not await database.run(database.delete_reminder, job.data.id):
+        return
     try:
         reminder: db.Reminder = job.data
         from_user = reminder.from_user if reminder.from_user != reminder.target_user else "You"
-        message = f"""{choice(data['words']['greeting']).replace('%tod%',get_time_of_day())}
+        tod = get_time_of_day(await get_chat_zone(job.chat_id))
+        message = f"""{choice(word_data.data['words']['greeting']).replace('%tod%',tod)}
  @{reminder.target_user}! {from_user} asked me to remind you {reminder.subject}."""
-        return await context.bot.send_message(chat_id=job.chat_id, text=message)
+        return outbox.send_message(chat_id=job.chat_id, text=message, priority=PRIORITY_SCHEDULED)
     except Exception as e:
         logging.info(f"""Failed sending job: {job.name} at {get_current_time_string()} with the following error: {str(e)}""")
-    finally:
-        session.delete(reminder)
-        session.commit()
 
 
 async def awoo_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.is_bot:
         return
-    return await context.bot.send_message(
+    chat = await chat_cache.get(update.effective_chat.id)
+    if not awoo_bursts.hit(update.effective_chat.id, update.message.id,
+                           chat.awoo_window if chat else None, chat.awoo_cap if chat else None):
+        return
+    return outbox.send_message(
         chat_id=update.effective_chat.id,
-        text=choice(data["words"]["awoo"]),
+        text=choice(word_data.data["words"]["awoo"]),
         reply_to_message_id=update.message.id
     )
 
 
+async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sorts a plain text message in one pass: awoos, mentions and the chat's trigger words get a howl back."""
+    chat = await chat_cache.get(update.effective_chat.id)
+    trigger_words = get_trigger_words(chat.trigger_words if chat else None)
+    if classify_message(update.effective_message.text, trigger_words) == "chatter":
+        return await parse_all_messages(update, context)
+    return await awoo_reply(update, context)
+
+
+def send_burst_reply(chat_id: int, howls: int, message_id: int):
+    """The one reply for the awoos held back during a chat's window, a howl for each up to the cap."""
+    return outbox.send_message(
+        chat_id=chat_id,
+        text=" ".join(choice(word_data.data["words"]["awoo"]) for _ in range(howls)),
+        reply_to_message_id=message_id
+    )
+
+
 async def get_message_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    message = generate_message(data)
+    message = generate_message(word_data.data, await get_chat_zone(update.effective_chat.id))
     logging.info(f"Sending message: {message} at {get_current_time_string()}")
-    return await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
+    return outbox.send_message(chat_id=update.effective_chat.id, text=message)
+
+
+async def reminder_page(chat_id: int, after_id: int = None, before_id: int = None,
+                        page: int = 1) -> tuple[str, InlineKeyboardMarkup]:
+    """The text and paging buttons for a page of /list, (None, None) when the chat has no reminders."""
+    chat = await chat_cache.get(chat_id)
+    if not chat:
+        return None, None
+    reminders, has_before, has_after = await database.run(database.get_reminder_page, chat_id, after_id, before_id,
+                                                          now=get_now(get_zone(chat.time_zone)))
+    if not reminders:
+        return None, None
+    page = page if has_before else 1
+    daily = [reminder for reminder in reminders if reminder.is_daily]
+    onetime = [reminder for reminder in reminders if not reminder.is_daily]
+    lines = []
+    if daily:
+        minutes_str = "minute" if chat.reminder_offset == 1 else "minutes"
+        lines.append("This chat has the following daily reminder messages set{}:".format(
+            f" (with an offset of +/- {chat.reminder_offset} {minutes_str})" if chat.reminder_offset else ""
+        ))
+        lines += [reminder.format_string()[:LIST_LINE_LENGTH] for reminder in daily]
+    if onetime:
+        if lines:
+            lines.append("")
+        lines.append("This chat has the following one-time reminders set:")
+        lines += [reminder.format_string()[:LIST_LINE_LENGTH] for reminder in onetime]
+    buttons = []
+    if has_before:
+        buttons.append(InlineKeyboardButton("« Back", callback_data=f"list:before:{reminders[0].id}:{page - 1}"))
+    if has_after:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"list:after:{reminders[-1].id}:{page + 1}"))
+    if not buttons:
+        return "\n".join(lines), None
+    lines += ["", f"Page {page}"]
+    return "\n".join(lines), InlineKeyboardMarkup([buttons])
 
 
 async def list_reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    chat: db.Chat = session.query(db.Chat).filter(db.Chat.id == chat_id).first()
-    purge_past_reminders(chat_id)
-    if chat:
-        reminders_list_msg = ""
-        if chat.daily_reminders:
-            minutes_str = "minute" if chat.reminder_offset == 1 else "minutes"
-            reminders_list_msg += "This chat has the following daily reminder messages set{}:\n".format(
-                f" (with an offset of +/- {chat.reminder_offset} {minutes_str})" if chat.reminder_offset else ""
-            )
-            for reminder in sorted(chat.daily_reminders):
-                reminders_list_msg += reminder.format_string() + "\n"
-        if chat.onetime_reminders:
-            if reminders_list_msg:
-                reminders_list_msg += "\n"
-            reminders_list_msg += "This chat has the following one-time reminders set:\n"
-            for reminder in sorted(chat.onetime_reminders):
-                reminders_list_msg += reminder.format_string() + "\n"
-        if chat.reminders:
-            return await context.bot.send_message(chat_id=chat_id, text=reminders_list_msg)
-    return await context.bot.send_message(chat_id=chat_id, text=msg["err_no_reminders"])
+    text, keyboard = await reminder_page(chat_id)
+    if text:
+        return outbox.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
+    return outbox.send_message(chat_id=chat_id, text=msg["err_no_reminders"])
+
+
+async def list_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, direction, reminder_id, page = query.data.split(":")
+    text, keyboard = await reminder_page(query.message.chat_id, page=int(page),
+                                         **{f"{direction}_id": int(reminder_id)})
+    await query.answer()
+    return outbox.edit_message_text(chat_id=query.message.chat_id, message_id=query.message.message_id,
+                                    text=text or msg["err_no_reminders"], reply_markup=keyboard)
 
 
 async def set_random_offset(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     if not await is_user_chat_admin(update=update):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
     if context.args:
         try:
             offset = int(context.args[0])
             if 0 <= offset <= 60:
-                chat = add_chat_if_not_exist(update.effective_chat)
+                chat = await add_chat_if_not_exist(update.effective_chat)
                 if offset == chat.reminder_offset:
-                    return await context.bot.send_message(chat_id=chat_id, text=msg["err_set_random_same"])
-                chat.reminder_offset = offset
-                session.commit()
-                reregister_scheduled_daily_jobs(context=context, chat_id=chat_id)
+                    return outbox.send_message(chat_id=chat_id, text=msg["err_set_random_same"])
+                chat = await chat_cache.set_reminder_offset(chat_id, offset)
+                reregister_scheduled_daily_jobs(context=context, chat=chat)
                 if offset > 0:
                     msg_text = str(msg["cmd_set_random_set"]).format(offset)
                 else:
                     msg_text = msg["cmd_set_random_removed"]
-                return await context.bot.send_message(chat_id=chat_id, text=msg_text)
+                return outbox.send_message(chat_id=chat_id, text=msg_text)
         except Exception:
             pass
-    return await context.bot.send_message(chat_id=chat_id, text=msg["err_set_random"])
+    return outbox.send_message(chat_id=chat_id, text=msg["err_set_random"])
+
+
+async def trigger_words_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    chat = await add_chat_if_not_exist(update.effective_chat)
+    if not context.args:
+        if chat.trigger_words:
+            return outbox.send_message(chat_id=chat_id, text=msg["cmd_trigger_words_current"].format(chat.trigger_words))
+        return outbox.send_message(chat_id=chat_id, text=msg["cmd_trigger_words_none"])
+    if not await is_user_chat_admin(update=update):
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+    if [arg.lower() for arg in context.args] == ["none"]:
+        await chat_cache.set_trigger_words(chat_id, None)
+        return outbox.send_message(chat_id=chat_id, text=msg["cmd_trigger_words_cleared"])
+    # kept in the order given, without repeats
+    words = list(dict.fromkeys(word.lower() for word in re.findall(r"\w+", " ".join(context.args))))
+    if len(words) > MAX_TRIGGER_WORDS:
+        return outbox.send_message(chat_id=chat_id, text=msg["err_trigger_words_too_many"].format(MAX_TRIGGER_WORDS))
+    await chat_cache.set_trigger_words(chat_id, " ".join(words) or None)
+    return outbox.send_message(chat_id=chat_id, text=msg["cmd_trigger_words_set"].format(" ".join(words)))
+
+
+async def awoo_window_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    chat = await add_chat_if_not_exist(update.effective_chat)
+    if not context.args:
+        window = AWOO_WINDOW_SECONDS if chat.awoo_window is None else chat.awoo_window
+        cap = AWOO_BURST_CAP if chat.awoo_cap is None else chat.awoo_cap
+        if not window:
+            return outbox.send_message(chat_id=chat_id, text=msg["cmd_awoo_window_off"])
+        return outbox.send_message(chat_id=chat_id, text=msg["cmd_awoo_window_current"].format(window, cap))
+    if not await is_user_chat_admin(update=update):
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+    try:
+        window = int(context.args[0])
+        cap = int(context.args[1]) if len(context.args) > 1 else chat.awoo_cap
+    except ValueError:
+        window = -1
+    if not 0 <= window <= MAX_AWOO_WINDOW_SECONDS or (cap is not None and not 1 <= cap <= MAX_AWOO_BURST_CAP):
+        return outbox.send_message(chat_id=chat_id, text=msg["err_awoo_window"].format(
+            MAX_AWOO_WINDOW_SECONDS, MAX_AWOO_BURST_CAP))
+    await chat_cache.set_awoo_burst(chat_id, window, cap)
+    if not window:
+        return outbox.send_message(chat_id=chat_id, text=msg["cmd_awoo_window_off"])
+    cap = AWOO_BURST_CAP if cap is None else cap
+    return outbox.send_message(chat_id=chat_id, text=msg["cmd_awoo_window_set"].format(window, cap))
+
+
+async def set_time_zone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    chat = await add_chat_if_not_exist(update.effective_chat)
+    if not context.args:
+        return outbox.send_message(chat_id=chat_id, text=msg["cmd_time_zone_current"].format(chat.time_zone))
+    if not await is_user_chat_admin(update=update):
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+    tz = get_zone(context.args[0], default=None)
+    if not tz:
+        return outbox.send_message(chat_id=chat_id, text=msg["err_time_zone"])
+    chat = await get_chat_from_db(chat_id, reminders=True)
+    for reminder in chat.reminders:
+        remove_scheduled_job(context=context, job_name=reminder.name)
+    chat = await chat_cache.set_time_zone(chat_id, tz.key)
+    for reminder in chat.daily_reminders:
+        register_reminder(context=context, reminder=reminder, reminder_offset=chat.reminder_offset, tz=tz)
+    for reminder in chat.onetime_reminders:
+        schedule_if_in_window(context=context, reminder=reminder)
+    return outbox.send_message(chat_id=chat_id, text=msg["cmd_time_zone_set"].format(tz.key))
 
 
 async def set_daily_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     if not await is_user_chat_admin(update=update):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
     if context.args:
-        parsed_time = parse_time(time_string=' '.join(context.args))
+        chat = await add_chat_if_not_exist(update.effective_chat)
+        parsed_time = parse_time(time_string=' '.join(context.args), now=get_now(get_zone(chat.time_zone)))
         if parsed_time:
-            add_chat_if_not_exist(update.effective_chat)
             reminder = db.Reminder(
                 chat_id=chat_id,
                 when=parsed_time,
                 from_user=update.effective_user.username
             )
-            job_exists_db = session.query(db.Reminder).filter(db.Reminder.name == reminder.name).first()
-            job_exists_queue = context.job_queue.get_jobs_by_name(reminder.name)
+            job_exists_db = await database.run(database.get_reminder_by_name, reminder.name)
+            job_exists_queue = reminder.name in daily_buckets
             if not job_exists_db and not job_exists_queue:
-                job = register_reminder(context=context, reminder=reminder)
+                job = register_reminder(context=context, reminder=reminder, reminder_offset=chat.reminder_offset,
+                                        tz=get_zone(chat.time_zone))
                 if job:
-                    session.add(reminder)
-                    session.commit()
-                    return await context.bot.send_message(chat_id=chat_id, text=msg["cmd_set_daily_succcess"])
+                    await database.run(database.add_reminder, reminder)
+                    return outbox.send_message(chat_id=chat_id, text=msg["cmd_set_daily_succcess"])
                 else:
-                    return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_schedule_jobs"])
+                    return outbox.send_message(chat_id=chat_id, text=msg["err_cant_schedule_jobs"])
             else:
-                return await context.bot.send_message(chat_id=chat_id, text=msg["err_already_exists"])
-    return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_parse_time"])
+                return outbox.send_message(chat_id=chat_id, text=msg["err_already_exists"])
+    return outbox.send_message(chat_id=chat_id, text=msg["err_cant_parse_time"])
 
 
 async def stop_daily_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     if not await is_user_chat_admin(update=update):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
     if context.args:
-        parsed_time = parse_time(time_string=' '.join(context.args))
+        parsed_time = parse_time(time_string=' '.join(context.args), now=get_now(await get_chat_zone(chat_id)))
         if parsed_time:
             reminder = db.Reminder(
                 chat_id=chat_id,
                 when=parsed_time,
                 from_user=update.effective_user.username
             )
-            job_exists_queue = context.job_queue.get_jobs_by_name(reminder.name)
-            job_exists_db = session.query(db.Reminder).filter(db.Reminder.name == reminder.name).first()
-            if job_exists_queue:
-                job = job_exists_queue[0]
-                job.schedule_removal()
-                logging.info(f"Removing job: {reminder.name}")
-                if job_exists_db:
-                    session.delete(job_exists_db)
-                    session.commit()
-                return await context.bot.send_message(chat_id=chat_id, text=msg["cmd_stop_daily_success"])
+            if reminder.name in daily_buckets:
+                remove_scheduled_job(context=context, job_name=reminder.name)
+                await database.run(database.delete_reminder_by_name, reminder.name)
+                return outbox.send_message(chat_id=chat_id, text=msg["cmd_stop_daily_success"])
             else:
-                return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_find_reminder"])
-    return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_parse_time"])
+                return outbox.send_message(chat_id=chat_id, text=msg["err_cant_find_reminder"])
+    return outbox.send_message(chat_id=chat_id, text=msg["err_cant_parse_time"])
 
 
 async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     if len(context.args) < 4:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_reminder_need_at"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_reminder_need_at"])
 
-    now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+    chat = await add_chat_if_not_exist(update.effective_chat)
+    now = get_now(get_zone(chat.time_zone))
     reminder = parse_reminder(
         chat_id=chat_id,
         from_user=update.effective_user.username,
-        args=context.args
+        args=context.args,
+        now=now
     )
 
     if not reminder:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_reminder_need_at"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_reminder_need_at"])
     if not reminder.subject:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_reminder_no_subject"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_reminder_no_subject"])
     elif reminder.when < now:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_reminder_in_past"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_reminder_in_past"])
     elif reminder.when > now + timedelta(days=365):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_reminder_too_far_out"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_reminder_too_far_out"])
     elif reminder.when - now < timedelta(minutes=1):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_reminder_too_close"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_reminder_too_close"])
 
-    add_chat_if_not_exist(update.effective_chat)
-    job_exists = session.query(db.Reminder).filter(db.Reminder.name == reminder.name).first()
+    job_exists = await database.run(database.get_reminder_by_name, reminder.name)
     if not job_exists:
-        job = register_reminder(context=context, reminder=reminder)
-        if job:
-            session.add(reminder)
-            session.commit()
-            return await context.bot.send_message(
+        # saved first so a page-in running meanwhile can't miss it, then queued only if it's due soon
+        await database.run(database.add_reminder, reminder)
+        if schedule_if_in_window(context=context, reminder=reminder):
+            return outbox.send_message(
                 chat_id=chat_id,
                 text="I've set your reminder!\n{}\n{}".format(
                     reminder.format_string(),
@@ -310,24 +606,25 @@ async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
             )
         else:
-            return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_schedule_jobs"])
+            await database.run(database.delete_reminder, reminder.id)
+            return outbox.send_message(chat_id=chat_id, text=msg["err_cant_schedule_jobs"])
     else:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_already_exists"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_already_exists"])
 
 
 # [ ] remove_reminder_command
 async def remove_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    chat: db.Chat = session.query(db.Chat).filter(db.Chat.id == chat_id).first()
+    chat: db.Chat = await chat_cache.get(chat_id)
     username = update.effective_user.username.lower()
     delete_arg_index, delete_reminder_num = (-1, -1)
-    reminders_to_show: list[db.Reminder] = []
-    user_is_admin = await is_user_chat_admin(update=update)
-    num_possible_matched_reminders = 0
+    t = None
     if not chat:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_chat_not_in_db"])
-    if not chat.reminders:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_no_reminders"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_chat_not_in_db"])
+    counts = await database.run(database.count_reminders, chat_id)
+    if not counts:
+        return outbox.send_message(chat_id=chat_id, text=msg["err_no_reminders"])
+    user_is_admin = await is_user_chat_admin(update=update)
     if context.args:
         for index, arg in enumerate(context.args):
             if arg.startswith("#"):
@@ -347,45 +644,44 @@ async def remove_reminder_command(update: Update, context: ContextTypes.DEFAULT_
                 except Exception:
                     pass
             if delete_reminder_num == -1:
-                return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_remove_reminder"])
-        t = parse_time(" ".join(time_args))
+                return outbox.send_message(chat_id=chat_id, text=msg["err_cant_remove_reminder"])
+        t = parse_time(" ".join(time_args), now=get_now(get_zone(chat.time_zone)))
         if not t and delete_arg_index == -1:
-            return await context.bot.send_message(
+            return outbox.send_message(
                 chat_id=chat_id,
                 text=msg["err_cant_parse_time"]
             )
+    # a #n without a time that parses picks from all of the chat's reminders
+    minute = t.hour * 60 + t.minute if t else None
 
-    for reminder in chat.onetime_reminders:
-        time_match = False if 't' not in locals() else reminder.when.hour == t.hour and reminder.when.minute == t.minute
-        delete_but_not_time_is_set = delete_arg_index != -1 and not t
-        if not context.args or delete_but_not_time_is_set or time_match:
-            num_possible_matched_reminders += 1
-            if username == reminder.from_user.lower() or username == reminder.target_user.lower() or user_is_admin:
-                reminders_to_show.append(reminder)
+    if delete_reminder_num != -1:
+        reminder = await database.run(database.get_removable_reminder, chat_id, username, user_is_admin,
+                                      delete_reminder_num, minute)
+        if reminder:
+            remove_scheduled_job(context=context, job_name=reminder.name)
+            await database.run(database.delete_reminder, reminder.id)
+            return outbox.send_message(
+                chat_id=chat_id, text=f"Removing reminder #{delete_reminder_num}: " + reminder.format_string())
 
+    num_possible_matched_reminders, reminders_to_show = await database.run(
+        database.get_removable_reminders, chat_id, username, user_is_admin, minute)
     if not reminders_to_show and num_possible_matched_reminders == 0 and not user_is_admin:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_remove_permissions"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_remove_permissions"])
 
-    if reminders_to_show or (user_is_admin and chat.daily_reminders):
+    if reminders_to_show or (user_is_admin and counts.get(True)):
+        if delete_reminder_num != -1:
+            return outbox.send_message(chat_id=chat_id, text=msg["err_cant_remove_reminder"])
         reminders_msg = "You have access to remove the following reminders{}:\n".format(
             ' that match your search' if context.args else ''
         )
         args = ' '.join(context.args)
-        for i, reminder in enumerate(sorted(reminders_to_show)):
+        for i, reminder in enumerate(reminders_to_show):
             n = i + 1
             reminder_str = f"#{n}: " + reminder.format_string()
             delete_str = f"``` /removereminder {(args + ' ') if args else ''}#{n}```"
             reminders_msg += reminder_str + delete_str
-            if n == delete_reminder_num and delete_reminder_num != -1:
-                remove_scheduled_job(context=context, job_name=reminder.name)
-                session.delete(reminder)
-                session.commit()
-                return await context.bot.send_message(chat_id=chat_id, text=f"Removing reminder {reminder_str}")
-        if delete_reminder_num == -1:
-            return await context.bot.send_message(chat_id=chat_id, text=reminders_msg, parse_mode="markdown")
-        else:
-            return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_remove_reminder"])
-    return await context.bot.send_message(chat_id=chat_id, text=msg["err_cant_find_reminder"])
+        return outbox.send_message(chat_id=chat_id, text=reminders_msg, parse_mode="markdown")
+    return outbox.send_message(chat_id=chat_id, text=msg["err_cant_find_reminder"])
 
 
 async def remind_me_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -394,7 +690,7 @@ async def remind_me_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def remind_examples_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    return await context.bot.send_message(
+    return outbox.send_message(
         chat_id=update.effective_chat.id,
         text=msg["cmd_remind_examples"],
         parse_mode="markdown"
@@ -403,72 +699,96 @@ async def remind_examples_command(update: Update, context: ContextTypes.DEFAULT_
 
 async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_user_chat_admin(update=update):
-        return await context.bot.send_message(chat_id=update.effective_chat.id, text=msg["err_admin_required"])
-    global data
-    data = get_data_from_google()
-    return await context.bot.send_message(chat_id=update.effective_chat.id, text=msg["cmd_update"])
+        return outbox.send_message(chat_id=update.effective_chat.id, text=msg["err_admin_required"])
+    context.application.create_task(report_data_update(update.effective_chat.id))
+    return outbox.send_message(chat_id=update.effective_chat.id, text=msg["cmd_update_started"])
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    return await context.bot.send_message(chat_id=update.effective_chat.id, text=msg["cmd_help"])
+    return outbox.send_message(chat_id=update.effective_chat.id, text=msg["cmd_help"])
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_message.chat_id
-    add_chat_if_not_exist(update.effective_message.chat)
-    return await context.bot.send_message(chat_id=chat_id, text=msg["cmd_start"])
+    await add_chat_if_not_exist(update.effective_message.chat)
+    return outbox.send_message(chat_id=chat_id, text=msg["cmd_start"])
 
 
 async def stop_all_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_message.chat_id
     if not await is_user_chat_admin(update=update):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_admin_required"])
-    chat: db.Chat = session.query(db.Chat).filter(db.Chat.id == chat_id).first()
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+    chat: db.Chat = await set_stop_armed(chat_id=chat_id, armed=True)
     if chat:
-        set_stop_armed(chat_id=chat_id, armed=True)
-        return await context.bot.send_message(chat_id=chat_id, text=msg["cmd_stop"])
+        return outbox.send_message(chat_id=chat_id, text=msg["cmd_stop"])
     else:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_chat_not_in_db"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_chat_not_in_db"])
 
 
 async def stop_confirm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_message.chat_id
     if not await is_user_chat_admin(update=update):
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_admin_required"])
-    chat: db.Chat = session.query(db.Chat).filter(db.Chat.id == chat_id).first()
+        return outbox.send_message(chat_id=chat_id, text=msg["err_admin_required"])
+    chat: db.Chat = await get_chat_from_db(chat_id)
     if chat:
         if chat.stop_armed:
-            session.delete(chat)
-            session.commit()
-            return await context.bot.send_message(chat_id=chat_id, text=msg["cmd_stop_confirm"])
+            await chat_cache.delete(chat_id)
+            awoo_bursts.forget(chat_id)
+            for minute in daily_buckets.remove_chats([chat_id]):
+                remove_bucket_job(minute)
+            return outbox.send_message(chat_id=chat_id, text=msg["cmd_stop_confirm"])
         else:
-            return await context.bot.send_message(chat_id=chat_id, text=msg["err_stop_not_armed"])
+            return outbox.send_message(chat_id=chat_id, text=msg["err_stop_not_armed"])
     else:
-        return await context.bot.send_message(chat_id=chat_id, text=msg["err_chat_not_in_db"])
+        return outbox.send_message(chat_id=chat_id, text=msg["err_chat_not_in_db"])
 
 
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    return await context.bot.send_message(chat_id=update.effective_chat.id, text=msg["cmd_unknown"])
+    return outbox.send_message(chat_id=update.effective_chat.id, text=msg["cmd_unknown"])
+
+
+async def chat_member_updated(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # someone was promoted, demoted, joined or left, the cached admin list may be wrong now
+    admin_cache.invalidate(update.effective_chat.id)
 
 
 async def parse_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    set_stop_armed(chat_id=update.effective_message.chat_id, armed=False)
+    await set_stop_armed(chat_id=update.effective_message.chat_id, armed=False)
     if update.effective_user.is_bot:
         return
 
 
 if __name__ == '__main__':
-    data = get_data_from_google()
     db.init_db()
+    metrics.instrument_db()
+    slow_queries.install(db.engine)
     token = get_token()
-    application = ApplicationBuilder().token(token).build()
+    application = (ApplicationBuilder().token(token).base_url(BOT_API_URL).job_queue(metrics.InstrumentedJobQueue())
+                   .concurrent_updates(CONCURRENT_UPDATES).post_init(post_init).post_stop(post_stop)
+                   .post_shutdown(post_shutdown).build())
     load_chats(application)
+    application.job_queue.run_repeating(flush_chat_cache, interval=CHAT_CACHE_FLUSH_SECONDS)
+    application.job_queue.run_repeating(page_in_reminders_job, interval=timedelta(minutes=REMINDER_PAGE_MINUTES))
+    application.job_queue.run_repeating(sweep_reminders_job, interval=timedelta(minutes=SWEEP_MINUTES))
+    application.job_queue.run_repeating(refresh_data_job, interval=timedelta(minutes=DATA_REFRESH_MINUTES), first=1)
+    if leases.enabled:
+        if UPDATE_MODE == "polling":
+            logging.info("Polling for every worker, the others should run with AWOO_UPDATE_MODE=forwarded")
+        application.job_queue.run_repeating(renew_leases_job, interval=LEASE_RENEW_SECONDS)
+        application.job_queue.run_repeating(take_forwarded_updates_job, interval=FORWARD_POLL_SECONDS)
+        # apscheduler logs every run, twice a second would bury everything else
+        logging.getLogger("apscheduler.executors.default").setLevel(logging.WARNING)
+        application.add_handler(TypeHandler(Update, forward_unowned_updates), group=-1)
 
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('getmessage', get_message_command))
     application.add_handler(CommandHandler(['list', 'listdaily', 'listreminders'], list_reminders_command))
+    application.add_handler(CallbackQueryHandler(list_page_callback, pattern=r"^list:(after|before):\d+:\d+$"))
     application.add_handler(CommandHandler(['set', 'setdaily', 'setdailyreminder'], set_daily_reminder_command))
     application.add_handler(CommandHandler(['setrandom', 'setoffset'], set_random_offset))
+    application.add_handler(CommandHandler(['timezone', 'settimezone'], set_time_zone_command))
+    application.add_handler(CommandHandler(['triggerwords', 'triggers'], trigger_words_command))
+    application.add_handler(CommandHandler(['awoowindow', 'setawoowindow'], awoo_window_command))
     application.add_handler(CommandHandler(['stopdaily', 'stopreminder', 'stopdailyreminder'], stop_daily_reminder_command))
     application.add_handler(CommandHandler('remind', remind_command))
     application.add_handler(CommandHandler('remindme', remind_me_command))
@@ -478,9 +798,16 @@ if __name__ == '__main__':
     application.add_handler(CommandHandler('stopall', stop_all_command))
     application.add_handler(CommandHandler('stopconfirm', stop_confirm_command))
     application.add_handler(CommandHandler('update', update_command))
-    application.add_handler(MessageHandler(filters.Regex(re.compile(AWOO_PATTERN, re.I)), awoo_reply))
-    application.add_handler(MessageHandler(filters.Regex(re.compile(BOT_NAME, re.I)), awoo_reply))
-    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), parse_all_messages))
+    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), route_message))
     application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
-
-    application.run_polling()
+    application.add_handler(ChatMemberHandler(chat_member_updated, ChatMemberHandler.ANY_CHAT_MEMBER))
+    profiler.instrument(application)
+    metrics.instrument_handlers(application)
+
+    # chat_member updates are only sent when asked for explicitly
+    if UPDATE_MODE == "webhook":
+        run_webhook(application, allowed_updates=Update.ALL_TYPES)
+    elif UPDATE_MODE == "forwarded":
+        run_forwarded(application)
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
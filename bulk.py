@@ -0,0 +1,272 @@
+# bulk import and export of chats and reminders. imports read the legacy
+# chats.json, one object keyed by chat id with each chat's daily_reminders and
+# onetime_reminders, or a json lines dump as written by export. either is read
+# a record at a time and written in executemany batches, one transaction each.
+# the number of records done from FILE is saved in the import_progress table in
+# the same transaction as each batch, so an interrupted import carries on right
+# after the last batch that made it in and running it again adds nothing.
+# loading into an empty reminder table drops its indexes until the end, when
+# they're built once, which is much faster than keeping them up to date.
+# usage: python bulk.py import FILE [--format legacy|jsonl] [--batch 20000] [--restart]
+#        python bulk.py export FILE [--batch 20000]
+import argparse
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Iterator
+
+import database
+import models as db
+from constants import DAILY, ONETIME, PACIFIC_TZ
+from functions import get_zone
+
+BATCH_SIZE = 20000
+CHUNK_SIZE = 1 << 16
+CHAT_FIELDS = ("title", "time_zone", "stop_armed", "reminder_offset", "trigger_words", "awoo_window", "awoo_cap")
+
+
+class JsonStream:
+    """Decodes json values one at a time off a text file, only holding the one being read."""
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        # at least doubles what's held, so one big value is decoded a linear number of times
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character that isn't whitespace, "" at the end of the file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number or literal could carry on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_legacy_chats(f, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple[str, dict]]:
+    """(chat_id, chat) pairs from a legacy chats.json, one chat in memory at a time."""
+    stream = JsonStream(f, chunk_size)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        chat_id = stream.value()
+        stream.expect(":")
+        yield chat_id, stream.value()
+        if stream.expect(",}") == "}":
+            return
+
+
+def reminder_row(chat_id: int, when: datetime, from_user: str, target_user: str = None, subject: str = None,
+                 tz=PACIFIC_TZ, next_fire: datetime = None, now: datetime = None) -> dict:
+    """A complete reminder row, the same as a db.Reminder would save without building one."""
+    is_daily = not target_user and not subject
+    when = when if when.tzinfo else when.replace(tzinfo=tz)
+    return {
+        "chat_id": chat_id,
+        "name": db.job_name(chat_id, when, from_user, is_daily),
+        "when": when,
+        "next_fire": next_fire or db.next_fire_time(when, is_daily, tz, now),
+        "from_user": from_user,
+        "is_daily": is_daily,
+        "target_user": target_user,
+        "subject": subject,
+        "minute_of_day": when.hour * 60 + when.minute,
+        "from_user_lower": from_user.lower() if from_user else None,
+        "target_user_lower": target_user.lower() if target_user else None,
+    }
+
+
+def parse_when(value, tz, now: datetime) -> datetime:
+    """A legacy time, either "HH:MM" for today or an iso datetime, as wall time in tz."""
+    if isinstance(value, dict):
+        value = value.get("when") or value.get("time")
+    if len(value) <= 5:
+        hour, minute = value.split(":")
+        return now.astimezone(tz).replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+    when = datetime.fromisoformat(value)
+    return when.astimezone(tz) if when.tzinfo else when.replace(tzinfo=tz)
+
+
+def legacy_records(chat_id, chat: dict, now: datetime) -> Iterator[tuple[str, dict]]:
+    chat_id = int(chat_id)
+    tz = get_zone(chat.get("time_zone"))
+    yield "chat", {"id": chat_id, "title": chat.get("title"), "time_zone": tz.key, "stop_armed": False,
+                   "reminder_offset": int(chat.get("reminder_offset") or 0), "trigger_words": None,
+                   "awoo_window": None, "awoo_cap": None}
+    daily = chat.get(DAILY) or []
+    for entry in daily.values() if isinstance(daily, dict) else daily:
+        from_user = entry.get("from_user", "import") if isinstance(entry, dict) else "import"
+        yield "reminder", reminder_row(chat_id, parse_when(entry, tz, now), from_user, tz=tz, now=now)
+    for entry in chat.get(ONETIME) or []:
+        yield "reminder", reminder_row(chat_id, parse_when(entry, tz, now), entry.get("from_user"),
+                                       entry.get("target_user"), entry.get("subject"), tz=tz, now=now)
+
+
+def jsonl_records(f, now: datetime) -> Iterator[tuple[str, dict]]:
+    # zones of the chats read so far, for reminders saved without a next_fire
+    zones: dict[int, object] = {}
+    for line in f:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        kind = record.pop("type")
+        if kind == "chat":
+            chat = {"id": int(record["id"])} | {field: record.get(field) for field in CHAT_FIELDS}
+            chat["stop_armed"] = bool(chat["stop_armed"])
+            chat["reminder_offset"] = chat["reminder_offset"] or 0
+            zones[chat["id"]] = get_zone(chat["time_zone"])
+            yield "chat", chat
+        elif kind == "reminder":
+            chat_id = int(record["chat_id"])
+            next_fire = record.get("next_fire")
+            yield "reminder", reminder_row(
+                chat_id, datetime.fromisoformat(record["when"]), record.get("from_user"), record.get("target_user"),
+                record.get("subject"), tz=zones.get(chat_id, PACIFIC_TZ),
+                next_fire=datetime.fromisoformat(next_fire) if next_fire else None, now=now)
+        else:
+            raise ValueError(f"Unknown record type {kind!r}")
+
+
+def read_records(path: str, fmt: str, now: datetime) -> Iterator[tuple[str, dict]]:
+    with open(path, "r", encoding="utf-8") as f:
+        if fmt == "legacy":
+            for chat_id, chat in iter_legacy_chats(f):
+                yield from legacy_records(chat_id, chat, now)
+        else:
+            yield from jsonl_records(f, now)
+
+
+def write_batch(source: str, records: int, chats: list[dict], reminders: list[dict]) -> tuple[int, int]:
+    with database.session_scope() as session:
+        # chats first, their reminders can be in the same batch. a chat that's already there is kept as it is
+        added_chats = database.bulk_insert(session, db.Chat.__table__, chats, or_ignore=True)
+        added_reminders = database.bulk_insert(session, db.Reminder.__table__, reminders)
+        database.set_import_progress(session, source, records)
+    return added_chats, added_reminders
+
+
+def start_import(source: str, restart: bool) -> tuple[int, bool]:
+    """Records already imported from source and whether the reminder indexes are off for the load."""
+    with database.session_scope() as session:
+        if restart:
+            database.set_import_progress(session, source, 0)
+        skip = database.get_import_progress(session, source)
+        # still missing means an earlier import stopped before building them
+        indexes_off = database.reminder_indexes_missing(session)
+        if not indexes_off and not database.count_all_reminders(session):
+            database.drop_reminder_indexes(session)
+            indexes_off = True
+    return skip, indexes_off
+
+
+def import_file(path: str, fmt: str = None, batch: int = BATCH_SIZE, restart: bool = False) -> dict:
+    """Imports path into the db and returns counts of what was read and added.
+
+    restart forgets the progress saved for path, reminders from the earlier attempt are added again.
+    """
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "legacy")
+    source = os.path.abspath(path)
+    skip, indexes_off = start_import(source, restart)
+    now = datetime.now(tz=timezone.utc)
+    counts = {"skipped": skip, "records": skip, "chats": 0, "reminders": 0}
+    started = time.perf_counter()
+    # records already done are still read, just not written again
+    records = itertools.islice(read_records(path, fmt, now), skip, None)
+    while True:
+        chunk = list(itertools.islice(records, batch))
+        if not chunk:
+            break
+        chats = [row for kind, row in chunk if kind == "chat"]
+        reminders = [row for kind, row in chunk if kind == "reminder"]
+        added_chats, added_reminders = write_batch(source, counts["records"] + len(chunk), chats, reminders)
+        counts["records"] += len(chunk)
+        counts["chats"] += added_chats
+        counts["reminders"] += added_reminders
+        rate = (counts["records"] - skip) / (time.perf_counter() - started)
+        logging.info(f"Imported {counts['records']} record(s), {rate:.0f}/sec")
+    if indexes_off:
+        index_started = time.perf_counter()
+        with database.session_scope() as session:
+            database.create_reminder_indexes(session)
+        logging.info(f"Built the reminder indexes in {time.perf_counter() - index_started:.1f}s")
+    return counts
+
+
+def export_file(path: str, batch: int = BATCH_SIZE) -> dict:
+    """Writes every chat, then every reminder, to path as json lines and returns how many of each."""
+    counts = {"chats": 0, "reminders": 0}
+    with open(path, "w", encoding="utf-8") as f, database.session_scope() as session:
+        for kind, table in (("chat", db.Chat.__table__), ("reminder", db.Reminder.__table__)):
+            for row in database.stream_table(session, table, batch):
+                if kind == "reminder":
+                    # ids are given out again on import, a dump can go into a db that already has reminders
+                    del row["id"]
+                f.write(json.dumps({"type": kind} | row, default=datetime.isoformat) + "\n")
+                counts[f"{kind}s"] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of chats and reminders.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import a legacy chats.json or a json lines dump")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=("legacy", "jsonl"), help="by default from the file extension")
+    import_parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="records per transaction")
+    import_parser.add_argument("--restart", action="store_true",
+                               help="ignore saved progress and start over, e.g. into a new db")
+    export_parser = commands.add_parser("export", help="write every chat and reminder as json lines")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="rows read at a time")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    db.init_db()
+    started = time.perf_counter()
+    if args.command == "import":
+        counts = import_file(args.file, args.format, args.batch, args.restart)
+    else:
+        counts = export_file(args.file, args.batch)
+    logging.info(f"Finished {args.command} of {args.file}: {counts} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# write-behind cache of chat rows. reads are served from memory, writes that
+# don't change anything are dropped and the rest are flushed to the db in one
+# batch by a repeating job. only the fields written behind are flushed, so a
+# flush can't put back an old value a write-through setter has just replaced.
+import logging
+from collections import OrderedDict
+
+import database
+import models as db
+from constants import CHAT_CACHE_SIZE
+
+CACHED_FIELDS = ("title", "time_zone", "stop_armed", "reminder_offset")
+
+
+class ChatCache:
+    def __init__(self, max_size: int = CHAT_CACHE_SIZE):
+        self.max_size = max_size
+        # chat_id -> detached db.Chat, or None when the chat isn't in the db
+        self._chats: OrderedDict[int, db.Chat] = OrderedDict()
+        # chat_id -> fields changed since the last flush, for cached and evicted chats
+        self._dirty: dict[int, set[str]] = {}
+        # dirty chats pushed out by the size bound before they were flushed
+        self._evicted: dict[int, db.Chat] = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes_skipped = 0
+        self.rows_flushed = 0
+
+    def __len__(self):
+        return len(self._chats)
+
+    def __contains__(self, chat_id: int):
+        return chat_id in self._chats or chat_id in self._evicted
+
+    def _put(self, chat_id: int, chat: db.Chat, dirty_field: str = None):
+        self._chats[chat_id] = chat
+        self._chats.move_to_end(chat_id)
+        if dirty_field:
+            self._dirty.setdefault(chat_id, set()).add(dirty_field)
+        while len(self._chats) > self.max_size:
+            old_id, old_chat = self._chats.popitem(last=False)
+            if old_id in self._dirty:
+                self._evicted[old_id] = old_chat
+
+    async def get(self, chat_id: int) -> db.Chat:
+        if chat_id in self._chats:
+            self.hits += 1
+            self._chats.move_to_end(chat_id)
+            return self._chats[chat_id]
+        if chat_id in self._evicted:
+            self.hits += 1
+            chat = self._evicted.pop(chat_id)
+            self._put(chat_id, chat)
+            return chat
+        self.misses += 1
+        chat = await database.run(database.get_chat, chat_id)
+        if chat_id in self:
+            # another update loaded or changed it while we were waiting
+            return await self.get(chat_id)
+        self._put(chat_id, chat)
+        return chat
+
+    def overlay(self, chat: db.Chat) -> db.Chat:
+        """Copies unflushed cached values onto a chat freshly loaded from the db."""
+        if chat:
+            cached = self._chats.get(chat.id) or self._evicted.get(chat.id)
+            if cached:
+                for field in CACHED_FIELDS:
+                    setattr(chat, field, getattr(cached, field))
+        return chat
+
+    async def add_if_not_exist(self, chat_id: int, title: str) -> db.Chat:
+        chat = await self.get(chat_id)
+        if not chat:
+            chat = await database.run(database.add_chat_if_not_exist, chat_id=chat_id, title=title)
+            self._put(chat_id, chat)
+        return chat
+
+    async def set_stop_armed(self, chat_id: int, armed: bool) -> db.Chat:
+        chat = await self.get(chat_id)
+        if chat:
+            if bool(chat.stop_armed) == armed:
+                self.writes_skipped += 1
+            else:
+                chat.stop_armed = armed
+                self._put(chat_id, chat, dirty_field="stop_armed")
+        return chat
+
+    async def set_reminder_offset(self, chat_id: int, offset: int) -> db.Chat:
+        """Writes through immediately and returns the chat with its reminders loaded."""
+        chat = await database.run(database.set_reminder_offset, chat_id, offset)
+        cached = await self.get(chat_id)
+        if cached:
+            cached.reminder_offset = offset
+        return self.overlay(chat)
+
+    async def set_trigger_words(self, chat_id: int, trigger_words: str) -> db.Chat:
+        """Writes through immediately, the words aren't part of the batched flush."""
+        chat = await database.run(database.set_trigger_words, chat_id, trigger_words)
+        cached = await self.get(chat_id)
+        if cached:
+            cached.trigger_words = trigger_words
+        return self.overlay(chat)
+
+    async def set_awoo_burst(self, chat_id: int, window: int, cap: int) -> db.Chat:
+        """Writes through immediately, like set_trigger_words."""
+        chat = await database.run(database.set_awoo_burst, chat_id, window, cap)
+        cached = await self.get(chat_id)
+        if cached:
+            cached.awoo_window = window
+            cached.awoo_cap = cap
+        return self.overlay(chat)
+
+    async def set_time_zone(self, chat_id: int, time_zone: str) -> db.Chat:
+        """Writes through along with the chat's rescheduled reminders, which it returns loaded."""
+        chat = await database.run(database.set_time_zone, chat_id, time_zone)
+        cached = await self.get(chat_id)
+        if cached:
+            cached.time_zone = time_zone
+        return self.overlay(chat)
+
+    async def delete(self, chat_id: int) -> bool:
+        deleted = await database.run(database.delete_chat, chat_id)
+        self._dirty.pop(chat_id, None)
+        self._evicted.pop(chat_id, None)
+        self._put(chat_id, None)
+        return deleted
+
+    async def flush(self) -> int:
+        if not self._dirty:
+            return 0
+        dirty, evicted = self._dirty, self._evicted
+        self._dirty, self._evicted = {}, {}
+        values = []
+        for chat_id, fields in dirty.items():
+            chat = evicted.get(chat_id) or self._chats[chat_id]
+            values.append({field: getattr(chat, field) for field in fields} | {"chat_id": chat_id})
+        try:
+            await database.run(database.update_chat_states, values)
+        except Exception:
+            for chat_id, fields in dirty.items():
+                if chat_id in evicted and chat_id not in self._chats:
+                    self._evicted[chat_id] = evicted[chat_id]
+                # a chat deleted in the meantime has nothing left to write
+                if self._chats.get(chat_id) or chat_id in self._evicted:
+                    self._dirty.setdefault(chat_id, set()).update(fields)
+            raise
+        self.rows_flushed += len(values)
+        logging.info(f"Flushed {len(values)} cached chat(s) to the db")
+        return len(values)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._chats),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes_skipped": self.writes_skipped,
+            "rows_flushed": self.rows_flushed,
+        }
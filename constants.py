@@ -1,14 +1,99 @@
+import os
 from zoneinfo import ZoneInfo
 GOOGLE_SHEET_ID = "1IfGrcY4ntE70fycFRAEtjAvb20ukVf9wTkPzdvtLLKg"
+GOOGLE_SHEET_URL = "https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet}"
 PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
 CHATS_FILE_PATH = "data/chats.json"
+DATA_SNAPSHOT_PATH = "data/words.json"
 MESSAGES_FILE_PATH = "messages.json"
 BOT_NAME = "AwooPackBot"
 ONETIME = "onetime_reminders"
 DAILY = "daily_reminders"
 AWOO_PATTERN = r"\b[auo0]+w[u0o]+\b"
+# a chat's own words the bot howls back at, on top of awoos and mentions
+MAX_TRIGGER_WORDS = 200
+# awoos inside a chat's window are answered with one reply of up to cap howls, see debounce.py. chats can
+# set their own with /awoowindow, a window of 0 replies to every awoo
+AWOO_WINDOW_SECONDS = int(os.environ.get("AWOO_REPLY_WINDOW", "10"))
+AWOO_BURST_CAP = 5
+MAX_AWOO_WINDOW_SECONDS = 300
+MAX_AWOO_BURST_CAP = 20
 TIME_PATTERN_12H = r"([0-1]?\d):*([0-5]\d)*\s?([ap]\.?m?\.?)$"
 TIME_PATTERN_24H = r"([0-2]?\d):??([0-5]\d)$"
 TIME_PATTERN_IN = r"(\d+) (minute|hour|day|week)"
 DATE_PATTERN_INTL = r"([12]\d{3})-([01]?\d)-([0-3]?\d)"
 DATE_PATTERN_US = r"([01]?\d)\/([0-3]?\d)\/?([12]?\d?\d{2})?"
+DB_THREADS = 4
+# updates handled at once, so one chat's db work or api call doesn't hold up the rest. 1 handles them in order
+CONCURRENT_UPDATES = int(os.environ.get("AWOO_CONCURRENT_UPDATES", "32"))
+CHAT_CACHE_SIZE = 10000
+CHAT_CACHE_FLUSH_SECONDS = 30
+REMINDER_WINDOW_MINUTES = 60
+REMINDER_PAGE_MINUTES = 15
+# past one-time reminders are deleted in bulk this often. the grace leaves ones whose job is running late alone
+SWEEP_MINUTES = float(os.environ.get("AWOO_SWEEP_MINUTES", "10"))
+SWEEP_GRACE_MINUTES = 5
+# /list shows this many reminders a message. a page has to fit telegram's 4096 characters, so each
+# line is cut to LIST_LINE_LENGTH
+LIST_PAGE_SIZE = 10
+LIST_LINE_LENGTH = 350
+SEND_GLOBAL_PER_SECOND = 30
+SEND_GROUP_PER_MINUTE = 20
+SEND_PRIVATE_PER_SECOND = 1
+SEND_BURST = 3
+# how long shutdown waits for queued messages to go out
+OUTBOX_DRAIN_SECONDS = 10
+TEMPLATE_VAR_PATTERN = r"\%[a-z_]+\%"
+DATA_REFRESH_MINUTES = 60
+CSV_NA_VALUES = frozenset((
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+))
+ADMIN_CACHE_SECONDS = 300
+ADMIN_CACHE_SIZE = 10000
+# the bot api and db can be pointed elsewhere, test/bench_load.py runs the bot against a local fake api
+BOT_TOKEN = os.environ.get("AWOO_TOKEN", "")
+BOT_API_URL = os.environ.get("AWOO_BOT_API_URL", "https://api.telegram.org/bot")
+DB_URL = os.environ.get("AWOO_DB_URL", "sqlite:///data/chats.db")
+# "polling", "webhook" or, for all but one of several polling workers, "forwarded". the webhook settings
+# can also come from the environment, e.g. in docker-compose
+UPDATE_MODE = os.environ.get("AWOO_UPDATE_MODE", "polling")
+WEBHOOK_URL = os.environ.get("AWOO_WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("AWOO_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("AWOO_WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.environ.get("AWOO_WEBHOOK_SECRET", "")
+# pem files for serving https directly. without them the receiver speaks plain http and has to sit behind a
+# reverse proxy that terminates tls, telegram only posts to https urls
+WEBHOOK_CERT = os.environ.get("AWOO_WEBHOOK_CERT", "")
+WEBHOOK_KEY = os.environ.get("AWOO_WEBHOOK_KEY", "")
+WEBHOOK_MAX_CONNECTIONS = 40
+WEBHOOK_MAX_PENDING = 1000
+# more than one worker splits the chats between processes sharing the db, see sharding.py. they either share
+# one webhook url and AWOO_WEBHOOK_SECRET, or one polls and the rest run in "forwarded" mode
+WORKER_COUNT = int(os.environ.get("AWOO_WORKERS", "1"))
+WORKER_ID = os.environ.get("AWOO_WORKER_ID", "")
+SHARD_COUNT = 64
+LEASE_SECONDS = 60
+LEASE_RENEW_SECONDS = 20
+# daily firing claims are only needed until every worker is past the firing
+FIRING_KEEP_DAYS = 2
+# how often each worker picks up updates the others forwarded to its shards, and how many at a time
+FORWARD_POLL_SECONDS = 0.5
+FORWARD_BATCH = 200
+# prometheus metrics, see metrics.py. a port of 0 turns the endpoint off
+METRICS_LISTEN = os.environ.get("AWOO_METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("AWOO_METRICS_PORT", "9464"))
+# profiling, see profiling.py. SIGUSR2 turns handler profiling on and off, SIGUSR1 dumps the hot functions
+PROFILE_HANDLERS = os.environ.get("AWOO_PROFILE", "") not in ("", "0")
+PROFILE_THRESHOLD_MS = float(os.environ.get("AWOO_PROFILE_THRESHOLD_MS", "500"))
+PROFILE_DIR = "data/profiles"
+PROFILE_TOP_N = 30
+SLOW_QUERY_MS = float(os.environ.get("AWOO_SLOW_QUERY_MS", "100"))
+# set on every new sqlite connection. init_db also turns on wal, which is kept in the file, so readers
+# carry on while the flush or a worker writes
+SQLITE_PRAGMAS = (
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", "5000"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", "-16000"),
+)
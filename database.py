@@ -0,0 +1,450 @@
+# data access helpers. every call gets its own short-lived session and,
+# when awaited through run(), executes on a bounded thread pool so SQLite
+# never blocks the asyncio event loop.
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from sqlalchemy import and_, bindparam, func, inspect, or_, select, true
+from sqlalchemy.orm import joinedload, selectinload
+
+import models as db
+from constants import DB_THREADS, LIST_PAGE_SIZE
+from functions import get_zone
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+
+@contextmanager
+def session_scope():
+    session = db.Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def run_sync(fn, *args, **kwargs):
+    with session_scope() as session:
+        return fn(session, *args, **kwargs)
+
+
+async def run(fn, *args, **kwargs):
+    """Run fn(session, *args, **kwargs) on the db thread pool and return its result."""
+    loop = asyncio.get_running_loop()
+    # carries the caller's context over so the statements are counted against its handler
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, context.run, partial(run_sync, fn, *args, **kwargs))
+
+
+def _with_reminders(query):
+    return query.options(
+        selectinload(db.Chat.reminders),
+        selectinload(db.Chat.daily_reminders),
+        selectinload(db.Chat.onetime_reminders),
+    )
+
+
+def get_chat(session, chat_id: int, reminders: bool = False) -> db.Chat:
+    query = session.query(db.Chat).filter(db.Chat.id == chat_id)
+    if reminders:
+        query = _with_reminders(query)
+    return query.first()
+
+
+def get_all_chats(session, reminders: bool = False) -> list[db.Chat]:
+    query = session.query(db.Chat)
+    if reminders:
+        query = _with_reminders(query)
+    return query.all()
+
+
+def add_chat_if_not_exist(session, chat_id: int, title: str) -> db.Chat:
+    the_chat = get_chat(session, chat_id)
+    if not the_chat:
+        the_chat = db.Chat(
+            chat_id=chat_id,
+            title=title,
+            time_zone="America/Los_Angeles"
+        )
+        session.add(the_chat)
+    return the_chat
+
+
+def set_stop_armed(session, chat_id: int, armed: bool) -> db.Chat:
+    chat = get_chat(session, chat_id)
+    if chat:
+        chat.stop_armed = armed
+    return chat
+
+
+def set_reminder_offset(session, chat_id: int, offset: int) -> db.Chat:
+    chat = get_chat(session, chat_id, reminders=True)
+    if chat:
+        chat.reminder_offset = offset
+    return chat
+
+
+def set_trigger_words(session, chat_id: int, trigger_words: str) -> db.Chat:
+    chat = get_chat(session, chat_id)
+    if chat:
+        chat.trigger_words = trigger_words
+    return chat
+
+
+def set_awoo_burst(session, chat_id: int, window: int, cap: int) -> db.Chat:
+    chat = get_chat(session, chat_id)
+    if chat:
+        chat.awoo_window = window
+        chat.awoo_cap = cap
+    return chat
+
+
+def set_time_zone(session, chat_id: int, time_zone: str) -> db.Chat:
+    """Moves a chat to another zone. Daily reminders keep their wall time, one-time reminders keep their instant."""
+    chat = get_chat(session, chat_id, reminders=True)
+    if chat:
+        chat.time_zone = time_zone
+        tz = get_zone(time_zone)
+        for reminder in chat.reminders:
+            if reminder.is_daily:
+                reminder.schedule_next(tz)
+            elif reminder.next_fire:
+                reminder.when = reminder.next_fire.astimezone(tz)
+                reminder.update_job_name()
+    return chat
+
+
+def update_chat_states(session, rows: list[dict]):
+    """Writes a batch of chat rows, each keyed by chat_id and the columns that changed.
+
+    Rows changing the same columns go in one executemany UPDATE, columns a row leaves out are left alone.
+    """
+    chat_table = db.Chat.__table__
+    batches: dict[tuple[str, ...], list[dict]] = {}
+    for row in rows:
+        batches.setdefault(tuple(sorted(key for key in row if key != "chat_id")), []).append(row)
+    for columns, batch in batches.items():
+        # bind names can't shadow the column names in SET, so prefix them
+        statement = chat_table.update().where(chat_table.c.id == bindparam("b_chat_id")).values(
+            {column: bindparam(f"b_{column}") for column in columns}
+        )
+        session.execute(statement, [{f"b_{key}": value for key, value in row.items()} for row in batch])
+
+
+def delete_chat(session, chat_id: int) -> bool:
+    chat = get_chat(session, chat_id)
+    if chat:
+        session.delete(chat)
+        return True
+    return False
+
+
+def disarm_all_chats(session) -> int:
+    return session.query(db.Chat).filter(db.Chat.stop_armed == True).update(  # noqa: E712
+        {db.Chat.stop_armed: False}, synchronize_session=False
+    )
+
+
+def delete_past_reminders(session, now: datetime) -> int:
+    return session.query(db.Reminder).filter(
+        db.Reminder.is_daily == False, db.Reminder.next_fire < now  # noqa: E712
+    ).delete(synchronize_session=False)
+
+
+def update_next_fires(session, now: datetime) -> int:
+    """Fills in missing next_fire values and moves daily reminders that were missed while down to their next time."""
+    stale = session.query(db.Reminder).options(joinedload(db.Reminder.chat)).filter(
+        or_(db.Reminder.next_fire == None, and_(db.Reminder.is_daily == True, db.Reminder.next_fire <= now))  # noqa: E711,E712
+    ).all()
+    for reminder in stale:
+        reminder.schedule_next(get_zone(reminder.chat.time_zone if reminder.chat else None), after=now)
+    return len(stale)
+
+
+def set_next_fires(session, rows: list[tuple[int, datetime]]):
+    """Saves (reminder_id, next_fire) pairs in one executemany UPDATE."""
+    if not rows:
+        return
+    reminder_table = db.Reminder.__table__
+    statement = reminder_table.update().where(reminder_table.c.id == bindparam("b_id")).values(
+        next_fire=bindparam("b_next_fire")
+    )
+    session.execute(statement, [{"b_id": reminder_id, "b_next_fire": next_fire} for reminder_id, next_fire in rows])
+
+
+def get_daily_reminders(session) -> list[db.Reminder]:
+    """Every daily reminder with its chat joined in, for the offset."""
+    return session.query(db.Reminder).options(joinedload(db.Reminder.chat)).filter(
+        db.Reminder.is_daily == True  # noqa: E712
+    ).all()
+
+
+def get_reminders(session, chat_id: int, is_daily: bool) -> list[db.Reminder]:
+    return session.query(db.Reminder).filter(db.Reminder.chat_id == chat_id, db.Reminder.is_daily == is_daily).all()
+
+
+def _list_key(is_daily: bool):
+    # daily reminders list by time of day, the date in when is just the day they were set
+    return db.Reminder.minute_of_day if is_daily else db.Reminder.when
+
+
+def _walk_reminders(session, chat_id: int, cursor, limit: int, backwards: bool, now: datetime) -> list[db.Reminder]:
+    """Up to limit reminders next to cursor, a (is_daily, key, id) row or None for an end of the list.
+
+    The list is daily reminders then one-time ones still to come, each section read in (key, id) order off its index.
+    """
+    sections = (False, True) if backwards else (True, False)
+    if cursor:
+        sections = sections[sections.index(cursor[0]):]
+    rows = []
+    for is_daily in sections:
+        key = _list_key(is_daily)
+        query = session.query(db.Reminder).filter(db.Reminder.chat_id == chat_id, db.Reminder.is_daily == is_daily)
+        if not is_daily:
+            # past ones are left for the sweeper. when is wall time, so this stays a range on the index
+            query = query.filter(db.Reminder.when >= now)
+        if cursor and cursor[0] == is_daily:
+            _, cursor_key, cursor_id = cursor
+            if backwards:
+                query = query.filter(or_(key < cursor_key, and_(key == cursor_key, db.Reminder.id < cursor_id)))
+            else:
+                query = query.filter(or_(key > cursor_key, and_(key == cursor_key, db.Reminder.id > cursor_id)))
+        order = (key.desc(), db.Reminder.id.desc()) if backwards else (key, db.Reminder.id)
+        rows += query.order_by(*order).limit(limit - len(rows)).all()
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def get_reminder_page(session, chat_id: int, after_id: int = None, before_id: int = None,
+                      size: int = LIST_PAGE_SIZE, now: datetime = None) -> tuple[list[db.Reminder], bool, bool]:
+    """A page of a chat's reminders next to another reminder, the first page without one.
+
+    now is the chat's local time, one-time reminders before it aren't listed. Returns the page and whether
+    there are reminders before and after it. Each page costs the same few indexed queries, however long the list is.
+    """
+    now = now or datetime.now(tz=get_zone(None))
+    cursor = None
+    if after_id or before_id:
+        cursor = session.query(
+            db.Reminder.is_daily, db.Reminder.minute_of_day, db.Reminder.when, db.Reminder.id
+        ).filter(db.Reminder.id == (after_id or before_id), db.Reminder.chat_id == chat_id).first()
+    if cursor:
+        cursor = (cursor.is_daily, cursor.minute_of_day if cursor.is_daily else cursor.when, cursor.id)
+    if cursor and before_id:
+        rows = _walk_reminders(session, chat_id, cursor, size + 1, backwards=True, now=now)
+        return rows[:size][::-1], len(rows) > size, True
+    rows = _walk_reminders(session, chat_id, cursor, size + 1, backwards=False, now=now)
+    # a reminder that's gone since the page was shown starts the list over
+    return rows[:size], bool(cursor), len(rows) > size
+
+
+def get_onetime_reminders_between(session, start: datetime, end: datetime) -> list[db.Reminder]:
+    """One-time reminders due in [start, end), an open start means everything before end."""
+    query = session.query(db.Reminder).filter(db.Reminder.is_daily == False, db.Reminder.next_fire < end)  # noqa: E712
+    if start:
+        query = query.filter(db.Reminder.next_fire >= start)
+    return query.order_by(db.Reminder.next_fire).all()
+
+
+def get_reminder_by_name(session, name: str) -> db.Reminder:
+    return session.query(db.Reminder).filter(db.Reminder.name == name).first()
+
+
+def add_reminder(session, reminder: db.Reminder) -> db.Reminder:
+    session.add(reminder)
+    return reminder
+
+
+def count_reminders(session, chat_id: int) -> dict[bool, int]:
+    """is_daily -> how many of the chat's reminders there are, kinds it has none of are left out."""
+    return dict(session.query(db.Reminder.is_daily, func.count()).filter(
+        db.Reminder.chat_id == chat_id).group_by(db.Reminder.is_daily).all())
+
+
+def _removable_query(session, chat_id: int, minute: int = None):
+    query = session.query(db.Reminder).filter(db.Reminder.chat_id == chat_id, db.Reminder.is_daily == False)  # noqa: E712
+    if minute is not None:
+        query = query.filter(db.Reminder.minute_of_day == minute)
+    return query
+
+
+def _may_remove(username: str, is_admin: bool):
+    if is_admin:
+        return true()
+    return or_(db.Reminder.from_user_lower == username, db.Reminder.target_user_lower == username)
+
+
+def get_removable_reminders(session, chat_id: int, username: str, is_admin: bool,
+                            minute: int = None) -> tuple[int, list[db.Reminder]]:
+    """A chat's one-time reminders at minute of day, or at any time, in time order.
+
+    Returns how many there are and the ones username may remove, which /removereminder numbers from 1.
+    """
+    rows = _removable_query(session, chat_id, minute).add_columns(_may_remove(username.lower(), is_admin)).order_by(
+        db.Reminder.when, db.Reminder.id).all()
+    return len(rows), [reminder for reminder, allowed in rows if allowed]
+
+
+def get_removable_reminder(session, chat_id: int, username: str, is_admin: bool, number: int,
+                           minute: int = None) -> db.Reminder:
+    """The reminder get_removable_reminders would number number, picked out by the db."""
+    if number < 1:
+        return None
+    return _removable_query(session, chat_id, minute).filter(_may_remove(username.lower(), is_admin)).order_by(
+        db.Reminder.when, db.Reminder.id).offset(number - 1).first()
+
+
+def delete_reminder(session, reminder_id: int) -> bool:
+    return session.query(db.Reminder).filter(db.Reminder.id == reminder_id).delete() > 0
+
+
+def delete_reminder_by_name(session, name: str) -> bool:
+    return session.query(db.Reminder).filter(db.Reminder.name == name).delete() > 0
+
+
+def bulk_insert(session, table, rows: list[dict], or_ignore: bool = False) -> int:
+    """Adds complete rows in one driver-level executemany and returns how many went in.
+
+    Values are converted with the column types' own bind processors up front, which skips the per-row work a
+    core insert does and is what makes a bulk import fast. Every row needs every column but an autoincrement id.
+    """
+    if not rows:
+        return 0
+    connection = session.connection()
+    dialect = connection.dialect
+    columns = [column for column in table.columns if column.name in rows[0]]
+    processors = [column.type.dialect_impl(dialect).bind_processor(dialect) for column in columns]
+    # a column at a time, then zipped back into rows
+    values = list(zip(*(
+        [process(row[column.name]) for row in rows] if process else [row[column.name] for row in rows]
+        for column, process in zip(columns, processors))))
+    statement = "INSERT {}INTO {} ({}) VALUES ({})".format(
+        "OR IGNORE " if or_ignore else "", table.name, ", ".join(f'"{column.name}"' for column in columns),
+        ", ".join("?" * len(columns)))
+    return connection.exec_driver_sql(statement, values).rowcount
+
+
+def get_import_progress(session, source: str) -> int:
+    progress = session.get(db.ImportProgress, source)
+    return progress.records if progress else 0
+
+
+def set_import_progress(session, source: str, records: int):
+    """Meant for the same transaction as the rows it counts, so the two can't disagree after a crash."""
+    session.merge(db.ImportProgress(source=source, records=records))
+
+
+def drop_reminder_indexes(session):
+    """Drops the reminder table's indexes ahead of a big load, create_reminder_indexes puts them back."""
+    connection = session.connection()
+    for index in db.Reminder.__table__.indexes:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+
+
+def create_reminder_indexes(session):
+    connection = session.connection()
+    for index in db.Reminder.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+def reminder_indexes_missing(session) -> bool:
+    names = {index["name"] for index in inspect(session.connection()).get_indexes("reminder")}
+    return any(index.name not in names for index in db.Reminder.__table__.indexes)
+
+
+def count_all_reminders(session) -> int:
+    return session.query(func.count(db.Reminder.id)).scalar()
+
+
+def stream_table(session, table, batch: int):
+    """Yields every row of table as a dict, reading batch rows at a time."""
+    result = session.execute(select(table).order_by(*table.primary_key.columns).execution_options(yield_per=batch))
+    for row in result:
+        yield dict(row._mapping)
+
+
+def ensure_leases(session, shard_count: int):
+    """Creates the unowned lease rows. Safe to run from every worker at once."""
+    session.execute(db.Lease.__table__.insert().prefix_with("OR IGNORE"), [{"shard": s} for s in range(shard_count)])
+
+
+def renew_leases(session, owner: str, shard_count: int, now: datetime, ttl: timedelta) -> set[int]:
+    """Extends owner's leases, then claims free or expired shards or gives some up to reach a fair share.
+
+    Every claim is a conditional UPDATE, so two workers can never both come away owning the same shard.
+    """
+    expires = now + ttl
+    session.merge(db.Worker(id=owner, expires=expires))
+    session.flush()
+    live_workers = session.query(db.Worker).filter(db.Worker.expires > now).count()
+    fair_share = -(-shard_count // max(live_workers, 1))
+    session.query(db.Lease).filter(db.Lease.owner == owner).update({db.Lease.expires: expires})
+    owned = sorted(shard for (shard,) in session.query(db.Lease.shard).filter(db.Lease.owner == owner))
+    if len(owned) > fair_share:
+        session.query(db.Lease).filter(db.Lease.owner == owner, db.Lease.shard.in_(owned[fair_share:])).update(
+            {db.Lease.owner: None, db.Lease.expires: None}, synchronize_session=False
+        )
+        return set(owned[:fair_share])
+    claimable = or_(db.Lease.owner == None, db.Lease.expires <= now)  # noqa: E711
+    for (shard,) in session.query(db.Lease.shard).filter(claimable).order_by(db.Lease.shard):
+        if len(owned) >= fair_share:
+            break
+        if session.query(db.Lease).filter(db.Lease.shard == shard, claimable).update(
+                {db.Lease.owner: owner, db.Lease.expires: expires}, synchronize_session=False):
+            owned.append(shard)
+    return set(owned)
+
+
+def release_leases(session, owner: str):
+    session.query(db.Lease).filter(db.Lease.owner == owner).update(
+        {db.Lease.owner: None, db.Lease.expires: None}, synchronize_session=False
+    )
+    session.query(db.Worker).filter(db.Worker.id == owner).delete()
+
+
+def forward_update(session, shard: int, payload: str):
+    session.add(db.ForwardedUpdate(shard=shard, payload=payload))
+
+
+def take_forwarded_updates(session, shards: set[int], limit: int) -> list[str]:
+    """Removes and returns the oldest updates forwarded to shards, in the order they came in.
+
+    Deleting the row is the claim, so an update is only handed out once even while its shard changes hands.
+    """
+    if not shards:
+        return []
+    rows = session.query(db.ForwardedUpdate.id, db.ForwardedUpdate.payload).filter(
+        db.ForwardedUpdate.shard.in_(shards)
+    ).order_by(db.ForwardedUpdate.id).limit(limit).all()
+    return [payload for row_id, payload in rows
+            if session.query(db.ForwardedUpdate).filter(db.ForwardedUpdate.id == row_id).delete() == 1]
+
+
+def firing_key(fire_at: datetime) -> str:
+    """How a firing's instant is stored, utc iso text sorts the same as the instants."""
+    return fire_at.astimezone(timezone.utc).isoformat()
+
+
+def claim_firing(session, name: str, day: str, owner: str) -> bool:
+    """Records that a daily reminder fired at day, a firing_key. Returns False if some worker already did."""
+    result = session.execute(db.Firing.__table__.insert().prefix_with("OR IGNORE"),
+                             {"name": name, "day": day, "owner": owner})
+    return result.rowcount == 1
+
+
+def claim_firings(session, firings: list[tuple[str, str]], owner: str) -> set[tuple[str, str]]:
+    """claim_firing for a batch of (name, day) pairs, returning the ones this owner got."""
+    return {(name, day) for name, day in firings if claim_firing(session, name, day, owner)}
+
+
+def purge_firings(session, before: datetime) -> int:
+    return session.query(db.Firing).filter(db.Firing.day < firing_key(before)).delete(synchronize_session=False)
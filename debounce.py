@@ -0,0 +1,77 @@
+# coalesces bursts of awoos in a chat. the first one gets a reply straight
+# away and opens a window, matches inside the window are only counted, and
+# when it closes they get one reply scaled to how many there were. a chain that
+# keeps going keeps the window open, so it costs one send per window at most.
+import asyncio
+from typing import Callable
+
+from constants import AWOO_BURST_CAP, AWOO_WINDOW_SECONDS
+
+
+class Burst:
+    __slots__ = ("count", "message_id", "window", "cap")
+
+    def __init__(self, window: float, cap: int):
+        self.count = 0
+        self.message_id = None
+        self.window = window
+        self.cap = cap
+
+
+class BurstDebouncer:
+    def __init__(self, on_burst: Callable[[int, int, int], object] = None,
+                 window: float = AWOO_WINDOW_SECONDS, cap: int = AWOO_BURST_CAP):
+        # called with (chat_id, howls, message_id) when a window closes on held back matches
+        self.on_burst = on_burst
+        self.window = window
+        self.cap = cap
+        self._bursts: dict[int, Burst] = {}
+        self.matched = 0
+        self.replies = 0
+
+    def __len__(self):
+        return len(self._bursts)
+
+    def hit(self, chat_id: int, message_id: int, window: float = None, cap: int = None) -> bool:
+        """Counts a match and returns True if it should be replied to now.
+
+        window and cap are the chat's own settings, None uses the defaults and a window of 0 replies to every match.
+        """
+        self.matched += 1
+        burst = self._bursts.get(chat_id)
+        if burst:
+            burst.count += 1
+            burst.message_id = message_id
+            return False
+        window = self.window if window is None else window
+        if window > 0:
+            self._bursts[chat_id] = burst = Burst(window, self.cap if cap is None else cap)
+            asyncio.get_running_loop().call_later(window, self._close, chat_id)
+        self.replies += 1
+        return True
+
+    def _close(self, chat_id: int):
+        burst = self._bursts.get(chat_id)
+        if not burst:
+            return
+        if not burst.count:
+            del self._bursts[chat_id]
+            return
+        howls, message_id = min(burst.count, burst.cap), burst.message_id
+        burst.count = 0
+        asyncio.get_running_loop().call_later(burst.window, self._close, chat_id)
+        self.replies += 1
+        if self.on_burst:
+            self.on_burst(chat_id, howls, message_id)
+
+    def forget(self, chat_id: int):
+        """Drops a chat's open window without replying, e.g. once the chat is removed."""
+        self._bursts.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self._bursts),
+            "matched": self.matched,
+            "replies": self.replies,
+            "sends_saved": self.matched - self.replies,
+        }
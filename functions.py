@@ -1,41 +1,133 @@
 # helper funtions
+import csv
+import io
 import json
 import re
 import sys
 from datetime import datetime, timedelta
+from functools import lru_cache
 from random import choice
+from zoneinfo import ZoneInfo, available_timezones
 
-import pandas as pd
 from telegram import Update
 
 import models as db
+from admin_cache import AdminCache
 from constants import *
 
+TEMPLATE_VAR_RE = re.compile(TEMPLATE_VAR_PATTERN)
+TIME_RE_12H = re.compile(TIME_PATTERN_12H)
+TIME_RE_24H = re.compile(TIME_PATTERN_24H)
+TIME_RE_IN = re.compile(TIME_PATTERN_IN)
+DATE_RE_INTL = re.compile(DATE_PATTERN_INTL)
+DATE_RE_US = re.compile(DATE_PATTERN_US)
+# one scan decides what a message is, the first awoo or mention wins. the lookahead on the first
+# letter lets the engine skip through text that can't start either. the word alternative is only
+# used when the chat has trigger words, each word is then a set lookup
+MESSAGE_PATTERN = rf"(?=[auo0{BOT_NAME[0]}])(?:(?P<awoo>{AWOO_PATTERN})|(?P<mention>{BOT_NAME}))"
+MESSAGE_RE = re.compile(MESSAGE_PATTERN, re.I)
+MESSAGE_WORDS_RE = re.compile(rf"{MESSAGE_PATTERN}|(?P<word>\w+)", re.I)
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+admin_cache = AdminCache()
 
-def get_data_from_google() -> dict:
-    formats_url = f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEET_ID}/gviz/tq?tqx=out:csv&sheet=Formats"
-    words_url = f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEET_ID}/gviz/tq?tqx=out:csv&sheet=Words"
-    formats_pd = pd.read_csv(formats_url).to_dict()
-    words_pd = pd.read_csv(words_url).to_dict()
-    data = {}
+
+def _csv_columns(rows) -> list[str]:
+    # header names the way pandas made them: blanks become "Unnamed: n", repeats get ".1", ".2"...
+    columns, seen = [], {}
+    for index, name in enumerate(next(rows, [])):
+        name = name or f"Unnamed: {index}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_formats_csv(text: str) -> tuple:
+    rows = csv.reader(io.StringIO(text))
+    columns = _csv_columns(rows)
+    column = columns.index("format")
     new_formats = []
-    for key in formats_pd["format"]:
-        new_formats.append(formats_pd["format"][key])
-    data["formats"] = tuple(new_formats)
-
-    data["words"] = {}
-    for key in [w for w in words_pd if w.find("Unnamed") == -1]:
-        new_words = []
-        for word_key in words_pd[key]:
-            word = words_pd[key][word_key]
-            if isinstance(word, str):
-                new_words.append(word)
-        data["words"][key] = new_words
-    return data
-
-
-def get_time_of_day() -> str:
-    now = datetime.now(PACIFIC_TZ)
+    for row in rows:
+        if not row:
+            continue
+        value = row[column] if column < len(row) else ""
+        new_formats.append(float("nan") if value in CSV_NA_VALUES else value)
+    return tuple(new_formats)
+
+
+def parse_words_csv(text: str) -> dict:
+    rows = csv.reader(io.StringIO(text))
+    columns = _csv_columns(rows)
+    keep = [(index, key) for index, key in enumerate(columns) if key.find("Unnamed") == -1]
+    words = {key: [] for _, key in keep}
+    for row in rows:
+        for index, key in keep:
+            if index < len(row) and row[index] not in CSV_NA_VALUES:
+                words[key].append(row[index])
+    for key, new_words in words.items():
+        # an all-numeric column was read as numbers, and numbers were never words
+        if new_words and all(_is_number(word) for word in new_words):
+            words[key] = []
+    return words
+
+
+def get_now(tz=PACIFIC_TZ) -> datetime:
+    """The current time to the second. Everything that parses times reads the clock through here."""
+    return datetime.now(tz=tz).replace(microsecond=0)
+
+
+@lru_cache(maxsize=CHAT_CACHE_SIZE)
+def get_trigger_words(words: str) -> frozenset:
+    """The set form of a chat's trigger_words column, worked out once per distinct value."""
+    return frozenset(words.lower().split()) if words else frozenset()
+
+
+def classify_message(text: str, trigger_words: frozenset = frozenset()) -> str:
+    """Returns "awoo", "mention", "trigger" or "chatter" for a message, in one pass over its text."""
+    if not trigger_words:
+        match = MESSAGE_RE.search(text)
+        return match.lastgroup if match else "chatter"
+    for match in MESSAGE_WORDS_RE.finditer(text):
+        if match.lastgroup != "word":
+            return match.lastgroup
+        if match.group().lower() in trigger_words:
+            return "trigger"
+    return "chatter"
+
+
+@lru_cache(maxsize=1)
+def _zone_names() -> frozenset[str]:
+    return frozenset(available_timezones())
+
+
+@lru_cache(maxsize=None)
+def _load_zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+def get_zone(name: str, default: ZoneInfo = PACIFIC_TZ) -> ZoneInfo:
+    """The ZoneInfo for a chat's time_zone, or default when the name isn't a known zone.
+
+    Only names in the zone database are cached, so whatever gets typed after /timezone can't grow the cache.
+    """
+    if name and name in _zone_names():
+        return _load_zone(name)
+    return default
+
+
+def get_time_of_day(tz: ZoneInfo = PACIFIC_TZ) -> str:
+    now = get_now(tz)
     if now.hour < 12:
         return "morning"
     elif now.hour < 18:
@@ -44,24 +136,47 @@ def get_time_of_day() -> str:
         return "evening"
 
 
-def generate_message(data: dict):
-    words = data["words"]
-    the_message = str(choice(data["formats"]))
-    tod = get_time_of_day()
-    vars_to_replace = re.findall(r'\%[a-z_]+\%', the_message)
-    for index, current_var in enumerate(vars_to_replace):
-        key = str(current_var).replace('%', '')
+def compile_templates(data: dict) -> dict:
+    """Splits each format into literal text and %var% slots and pre-strips the word lists, once per data load."""
+    formats = []
+    for the_format in data["formats"]:
+        the_format = str(the_format)
+        keys = [var.strip('%') for var in TEMPLATE_VAR_RE.findall(the_format)]
+        # only a greeting that isn't the first variable gets lowercased
+        slots = tuple((key, key == 'greeting' and index != 0) for index, key in enumerate(keys))
+        formats.append((tuple(TEMPLATE_VAR_RE.split(the_format)), slots))
+    words = {key: tuple(str(word).strip() for word in value) for key, value in data["words"].items()}
+    return {
+        "formats": tuple(formats),
+        "words": words,
+        "lower": {key: tuple(word.lower() for word in value) for key, value in words.items()},
+        "reminder_morning": data["words"]["reminder"][0] if data["words"].get("reminder") else None,
+        "reminder_rest": words.get("reminder", ())[1:],
+        "tod_in_words": any('%tod%' in word for value in words.values() for word in value),
+    }
+
+
+def generate_message(data: dict, tz: ZoneInfo = PACIFIC_TZ):
+    templates = data.get("templates") or compile_templates(data)
+    parts, slots = choice(templates["formats"])
+    tod = get_time_of_day(tz)
+    pieces = [parts[0]]
+    for index, (key, lower) in enumerate(slots):
         if key == 'tod':
             selected_word = tod
         elif key == 'reminder':
-            selected_word = words[key][0] if tod == 'morning' else str(choice(words[key][1:])).strip()
+            selected_word = templates["reminder_morning"] if tod == 'morning' else choice(templates["reminder_rest"])
         else:
-            selected_word = str(choice(words[key])).strip()
-        if key == 'greeting' and index != 0: 
-            selected_word = selected_word.lower()
-        the_message = the_message.replace(current_var, selected_word, 1)
+            selected_word = choice(templates["lower" if lower else "words"][key])
+        pieces.append(selected_word)
+        pieces.append(parts[index + 1])
+    the_message = "".join(pieces)
+    return the_message.replace('%tod%', tod) if templates["tod_in_words"] else the_message
 
-    return the_message.replace('%tod%', tod)
+
+def localize(when: datetime, tz: ZoneInfo = PACIFIC_TZ) -> datetime:
+    # sqlite hands datetimes back without their zone, they're stored as wall time in the chat's zone
+    return when if when.tzinfo else when.replace(tzinfo=tz)
 
 
 def get_current_time_string() -> str:
@@ -90,22 +205,20 @@ def get_chats_from_file() -> dict:
     return new_chats
 
 
-def parse_time(time_string: str) -> datetime:
-    time_string = time_string.lower().strip()
-    now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
-    match_in = re.search(TIME_PATTERN_IN, time_string)
-    match_12 = re.search(TIME_PATTERN_12H, time_string)
-    match_24 = re.search(TIME_PATTERN_24H, time_string)
+def parse_time(time_string: str, now: datetime = None) -> datetime:
+    return _parse_time(time_string.lower().strip(), now or get_now())
+
+
+def _parse_time(time_string: str, now: datetime) -> datetime:
+    # time_string must already be lowercased and stripped
     seconds = 0
-    if re.search(r"midnight", time_string):
+    if "midnight" in time_string:
         hours = 0
         minutes = 0
-        am = True
-    elif re.search(r"noon", time_string):
+    elif "noon" in time_string:
         hours = 12
         minutes = 0
-        am = False
-    elif match_in:
+    elif match_in := TIME_RE_IN.search(time_string):
         how_many = int(match_in[1])
         if how_many < 1:
             return False
@@ -119,13 +232,13 @@ def parse_time(time_string: str) -> datetime:
         elif units.startswith("week"):
             now += timedelta(days=how_many*7)
         return now
-    elif match_12: 
+    elif match_12 := TIME_RE_12H.search(time_string):
         hours = int(match_12[1])
         minutes = int(match_12[2] or 0)
         am = match_12[3][0] == "a"
         if hours == 12 and am: hours = 0
         elif hours < 12 and not am: hours += 12
-    elif match_24: 
+    elif match_24 := TIME_RE_24H.search(time_string):
         hours = int(match_24[1])
         minutes = int(match_24[2])
     else:
@@ -135,53 +248,60 @@ def parse_time(time_string: str) -> datetime:
     return now.replace(hour=hours, minute=minutes, second=seconds) + timedelta(days=add_days)
 
 
-def parse_date(date_string:str) -> datetime:
-    date_string = date_string.lower()
-    now = datetime.now(PACIFIC_TZ).replace(microsecond=0)
-    date_match_intl = re.search(DATE_PATTERN_INTL, date_string)
-    date_match_us = re.search(DATE_PATTERN_US, date_string)
+def parse_date(date_string: str, now: datetime = None) -> datetime:
+    return _parse_date(date_string.lower(), now or get_now())
+
+
+def _parse_date(date_string: str, now: datetime) -> datetime:
+    # date_string must already be lowercased
     if date_string.endswith("day"):
-        for i in range(1,8):
-            check_day = (now + timedelta(days=i))
-            if date_string.lower() == check_day.strftime("%A").lower():
-                return check_day
+        if date_string in WEEKDAYS:
+            days_ahead = (WEEKDAYS.index(date_string) - now.weekday()) % 7 or 7
+            return now + timedelta(days=days_ahead)
         return False
     elif date_string == "tomorrow":
         return now + timedelta(days=1)
-    elif date_match_intl != None:
+    elif date_match_intl := DATE_RE_INTL.search(date_string):
         y = int(date_match_intl[1])
         m = int(date_match_intl[2])
         d = int(date_match_intl[3])
-    elif date_match_us:
+    elif date_match_us := DATE_RE_US.search(date_string):
         m = int(date_match_us[1])
         d = int(date_match_us[2])
-        try: 
+        if date_match_us[3]:
             y = int(date_match_us[3])
-        except Exception: 
+        else:
             y = now.year
-            if now.replace(month=m, day=d) < now:
-                y += 1
+            try:
+                if now.replace(month=m, day=d) < now:
+                    y += 1
+            except ValueError:
+                return False
+    else:
+        return False
     try: return now.replace(year=y, month=m, day=d)
-    except Exception: return False 
+    except Exception: return False
 
 
 async def is_user_chat_admin(update: Update):
     if update.effective_chat.id >= 0: return True #private
-    admins = await update.effective_chat.get_administrators()
-    for admin in admins:
-        if admin.user.id == update.effective_user.id: return True
-    return False
+    return await admin_cache.is_admin(update.effective_chat, update.effective_user.id)
 
 
 def get_token():
+    if BOT_TOKEN: return BOT_TOKEN
     with open("token.txt", "r") as tkfile:
         token = tkfile.read().strip()
     if token: return token
     else: sys.exit("Create a file called token.txt and add your bot token to it.")
 
 
-def parse_reminder(chat_id:int, from_user:str, args:tuple[str]) -> db.Reminder:
-    now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+def parse_reminder(chat_id:int, from_user:str, args:tuple[str], now: datetime = None) -> db.Reminder:
+    """Parses /remind arguments in one pass over the words.
+
+    Every word is lowercased once, the clock is read once, and each candidate time is parsed at most once.
+    """
+    now = now or get_now()
     reminder = db.Reminder(
         chat_id=chat_id,
         when=now,
@@ -189,11 +309,19 @@ def parse_reminder(chat_id:int, from_user:str, args:tuple[str]) -> db.Reminder:
         target_user=args[0],
         subject=""
     )
+    words = [a.lower() for a in args]
+    parsed_times = {}
+
+    def time_of(value: str) -> datetime:
+        if value not in parsed_times:
+            parsed_times[value] = _parse_time(value.strip(), now)
+        return parsed_times[value]
+
     indicies = {}
-    when = now 
+    when = now
     keywords = {"at": 2,"in": 2,"on": 1,"tomorrow": 0}
     skip_next = False
-    for index,word in enumerate([a.lower() for a in args]):
+    for index,word in enumerate(words):
         #get ranges for each part of the sentence structure
         if skip_next:
             skip_next = False
@@ -207,41 +335,46 @@ def parse_reminder(chat_id:int, from_user:str, args:tuple[str]) -> db.Reminder:
                 if when.date() == now.date():
                     when += timedelta(days=1)
         elif indicies and cur_kw in indicies:
-            if indicies[cur_kw]["finished"]: continue
-
-            if indicies[cur_kw]["from"] == -1: indicies[cur_kw]["from"] = index
-            indicies[cur_kw]["to"] = index + 1
-            cur_kw_args = args[indicies[cur_kw]["from"]:indicies[cur_kw]["to"]]
-            value = " ".join(cur_kw_args)
-            indicies[cur_kw]["value"] = value
-            d,t = (parse_date(value), parse_time(value))
-            greedy = False if index + 1 >= len(args) else parse_time(value + " " + args[index+1])
-            if cur_kw in["at","in"] and (t or greedy):
-                indicies[cur_kw]["finished"] = True
-                if greedy:
-                    t = greedy
-                    skip_next = True
-                    indicies[cur_kw]["to"] += 1 
-                if t.date() != now.date() and when.date() == now.date(): 
-                    #if parse_time modifies date, and the date hasn't been modified elsewhere
-                    when = t                   
-                else:
-                    when = when.replace(hour=t.hour, minute=t.minute, second=t.second)
-            elif cur_kw == "on" and d:
-                indicies[cur_kw]["finished"] = True
-                when = when.replace(year=d.year,  month=d.month, day=d.day)
-            elif cur_kw == "in" and len(cur_kw_args) < 2:
-                pass
-            else: #couldn't parse kw, likely used in subject. i.e. yodel 'at' turtles
-                indicies.pop(cur_kw)
-    
+            kw = indicies[cur_kw]
+            if kw["finished"]: continue
+
+            if kw["from"] == -1: kw["from"] = index
+            kw["to"] = index + 1
+            value = word if kw["from"] == index else " ".join(words[kw["from"]:kw["to"]])
+            kw["value"] = value
+            if cur_kw in ["at","in"]:
+                # prefer the longer match, i.e. "4:20 p.m." over "4:20"
+                greedy = False if index + 1 >= len(words) else time_of(value + " " + words[index+1])
+                t = greedy or time_of(value)
+                if t:
+                    kw["finished"] = True
+                    if greedy:
+                        skip_next = True
+                        kw["to"] += 1
+                    if t.date() != now.date() and when.date() == now.date():
+                        #if parse_time modifies date, and the date hasn't been modified elsewhere
+                        when = t
+                    else:
+                        when = when.replace(hour=t.hour, minute=t.minute, second=t.second)
+                    continue
+                if cur_kw == "in" and kw["to"] - kw["from"] < 2:
+                    continue
+            elif cur_kw == "on":
+                d = _parse_date(value, now)
+                if d:
+                    kw["finished"] = True
+                    when = when.replace(year=d.year,  month=d.month, day=d.day)
+                    continue
+            #couldn't parse kw, likely used in subject. i.e. yodel 'at' turtles
+            indicies.pop(cur_kw)
+
     if not "at" in indicies and not "in" in indicies:
         return False
-    
+
     if reminder.target_user.lower() == "me": reminder.target_user = reminder.from_user
     else: reminder.target_user = reminder.target_user.lstrip("@")
 
-    subject_words = args.copy()
+    subject_words = list(args)
     for key in indicies:
         i = indicies[key]
         if i["from"] == -1: i["to"] = i["index"] + 1
@@ -251,4 +384,5 @@ def parse_reminder(chat_id:int, from_user:str, args:tuple[str]) -> db.Reminder:
     reminder.subject = " ".join([w for w in subject_words[1:] if w != ""])
     reminder.when = when
     reminder.update_job_name()
+    reminder.schedule_next(when.tzinfo)
     return reminder
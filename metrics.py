@@ -0,0 +1,234 @@
+# prometheus text-format metrics on a local http port. handlers, job queue
+# callbacks, sql statements and telegram sends are timed here, and the stats()
+# of the caches, the outbox and the schedulers are exported as gauges.
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from telegram.ext import ApplicationHandlerStop, JobQueue
+
+from constants import METRICS_LISTEN, METRICS_PORT
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# series are updated from the db threads as well as the event loop
+_lock = threading.Lock()
+_metrics: list = []
+_stats: dict = {}
+# sql statements run on behalf of the handler in progress, see timed_handler
+_queries: contextvars.ContextVar = contextvars.ContextVar("queries", default=None)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.buckets = buckets
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._series: dict[tuple, list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def sum(self, *labels) -> float:
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+HANDLER_SECONDS = Histogram("awoo_handler_seconds", "Time spent in an update handler.", ("handler",))
+HANDLER_ERRORS = Counter("awoo_handler_errors_total", "Update handlers that raised.", ("handler",))
+HANDLER_QUERIES = Histogram("awoo_handler_db_queries", "SQL statements run while handling one update.",
+                            ("handler",), COUNT_BUCKETS)
+JOB_SECONDS = Histogram("awoo_job_seconds", "Time spent in a job queue callback.", ("job",))
+JOB_LAG_SECONDS = Histogram("awoo_job_lag_seconds", "How long after its scheduled time a job was started.",
+                            ("job",), LAG_BUCKETS)
+DB_QUERY_SECONDS = Histogram("awoo_db_query_seconds", "SQL statement execution time.", ("statement",))
+SEND_SECONDS = Histogram("awoo_telegram_send_seconds", "Latency of bot.send_message and edit_message_text calls.", ("result",))
+
+
+def register_stats(prefix: str, stats):
+    """Exports the numbers in stats() as awoo_<prefix>_<key> gauges, read on every scrape."""
+    _stats[prefix] = stats
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, stats in _stats.items():
+        for key, value in stats().items():
+            if isinstance(value, (int, float)):
+                name = f"awoo_{prefix}_{key}"
+                lines.extend((f"# TYPE {name} gauge", f"{name} {float(value)}"))
+    return "\n".join(lines) + "\n"
+
+
+def timed_handler(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        queries = [0]
+        token = _queries.set(queries)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+            HANDLER_QUERIES.observe(queries[0], name)
+            _queries.reset(token)
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Wraps the callback of every handler added so far. Call it after the last add_handler."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback)
+
+
+class LagTimingExecutor(AsyncIOExecutor):
+    """Records how late each job is handed over compared with the run time it was scheduled for."""
+
+    def _do_submit_job(self, job, run_times):
+        lag = datetime.now(tz=timezone.utc) - min(run_times)
+        JOB_LAG_SECONDS.observe(max(lag.total_seconds(), 0), job.args[1].callback.__name__)
+        return super()._do_submit_job(job, run_times)
+
+
+class InstrumentedJobQueue(JobQueue):
+    """A JobQueue that times its callbacks and how late they start."""
+
+    def __init__(self):
+        super().__init__()
+        self._executor = LagTimingExecutor()
+        self.scheduler.configure(**self.scheduler_configuration)
+
+    @staticmethod
+    async def job_callback(job_queue, job) -> None:
+        started = time.perf_counter()
+        try:
+            await JobQueue.job_callback(job_queue, job)
+        finally:
+            JOB_SECONDS.observe(time.perf_counter() - started, job.callback.__name__)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    DB_QUERY_SECONDS.observe(elapsed, statement.split(None, 1)[0].upper())
+    queries = _queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def instrument_db():
+    """Times every statement on every engine, including ones the tests create."""
+    if not event.contains(Engine, "before_cursor_execute", _before_execute):
+        event.listen(Engine, "before_cursor_execute", _before_execute)
+        event.listen(Engine, "after_cursor_execute", _after_execute)
+
+
+class MetricsServer:
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT):
+        self.listen = listen
+        self.port = port
+        self._server: asyncio.AbstractServer = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Serving metrics on http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readuntil(b"\r\n\r\n")).split(b"\r\n", 1)[0].decode("latin-1")
+            method, target, _ = request_line.split(" ", 2)
+            if method == "GET" and target.split("?", 1)[0] == "/metrics":
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, time, timedelta, timezone
 from zoneinfo import ZoneInfo
 from sqlalchemy import (
     Boolean,
@@ -7,17 +7,150 @@ from sqlalchemy import (
     Integer,
     String,
     DateTime,
+    Index,
+    TypeDecorator,
     create_engine,
+    event,
+    inspect,
     and_)
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, validates
+from sqlalchemy.pool import QueuePool
 
-engine = create_engine('sqlite:///data/chats.db')  # , echo=True
+from constants import DB_THREADS, DB_URL, PACIFIC_TZ, SQLITE_PRAGMAS
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def make_engine(url: str, **kwargs):
+    """A pooled sqlite engine with the pragmas from SQLITE_PRAGMAS set once on every new connection."""
+    if make_url(url).database not in (None, "", ":memory:"):
+        # sqlalchemy 1.4 gives file databases a NullPool, which opens a connection and reruns the pragmas every call.
+        # pooled connections move between the db threads but are only ever used by one at a time
+        kwargs.setdefault("poolclass", QueuePool)
+        kwargs.setdefault("pool_size", DB_THREADS)
+        kwargs.setdefault("connect_args", {"check_same_thread": False})
+    new_engine = create_engine(url, **kwargs)
+    event.listen(new_engine, "connect", set_sqlite_pragmas)
+    return new_engine
+
+
+engine = make_engine(DB_URL)  # , echo=True
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def _add_next_fire(connection):
+    # the values are filled in by database.update_next_fires
+    if "next_fire" not in [c["name"] for c in inspect(connection).get_columns("reminder")]:
+        connection.exec_driver_sql("ALTER TABLE reminder ADD COLUMN next_fire DATETIME")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_reminder_next_fire ON reminder (next_fire)")
+
+
+def _add_lookup_indexes(connection):
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_reminder_name ON reminder (name)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_reminder_when ON reminder (\"when\")")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_reminder_chat_daily_when ON reminder (chat_id, is_daily, \"when\")"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_reminder_daily_next_fire ON reminder (is_daily, next_fire)"
+    )
+    # chat_id leads ix_reminder_chat_daily_when, so this one only costs writes now
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_reminder_chat_id")
+
+
+def _add_trigger_words(connection):
+    connection.exec_driver_sql("ALTER TABLE chat ADD COLUMN trigger_words VARCHAR(4000)")
+
+
+def _add_awoo_burst(connection):
+    connection.exec_driver_sql("ALTER TABLE chat ADD COLUMN awoo_window INTEGER")
+    connection.exec_driver_sql("ALTER TABLE chat ADD COLUMN awoo_cap INTEGER")
+
+
+def _add_match_columns(connection):
+    connection.exec_driver_sql("ALTER TABLE reminder ADD COLUMN minute_of_day INTEGER")
+    connection.exec_driver_sql("ALTER TABLE reminder ADD COLUMN from_user_lower VARCHAR(100)")
+    connection.exec_driver_sql("ALTER TABLE reminder ADD COLUMN target_user_lower VARCHAR(100)")
+    # when is stored as naive wall time, so strftime reads the hour and minute as the chat sees them
+    connection.exec_driver_sql(
+        "UPDATE reminder SET minute_of_day = CAST(strftime('%H', \"when\") AS INTEGER) * 60"
+        " + CAST(strftime('%M', \"when\") AS INTEGER), "
+        "from_user_lower = lower(from_user), target_user_lower = lower(target_user)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_reminder_chat_daily_minute ON reminder (chat_id, is_daily, minute_of_day, \"when\")"
+    )
+
+
+# (version, migration) pairs, applied in order to databases whose user_version is lower. a new
+# database gets the current schema from create_all and starts at the last version.
+MIGRATIONS = [
+    (1, _add_next_fire),
+    (2, _add_lookup_indexes),
+    (3, _add_trigger_words),
+    (4, _add_awoo_burst),
+    (5, _add_match_columns),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def init_db(bind=None) -> int:
+    """Brings the schema up to date and returns the version it started at."""
+    # WAL is kept in the database file, so it's set once here rather than on every connection
+    with (bind or engine).connect() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode = WAL")
+    with (bind or engine).begin() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        fresh = not inspect(connection).has_table("reminder")
+        # also adds tables that are new since the database was made, their indexes come with them
+        Base.metadata.create_all(connection)
+        for number, migration in MIGRATIONS:
+            if number > version and not fresh:
+                migration(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return version
 
 
-def init_db():
-    Base.metadata.create_all(engine)
+class UTCDateTime(TypeDecorator):
+    """An aware datetime stored as naive UTC, so instants from different zones compare correctly in sqlite."""
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return value.replace(tzinfo=timezone.utc) if value is not None else None
+
+
+def job_name(chat_id: int, when: datetime, from_user: str, is_daily: bool) -> str:
+    if is_daily:
+        return f"{chat_id}_{when.hour}_{when.minute}"
+    return f"{chat_id}_{from_user}_{when.month}_{when.day}_{when.hour}_{when.minute}"
+
+
+def next_fire_time(when: datetime, is_daily: bool, tz: ZoneInfo, after: datetime = None) -> datetime:
+    """The first utc instant after `after` (default now) that a reminder set for when goes off in zone tz."""
+    if not is_daily:
+        when = when if when.tzinfo else when.replace(tzinfo=tz)
+        return when.astimezone(timezone.utc)
+    after = (after or datetime.now(tz=timezone.utc)).astimezone(timezone.utc)
+    day = after.astimezone(tz).date()
+    at = time(hour=when.hour, minute=when.minute)
+    # comparing in utc, same-zone comparisons ignore the dst fold
+    next_fire = datetime.combine(day, at, tzinfo=tz).astimezone(timezone.utc)
+    if next_fire <= after:
+        next_fire = datetime.combine(day + timedelta(days=1), at, tzinfo=tz).astimezone(timezone.utc)
+    return next_fire
 
 
 class Reminder(Base):
@@ -26,15 +159,29 @@ class Reminder(Base):
     chat_id: int = Column(
         Integer,
         ForeignKey("chat.id"),
-        nullable=False,
-        index=True)
-    name: str = Column(String, nullable=False)
-    when: datetime = Column(DateTime(timezone=True), nullable=False)
+        nullable=False)
+    name: str = Column(String, nullable=False, index=True)
+    # wall time in the chat's zone, daily reminders only use the hour and minute
+    when: datetime = Column(DateTime(timezone=True), nullable=False, index=True)
+    # the next instant the reminder goes off, worked out in the chat's zone ahead of time
+    next_fire: datetime = Column(UTCDateTime, nullable=True, index=True)
     chat = relationship("Chat", back_populates="reminders")
     from_user: str = Column(String(100))
     is_daily: bool = Column(Boolean)
     target_user: str = Column(String(100), nullable=True)
     subject: str = Column(String(255), nullable=True)
+    # kept in step with when and the users by the validators below, for matching in sql
+    minute_of_day: int = Column(Integer, nullable=True)
+    from_user_lower: str = Column(String(100), nullable=True)
+    target_user_lower: str = Column(String(100), nullable=True)
+    __table_args__ = (
+        # a chat's daily or one-time reminders, in time order
+        Index("ix_reminder_chat_daily_when", "chat_id", "is_daily", "when"),
+        # a chat's reminders at a time of day in date order, and daily ones in /list order
+        Index("ix_reminder_chat_daily_minute", "chat_id", "is_daily", "minute_of_day", "when"),
+        # one-time reminders coming due and past ones to purge
+        Index("ix_reminder_daily_next_fire", "is_daily", "next_fire"),
+    )
 
     def __init__(self, chat_id: Integer, when: datetime, from_user: String,
                  target_user: String = None, subject: String = None):
@@ -45,20 +192,33 @@ class Reminder(Base):
         self.subject = subject
         self.is_daily = not target_user and not subject
         self.name = self.get_job_name()
+        self.next_fire = None
+        if when.tzinfo:
+            self.schedule_next(when.tzinfo)
+
+    @validates("when")
+    def _validate_when(self, key, when: datetime) -> datetime:
+        self.minute_of_day = when.hour * 60 + when.minute if when else None
+        return when
+
+    @validates("from_user", "target_user")
+    def _validate_user(self, key, user: str) -> str:
+        setattr(self, f"{key}_lower", user.lower() if user else None)
+        return user
 
     def get_job_name(self):
-        rt: datetime = self.when
-        if self.is_daily:
-            return f"{self.chat_id}_{rt.hour}_{rt.minute}"
-        else:
-            return f"{self.chat_id}_{self.from_user}_{rt.month}_{rt.day}_{rt.hour}_{rt.minute}"
+        return job_name(self.chat_id, self.when, self.from_user, self.is_daily)
 
     def update_job_name(self):
         self.name = self.get_job_name()
 
-    def get_time(self):
-        # BUG chat isn't populated
-        return self.when.astimezone(tz=ZoneInfo(self.chat.time_zone))
+    def schedule_next(self, tz: ZoneInfo, after: datetime = None):
+        """Sets next_fire to the first time after `after` (default now) that the reminder goes off in zone tz."""
+        self.next_fire = next_fire_time(self.when, self.is_daily, tz, after)
+        return self.next_fire
+
+    def get_time(self, tz: ZoneInfo = PACIFIC_TZ) -> datetime:
+        return self.next_fire.astimezone(tz)
 
     def format_string(self):
         when = self.when
@@ -89,6 +249,13 @@ class Reminder(Base):
         return False
 
 
+class ImportProgress(Base):
+    """How many records of a bulk.py import source are in, committed along with them."""
+    __tablename__ = "import_progress"
+    source: str = Column(String, primary_key=True)
+    records: int = Column(Integer, nullable=False, default=0)
+
+
 class Chat(Base):
     __tablename__ = "chat"
     id: int = Column(Integer, primary_key=True)
@@ -96,6 +263,11 @@ class Chat(Base):
     time_zone: str = Column(String(100))
     stop_armed: bool = Column(Boolean, default=False)
     reminder_offset: int = Column(Integer, default=0)
+    # space separated, lowercase
+    trigger_words: str = Column(String(4000), nullable=True)
+    # seconds and howls for debouncing awoo replies, null uses the defaults
+    awoo_window: int = Column(Integer, nullable=True)
+    awoo_cap: int = Column(Integer, nullable=True)
     reminders: list[Reminder] = relationship(
         "Reminder", back_populates="chat", cascade="all, delete-orphan"
     )
@@ -118,3 +290,37 @@ class Chat(Base):
 
     def __repr__(self):
         return f"Chat({self.title}, id={self.id}"
+
+
+class Worker(Base):
+    """A running bot process, kept alive by its lease renewals so the others know how to split the shards."""
+    __tablename__ = "worker"
+    id: str = Column(String(100), primary_key=True)
+    expires: datetime = Column(DateTime(timezone=True), nullable=False)
+
+
+class Lease(Base):
+    """Ownership of one chat_id shard. Only the owner handles updates and schedules reminders for its chats."""
+    __tablename__ = "lease"
+    shard: int = Column(Integer, primary_key=True, autoincrement=False)
+    owner: str = Column(String(100), nullable=True)
+    expires: datetime = Column(DateTime(timezone=True), nullable=True)
+
+
+class ForwardedUpdate(Base):
+    """An update received by a worker that doesn't own its chat, waiting for the worker that does."""
+    __tablename__ = "forwarded_update"
+    id: int = Column(Integer, primary_key=True, autoincrement=True)
+    shard: int = Column(Integer, nullable=False)
+    payload: str = Column(String, nullable=False)
+    __table_args__ = (Index("ix_forwarded_update_shard", "shard", "id"),)
+
+
+class Firing(Base):
+    """One row per daily reminder firing, so a reminder can't go out twice during a lease handover."""
+    __tablename__ = "firing"
+    name: str = Column(String, primary_key=True)
+    # the utc instant it fired at as iso text, see database.firing_key. the column kept its old name, it used to be
+    # the utc date, which two firings share on the day clocks go forward
+    day: str = Column(String(32), primary_key=True)
+    owner: str = Column(String(100))
@@ -0,0 +1,239 @@
+# outbound message queue. every send and edit goes through here so the bot stays under
+# telegram's limits: a global token bucket, one bucket per chat, replies ahead
+# of scheduled fan-out, and RetryAfter only ever holds back the chat it was for.
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from heapq import heappop, heappush
+
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+from constants import OUTBOX_DRAIN_SECONDS, SEND_BURST, SEND_GLOBAL_PER_SECOND, SEND_GROUP_PER_MINUTE, \
+    SEND_PRIVATE_PER_SECOND
+
+PRIORITY_REPLY = 0
+PRIORITY_SCHEDULED = 1
+MAX_IDLE_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    @classmethod
+    def for_limit(cls, limit: float, period: float, burst: float):
+        """A bucket that never lets more than limit through in any window of period seconds."""
+        capacity = min(burst, limit)
+        rate = (limit - capacity) / period
+        return cls(rate=rate or limit / period, capacity=capacity)
+
+
+def retry_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class Outbox:
+    def __init__(self, global_per_second: float = SEND_GLOBAL_PER_SECOND,
+                 group_per_minute: float = SEND_GROUP_PER_MINUTE,
+                 private_per_second: float = SEND_PRIVATE_PER_SECOND,
+                 burst: float = SEND_BURST):
+        self.bot = None
+        self.group_per_minute = group_per_minute
+        self.private_per_second = private_per_second
+        self.burst = burst
+        self._global = TokenBucket.for_limit(global_per_second, 1, burst)
+        self._buckets: dict[int, TokenBucket] = {}
+        # chat_id -> heap of (priority, seq, enqueued_at, method, kwargs, future)
+        self._queues: dict[int, list] = {}
+        # a chat with queued messages is in exactly one of: ready, parked or in flight
+        self._ready: list = []
+        self._parked: list = []
+        self._scheduled: set[int] = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task = None
+        self._sending: set[asyncio.Task] = set()
+        self._lags = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retry_afters = 0
+
+    def start(self, bot):
+        self.bot = bot
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout: float = OUTBOX_DRAIN_SECONDS):
+        """Waits up to timeout for everything queued to go out, then stops. Whatever is left resolves None."""
+        if not self._worker:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Outbox stopped with {self.queue_depth() + len(self._sending)} messages unsent")
+        for task in [self._worker, *self._sending]:
+            task.cancel()
+        await asyncio.gather(self._worker, *self._sending, return_exceptions=True)
+        self._worker = None
+        for queue in self._queues.values():
+            for *_, future in queue:
+                if not future.done():
+                    future.set_result(None)
+        self._queues.clear()
+        self._ready.clear()
+        self._parked.clear()
+        self._scheduled.clear()
+
+    async def _drain(self):
+        while self._queues or self._sending:
+            await asyncio.sleep(0.05)
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_REPLY, **kwargs) -> asyncio.Future:
+        """Queues a message and returns a future for the sent Message, or None if sending failed."""
+        return self._queue("send_message", chat_id, priority, dict(kwargs, chat_id=chat_id, text=text))
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str, priority: int = PRIORITY_REPLY,
+                          **kwargs) -> asyncio.Future:
+        """Queues an edit and returns a future for the edited Message, True if it already read the same, or None
+        if editing failed."""
+        kwargs.update(chat_id=chat_id, message_id=message_id, text=text)
+        return self._queue("edit_message_text", chat_id, priority, kwargs)
+
+    def _queue(self, method: str, chat_id: int, priority: int, kwargs: dict) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        item = (priority, next(self._seq), time.monotonic(), method, kwargs, future)
+        heappush(self._queues.setdefault(chat_id, []), item)
+        if chat_id not in self._scheduled:
+            self._push_ready(chat_id)
+        return future
+
+    def _push_ready(self, chat_id: int):
+        priority, seq = self._queues[chat_id][0][:2]
+        heappush(self._ready, (priority, seq, chat_id))
+        self._scheduled.add(chat_id)
+        self._wakeup.set()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if not bucket:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                for idle_id in [i for i, b in self._buckets.items() if i not in self._scheduled and b.is_full()]:
+                    del self._buckets[idle_id]
+            if chat_id < 0:
+                bucket = TokenBucket.for_limit(self.group_per_minute, 60, self.burst)
+            else:
+                bucket = TokenBucket.for_limit(self.private_per_second, 1, self.burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._parked and self._parked[0][0] <= now:
+                _, chat_id = heappop(self._parked)
+                self._scheduled.discard(chat_id)
+                self._push_ready(chat_id)
+            if not self._ready:
+                timeout = self._parked[0][0] - now if self._parked else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            wait = self._global.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, chat_id = heappop(self._ready)
+            bucket = self._bucket(chat_id)
+            wait = bucket.wait_time()
+            if wait > 0:
+                heappush(self._parked, (now + wait, chat_id))
+                continue
+            bucket.take()
+            self._global.take()
+            task = asyncio.create_task(self._send(chat_id, heappop(self._queues[chat_id])))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int, item: tuple):
+        _, _, enqueued_at, method, kwargs, future = item
+        started = time.perf_counter()
+        try:
+            message = await getattr(self.bot, method)(**kwargs)
+        except asyncio.CancelledError:
+            # stop() gave up waiting on it
+            if not future.done():
+                future.set_result(None)
+            raise
+        except RetryAfter as e:
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started, "retry_after")
+            # put it back at the front of this chat's queue and park only this chat
+            self.retry_afters += 1
+            heappush(self._queues[chat_id], item)
+            heappush(self._parked, (time.monotonic() + retry_seconds(e), chat_id))
+            logging.info(f"Telegram asked to retry chat {chat_id} after {retry_seconds(e)}s")
+            self._wakeup.set()
+            return
+        except Exception as e:
+            if isinstance(e, BadRequest) and "not modified" in str(e).lower():
+                # an edit to the text the message already has, e.g. a button pressed twice. nothing left to do
+                metrics.SEND_SECONDS.observe(time.perf_counter() - started, "not_modified")
+                message = True
+            else:
+                metrics.SEND_SECONDS.observe(time.perf_counter() - started, "error")
+                self.failed += 1
+                logging.info(f"Failed {method} to {chat_id} with the following error: {str(e)}")
+                message = None
+        else:
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started, "ok")
+            self.sent += 1
+            self._lags.append(time.monotonic() - enqueued_at)
+        if not future.done():
+            future.set_result(message)
+        self._scheduled.discard(chat_id)
+        if self._queues[chat_id]:
+            self._push_ready(chat_id)
+        else:
+            del self._queues[chat_id]
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "queue_depth": self.queue_depth(),
+            "chats_waiting": len(self._parked),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_afters": self.retry_afters,
+            "send_lag_p50": lags[len(lags) // 2] if lags else 0,
+            "send_lag_p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0,
+            "send_lag_max": lags[-1] if lags else 0,
+        }
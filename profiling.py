@@ -0,0 +1,137 @@
+# opt-in profiling for when the bot lags. while turned on, every update runs
+# under cProfile and the ones slower than the threshold are saved to
+# PROFILE_DIR, all of them add up into one set of totals that can be dumped as
+# the top hot functions. a slow-query log catches sql that takes too long.
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from constants import PROFILE_DIR, PROFILE_HANDLERS, PROFILE_THRESHOLD_MS, PROFILE_TOP_N, SLOW_QUERY_MS
+
+MAX_LOGGED_PARAMETERS = 500
+
+
+def _timestamp() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+class HandlerProfiler:
+    def __init__(self, enabled: bool = PROFILE_HANDLERS, threshold_ms: float = PROFILE_THRESHOLD_MS,
+                 directory: str = PROFILE_DIR, top_n: int = PROFILE_TOP_N):
+        self.enabled = enabled
+        self.threshold = threshold_ms / 1000
+        self.directory = directory
+        self.top_n = top_n
+        self._totals: pstats.Stats = None
+        # cProfile can't nest, an update that starts while another is profiled is only timed
+        self._active = False
+        self.profiled = 0
+        self.saved = 0
+
+    def wrap(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            if not self.enabled or self._active:
+                return await callback(update, context)
+            profile = cProfile.Profile()
+            self._active = True
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                return await callback(update, context)
+            finally:
+                profile.disable()
+                self._active = False
+                self._record(name, profile, time.perf_counter() - started)
+        return wrapper
+
+    def instrument(self, application):
+        """Wraps the callback of every handler added so far. Call it after the last add_handler."""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = self.wrap(handler.callback)
+
+    def _record(self, name: str, profile: cProfile.Profile, elapsed: float):
+        # the profile covers anything else the event loop ran while this update was awaiting
+        self.profiled += 1
+        if self._totals is None:
+            self._totals = pstats.Stats(profile)
+        else:
+            self._totals.add(profile)
+        if elapsed >= self.threshold:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{name}-{_timestamp()}.prof")
+            profile.dump_stats(path)
+            self.saved += 1
+            logging.warning(f"{name} took {elapsed * 1000:.0f}ms, profile saved to {path}")
+
+    def toggle(self) -> bool:
+        self.enabled = not self.enabled
+        logging.info(f"Handler profiling {'on' if self.enabled else 'off'}")
+        return self.enabled
+
+    def top(self, n: int = None) -> str:
+        """The n hottest functions by cumulative time over every profiled update, as pstats prints them."""
+        if self._totals is None:
+            return ""
+        out = io.StringIO()
+        self._totals.stream = out
+        self._totals.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(n or self.top_n)
+        return out.getvalue()
+
+    def dump(self) -> str:
+        """Writes top() to a file and returns its path, or None if nothing has been profiled yet."""
+        report = self.top()
+        if not report:
+            logging.info("Nothing has been profiled yet, send SIGUSR2 or set AWOO_PROFILE to turn profiling on")
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"top-{_timestamp()}.txt")
+        with open(path, "w") as f:
+            f.write(report)
+        logging.info(f"Top {self.top_n} functions over {self.profiled} update(s) written to {path}")
+        return path
+
+    def add_signal_handlers(self, loop):
+        """SIGUSR2 turns profiling on and off, SIGUSR1 dumps the hot functions. Not available on windows."""
+        if hasattr(signal, "SIGUSR1"):
+            loop.add_signal_handler(signal.SIGUSR1, self.dump)
+            loop.add_signal_handler(signal.SIGUSR2, self.toggle)
+
+    def stats(self) -> dict:
+        return {"enabled": int(self.enabled), "profiled": self.profiled, "saved": self.saved}
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold = threshold_ms / 1000
+        self.slow = 0
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["slow_query_started"].pop()
+        if elapsed >= self.threshold:
+            self.slow += 1
+            shown = repr(parameters)
+            if len(shown) > MAX_LOGGED_PARAMETERS:
+                shown = shown[:MAX_LOGGED_PARAMETERS] + "..."
+            logging.warning(f"Slow query ({elapsed * 1000:.1f}ms): {' '.join(statement.split())} {shown}")
+
+    def stats(self) -> dict:
+        return {"slow": self.slow}
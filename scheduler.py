@@ -0,0 +1,112 @@
+# rolling window for one-time reminders. only reminders due before the
+# horizon live in the job queue, later ones stay in the db until a page-in
+# job moves the horizon past them.
+# daily reminders are indexed by the utc minute of day they next go off, so
+# the job queue holds one repeating job per busy minute instead of one per
+# reminder.
+from datetime import datetime, timedelta
+from random import randrange
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+import models as db
+from constants import PACIFIC_TZ, REMINDER_WINDOW_MINUTES
+from functions import localize
+
+
+class ReminderScheduler:
+    def __init__(self, window: timedelta = timedelta(minutes=REMINDER_WINDOW_MINUTES)):
+        self.window = window
+        # every one-time reminder due before this has been handed to the job queue
+        self.horizon: datetime = None
+
+    def in_window(self, when: datetime) -> bool:
+        return self.horizon is not None and localize(when) < self.horizon
+
+    def advance(self, now: datetime = None) -> tuple[datetime, datetime]:
+        """Moves the horizon to now + window and returns the (start, end) range that still has to be paged in.
+
+        The horizon moves before the range is queried, so a reminder saved while the query runs is either
+        scheduled by the command that created it or picked up by the query, never neither.
+        """
+        now = now or datetime.now(tz=PACIFIC_TZ)
+        start = self.horizon
+        end = max(now + self.window, start) if start else now + self.window
+        self.horizon = end
+        return start, end
+
+
+class DailyEntry(NamedTuple):
+    fire_at: datetime
+    reminder: db.Reminder
+    offset: int
+    tz: ZoneInfo
+
+
+class DailyBuckets:
+    def __init__(self):
+        # utc minute of day -> reminder name -> entry
+        self._buckets: dict[int, dict[str, DailyEntry]] = {}
+        self._minute_of: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._minute_of)
+
+    def __contains__(self, name: str):
+        return name in self._minute_of
+
+    def minutes(self) -> list[int]:
+        return list(self._buckets)
+
+    def get(self, name: str) -> DailyEntry:
+        minute = self._minute_of.get(name)
+        return None if minute is None else self._buckets[minute][name]
+
+    def add(self, reminder: db.Reminder, offset: int = 0, tz: ZoneInfo = PACIFIC_TZ, now: datetime = None) -> int:
+        """Files the reminder under the minute of its next firing and returns that minute.
+
+        A chat's random offset is drawn here, once per firing, so it moves the reminder to another bucket
+        rather than needing a job of its own. An offset can't pull the firing back before now.
+        """
+        self.remove(reminder.name)
+        fire_at = reminder.next_fire
+        if offset:
+            fire_at += timedelta(minutes=randrange(0, offset * 2) - offset)
+        if now and fire_at < now:
+            fire_at = now
+        minute = fire_at.hour * 60 + fire_at.minute
+        self._buckets.setdefault(minute, {})[reminder.name] = DailyEntry(fire_at, reminder, offset, tz)
+        self._minute_of[reminder.name] = minute
+        return minute
+
+    def remove(self, name: str) -> int:
+        """Drops a reminder and returns its minute if that left the bucket empty, otherwise None."""
+        minute = self._minute_of.pop(name, None)
+        if minute is None:
+            return None
+        bucket = self._buckets[minute]
+        del bucket[name]
+        if not bucket:
+            del self._buckets[minute]
+            return minute
+        return None
+
+    def remove_chats(self, chat_ids) -> set[int]:
+        """Drops every reminder for the given chats and returns the minutes that are now empty."""
+        chat_ids = set(chat_ids)
+        names = [name for bucket in self._buckets.values() for name, entry in bucket.items()
+                 if entry.reminder.chat_id in chat_ids]
+        return {minute for minute in map(self.remove, names) if minute is not None}
+
+    def chat_ids(self) -> set[int]:
+        return {entry.reminder.chat_id for bucket in self._buckets.values() for entry in bucket.values()}
+
+    def pop_due(self, minute: int, now: datetime, slack: timedelta = timedelta(minutes=1)) -> list[DailyEntry]:
+        """Removes and returns the entries in a bucket that are due by now, later days' entries stay put."""
+        due = [entry for entry in self._buckets.get(minute, {}).values() if entry.fire_at <= now + slack]
+        for entry in due:
+            self.remove(entry.reminder.name)
+        return due
+
+    def stats(self) -> dict:
+        return {"buckets": len(self._buckets), "reminders": len(self._minute_of)}
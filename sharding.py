@@ -0,0 +1,62 @@
+# splits the chats between worker processes that share the db. chat ids hash
+# into a fixed number of shards and each worker holds leases on some of them.
+# a worker only handles updates and schedules reminders for chats in its own
+# shards, and a crashed worker's shards are claimed once its leases expire.
+# telegram sends each update to one worker only, so one for a chat in another
+# worker's shard is forwarded through the db for the owner to pick up.
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+
+import database
+from constants import FORWARD_BATCH, LEASE_SECONDS, SHARD_COUNT, WORKER_COUNT, WORKER_ID
+
+
+class ShardLeases:
+    def __init__(self, owner: str = WORKER_ID, shard_count: int = SHARD_COUNT, workers: int = WORKER_COUNT,
+                 ttl: timedelta = timedelta(seconds=LEASE_SECONDS)):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.shard_count = shard_count
+        self.ttl = ttl
+        # a single worker owns everything and never touches the lease table
+        self.enabled = workers > 1
+        self.owned: set[int] = set() if self.enabled else set(range(shard_count))
+
+    def shard_of(self, chat_id: int) -> int:
+        return chat_id % self.shard_count
+
+    def owns(self, chat_id: int) -> bool:
+        return self.shard_of(chat_id) in self.owned
+
+    def renew(self, session, now: datetime = None) -> tuple[set[int], set[int]]:
+        """Renews the leases and returns the (gained, lost) shards. Meant to run through database.run."""
+        if not self.enabled:
+            return set(), set()
+        now = now or datetime.now(tz=timezone.utc)
+        database.ensure_leases(session, self.shard_count)
+        owned = database.renew_leases(session, self.owner, self.shard_count, now, self.ttl)
+        gained, lost = owned - self.owned, self.owned - owned
+        # replaced in one assignment, owns() is called from the event loop
+        self.owned = owned
+        return gained, lost
+
+    def release(self, session):
+        if self.enabled:
+            database.release_leases(session, self.owner)
+            self.owned = set()
+
+    def forward(self, session, chat_id: int, payload: str):
+        """Queues an update for whichever worker owns chat_id's shard, now or once the lease is taken."""
+        database.forward_update(session, self.shard_of(chat_id), payload)
+
+    def take_forwarded(self, session, limit: int = FORWARD_BATCH) -> list[str]:
+        """Updates other workers forwarded to the shards owned here, oldest first."""
+        return database.take_forwarded_updates(session, self.owned, limit) if self.enabled else []
+
+    def claim(self, session, name: str, day: str) -> bool:
+        """True if this worker should send reminder name's firing at day, a firing_key. Only one worker gets True."""
+        return not self.enabled or database.claim_firing(session, name, day, self.owner)
+
+    def claim_all(self, session, firings: list[tuple[str, str]]) -> set[tuple[str, str]]:
+        """claim for a batch of (name, day) pairs in one transaction."""
+        return set(firings) if not self.enabled else database.claim_firings(session, firings, self.owner)
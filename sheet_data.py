@@ -0,0 +1,90 @@
+# word data from the google sheet. the parsed data is kept in a snapshot file
+# so the bot can start without the sheet, and refreshes run in the background
+# with conditional requests, replacing the whole data dict in one assignment.
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+import httpx
+
+from constants import DATA_SNAPSHOT_PATH, GOOGLE_SHEET_ID, GOOGLE_SHEET_URL
+from functions import compile_templates, parse_formats_csv, parse_words_csv
+
+SHEETS = ("Formats", "Words")
+
+
+class SheetData:
+    def __init__(self, snapshot_path: str = DATA_SNAPSHOT_PATH, url: str = GOOGLE_SHEET_URL,
+                 sheet_id: str = GOOGLE_SHEET_ID):
+        self.snapshot_path = snapshot_path
+        self.url = url
+        self.sheet_id = sheet_id
+        self.data: dict = {}
+        # sheet name -> {"etag": ..., "last_modified": ...} from the last 200 response
+        self.validators: dict[str, dict] = {}
+        self._refreshing: asyncio.Task = None
+
+    def load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, "r") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self._swap(snapshot["formats"], snapshot["words"])
+        except (OSError, ValueError, KeyError) as e:
+            logging.info(f"No usable word snapshot at {self.snapshot_path}: {str(e)}")
+            return False
+        self.validators = snapshot.get("validators", {})
+        return True
+
+    def _swap(self, formats, words: dict):
+        data = {"formats": tuple(formats), "words": words}
+        data["templates"] = compile_templates(data)
+        # readers only ever see the old dict or the finished new one
+        self.data = data
+
+    def _save_snapshot(self):
+        snapshot = {"formats": self.data["formats"], "words": self.data["words"], "validators": self.validators}
+        directory = os.path.dirname(self.snapshot_path) or "."
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as tmp_file:
+            json.dump(snapshot, tmp_file)
+        os.replace(tmp_file.name, self.snapshot_path)
+
+    async def refresh(self) -> bool:
+        """Fetches the sheets if they changed. Returns True when the data was replaced.
+
+        Concurrent callers share the same fetch. Network and parse errors are raised and the current data is kept.
+        """
+        if not self._refreshing or self._refreshing.done():
+            self._refreshing = asyncio.get_running_loop().create_task(self._refresh())
+        return await asyncio.shield(self._refreshing)
+
+    async def _refresh(self) -> bool:
+        texts, validators = {}, {}
+        async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
+            for sheet in SHEETS:
+                headers = {}
+                cached = self.validators.get(sheet, {}) if self.data else {}
+                if cached.get("etag"):
+                    headers["If-None-Match"] = cached["etag"]
+                if cached.get("last_modified"):
+                    headers["If-Modified-Since"] = cached["last_modified"]
+                response = await client.get(self.url.format(sheet_id=self.sheet_id, sheet=sheet), headers=headers)
+                if response.status_code == 304:
+                    continue
+                response.raise_for_status()
+                texts[sheet] = response.text
+                validators[sheet] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+        if not texts:
+            return False
+        formats = parse_formats_csv(texts["Formats"]) if "Formats" in texts else self.data["formats"]
+        words = parse_words_csv(texts["Words"]) if "Words" in texts else self.data["words"]
+        self.validators.update(validators)
+        changed = not self.data or tuple(formats) != self.data["formats"] or words != self.data["words"]
+        if changed:
+            self._swap(formats, words)
+        await asyncio.to_thread(self._save_snapshot)
+        return changed
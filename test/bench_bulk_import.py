@@ -0,0 +1,112 @@
+# bulk.py against a made up dump: writes a legacy chats.json and the same data
+# as json lines, imports each into an empty db and reports records/sec and peak
+# RSS, then exports the db back out. the per-object ORM path is timed on a
+# slice of the reminders for comparison.
+# usage: python test/bench_bulk_import.py [chats] [reminders]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import json
+import logging
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+from random import Random
+
+import bulk
+import database
+import models as db
+from constants import DAILY, ONETIME
+
+ZONES = ("America/Los_Angeles", "America/New_York", "Europe/London", "Australia/Sydney")
+ORM_SLICE = 20000
+
+
+def write_legacy(path: str, chats: int, reminders: int, seed: int = 1):
+    rng = Random(seed)
+    start = datetime(2030, 1, 1)
+    per_chat = reminders // chats
+    with open(path, "w") as f:
+        f.write("{")
+        for i in range(chats):
+            daily = [f"{h:02d}:{m:02d}" for h, m in sorted({(rng.randrange(24), rng.randrange(60)) for _ in range(3)})]
+            onetime = [{"when": (start + timedelta(minutes=rng.randrange(525600))).isoformat(),
+                        "from_user": f"pup{n}", "target_user": rng.choice(("Alpha", "Beta")), "subject": "walk"}
+                       for n in range(per_chat - len(daily))]
+            chat = {"title": f"pack {i}", "time_zone": rng.choice(ZONES), "reminder_offset": rng.choice((0, 5)),
+                    DAILY: daily, ONETIME: onetime}
+            f.write(("," if i else "") + json.dumps(str(-i - 1)) + ":" + json.dumps(chat))
+        f.write("}")
+
+
+def use_fresh_db(tmp: str, name: str):
+    engine = db.make_engine(f"sqlite:///{os.path.join(tmp, name)}")
+    db.init_db(engine)
+    db.Session.configure(bind=engine)
+    return engine
+
+
+def orm_rate(legacy_path: str) -> float:
+    # what adding rows one db.Reminder at a time costs, on the first ORM_SLICE reminders
+    rows = []
+    for kind, row in bulk.read_records(legacy_path, "legacy", datetime.now().astimezone()):
+        if kind == "reminder":
+            rows.append(row)
+            if len(rows) == ORM_SLICE:
+                break
+    start = time.perf_counter()
+    with database.session_scope() as session:
+        for row in rows:
+            when = row["when"]
+            session.add(db.Reminder(row["chat_id"], when, row["from_user"], row["target_user"], row["subject"]))
+            session.flush()
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main(chats: int = 10000, reminders: int = 1000000):
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "chats.json")
+        write_legacy(legacy_path, chats, reminders)
+        print(f"legacy chats.json: {os.path.getsize(legacy_path) / 2**20:.0f} MiB")
+
+        engine = use_fresh_db(tmp, "legacy.db")
+        start = time.perf_counter()
+        counts = bulk.import_file(legacy_path)
+        elapsed = time.perf_counter() - start
+        print(f"import legacy | {counts['chats']} chats, {counts['reminders']} reminders in {elapsed:6.1f}s | "
+              f"{counts['records'] / elapsed:8.0f} records/sec")
+
+        jsonl_path = os.path.join(tmp, "dump.jsonl")
+        start = time.perf_counter()
+        exported = bulk.export_file(jsonl_path)
+        elapsed = time.perf_counter() - start
+        print(f"export        | {exported['chats'] + exported['reminders']} records in {elapsed:6.1f}s | "
+              f"{(exported['chats'] + exported['reminders']) / elapsed:8.0f} records/sec")
+        engine.dispose()
+
+        engine = use_fresh_db(tmp, "jsonl.db")
+        start = time.perf_counter()
+        counts = bulk.import_file(jsonl_path)
+        elapsed = time.perf_counter() - start
+        print(f"import jsonl  | {counts['chats']} chats, {counts['reminders']} reminders in {elapsed:6.1f}s | "
+              f"{counts['records'] / elapsed:8.0f} records/sec")
+        # running it again picks up after the last record and adds nothing
+        again = bulk.import_file(jsonl_path)
+        assert again["chats"] == again["reminders"] == 0, again
+        engine.dispose()
+
+        engine = use_fresh_db(tmp, "orm.db")
+        print(f"orm objects   | {orm_rate(legacy_path):8.0f} reminders/sec")
+        engine.dispose()
+    # ru_maxrss is KiB on linux
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
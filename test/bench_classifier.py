@@ -0,0 +1,88 @@
+# messages/sec of classify_message against the old stacked handlers, which
+# searched every message with the awoo pattern, then the bot name, and here
+# also a per-chat alternation of its trigger words. run over a synthetic chat
+# log with 0 to 1000 trigger words, checking both sort every message the same.
+# usage: python test/bench_classifier.py [messages]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import random
+import re
+import time
+
+from constants import AWOO_PATTERN, BOT_NAME
+from functions import classify_message, get_trigger_words
+
+AWOO_RE = re.compile(AWOO_PATTERN, re.I)
+BOT_NAME_RE = re.compile(BOT_NAME, re.I)
+CHATTER = ("so", "anyway", "the", "pack", "went", "to", "park", "today", "and", "it", "was", "great", "lol",
+           "did", "you", "see", "that", "moonlight", "walk", "later", "who", "is", "up", "for", "snacks", "brb",
+           "haha", "yeah", "no", "way", "tail", "wags", "sleepy", "pup", "morning", "night", "fur", "zoomies")
+HOWLS = ("awoo", "AWOOOO", "a0w00", "owo", "uwu", "awooo!")
+TRIGGER_COUNTS = (0, 10, 100, 1000)
+
+
+def make_log(count: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    log = []
+    for _ in range(count):
+        # mostly short lines, the odd wall of text
+        words = [rng.choice(CHATTER) for _ in range(rng.choice([1, 3, 6, 10, 15, 40, 200]))]
+        roll = rng.random()
+        if roll < 0.08:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(HOWLS))
+        elif roll < 0.1:
+            words.insert(rng.randrange(len(words) + 1), f"@{BOT_NAME}")
+        log.append(" ".join(words).capitalize())
+    return log
+
+
+def make_trigger_words(count: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    # a few that turn up in the log, the rest made up
+    words = rng.sample(CHATTER, min(3, count))
+    while len(words) < count:
+        words.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randrange(4, 10))))
+    return " ".join(words)
+
+
+def legacy_classify(text: str, trigger_re: re.Pattern = None) -> str:
+    if AWOO_RE.search(text):
+        return "awoo"
+    if BOT_NAME_RE.search(text):
+        return "mention"
+    if trigger_re and trigger_re.search(text):
+        return "trigger"
+    return "chatter"
+
+
+def replies(kind: str) -> bool:
+    return kind != "chatter"
+
+
+def rate(fn, log: list[str]) -> float:
+    start = time.perf_counter()
+    for text in log:
+        fn(text)
+    return len(log) / (time.perf_counter() - start)
+
+
+def main(count: int = 20000):
+    log = make_log(count)
+    for trigger_count in TRIGGER_COUNTS:
+        words = make_trigger_words(trigger_count)
+        trigger_words = get_trigger_words(words)
+        trigger_re = re.compile(rf"\b(?:{'|'.join(map(re.escape, words.split()))})\b", re.I) if words else None
+        for text in log:
+            # a message with both an awoo and a trigger word can be sorted either way, both get a howl
+            assert replies(classify_message(text, trigger_words)) == replies(legacy_classify(text, trigger_re)), text
+        print(f"{trigger_count:4} trigger words, before: {rate(lambda t: legacy_classify(t, trigger_re), log):10.0f} "
+              f"messages/sec, after: {rate(lambda t: classify_message(t, trigger_words), log):10.0f} messages/sec")
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,73 @@
+# job queue size and memory for many daily reminders, scheduled the old way
+# with one ptb job per reminder and the new way with one job per minute of day.
+# the job queue is never started, so nothing is sent.
+# usage: python test/bench_daily_buckets.py [reminders]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import logging
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from telegram.ext import ApplicationBuilder, ContextTypes
+
+import awoo
+import models as db
+
+
+async def noop(context):
+    pass
+
+
+def make_reminders(count: int, seed: int = 1) -> list[db.Reminder]:
+    rng = random.Random(seed)
+    now = datetime.now(tz=timezone.utc)
+    reminders = []
+    for chat_id in range(count):
+        when = datetime(2024, 1, 1, rng.randrange(24), rng.randrange(60), tzinfo=timezone.utc)
+        reminder = db.Reminder(chat_id=-chat_id - 1, when=when, from_user="bench")
+        reminder.schedule_next(timezone.utc, after=now)
+        reminders.append(reminder)
+    return reminders
+
+
+def measure(label: str, schedule, reminders: list[db.Reminder]):
+    application = ApplicationBuilder().token("123:abc").build()
+    context = ContextTypes.DEFAULT_TYPE(application=application)
+    awoo.daily_buckets = awoo.DailyBuckets()
+    awoo.bucket_jobs = {}
+    tracemalloc.start()
+    start = time.perf_counter()
+    for reminder in reminders:
+        schedule(context, reminder)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    jobs = len(application.job_queue.jobs())
+    print(f"{label}: {jobs:6} jobs, {memory / 1024 / 1024:7.2f} MiB, {len(reminders) / elapsed:8.0f} reminders/sec")
+
+
+def per_reminder_job(context, reminder: db.Reminder):
+    context.job_queue.run_once(noop, when=reminder.next_fire, chat_id=reminder.chat_id, name=reminder.name,
+                               data=reminder)
+
+
+def bucketed(context, reminder: db.Reminder):
+    awoo.register_reminder(context=context, reminder=reminder, reminder_offset=10, tz=timezone.utc)
+
+
+def main(count: int = 20000):
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+    reminders = make_reminders(count)
+    measure("one job per reminder", per_reminder_job, reminders)
+    measure("one job per minute  ", bucketed, reminders)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,131 @@
+# handler latency for a burst of updates fed through a real Application's update
+# queue, against fake_bot_api.py answering after API_LATENCY: chatter that writes,
+# /list that reads a page and checks admins with the api, and /help. compares db work on the event loop (old
+# shared session) with database.run(), handling updates one at a time and with
+# concurrent_updates. usage: python test/bench_db_latency.py [updates] [chats]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+
+import database
+import models as db
+from constants import CONCURRENT_UPDATES
+from fake_bot_api import FakeBotApi, chat, user
+
+TOKEN = "123456:bench"
+API_LATENCY = 0.02
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    message = {"message_id": update_id, "date": int(time.time()), "chat": chat(chat_id),
+               "from": user(7, "pup"), "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+async def simulate(api: FakeBotApi, updates: int, chats: int, offload: bool, concurrent: int) -> dict:
+    shared_session = db.Session()
+    db_latency, list_latency, light_latency = [], [], []
+    done = asyncio.Event()
+    start = 0
+
+    def finished(latency: list):
+        latency.append(time.perf_counter() - start)
+        if len(db_latency) + len(list_latency) + len(light_latency) == 3 * updates:
+            done.set()
+
+    async def db_handler(update, context):
+        # what parse_all_messages does for every line of chatter
+        if offload:
+            await database.run(database.set_stop_armed, chat_id=update.effective_chat.id, armed=False)
+        else:
+            database.set_stop_armed(shared_session, chat_id=update.effective_chat.id, armed=False)
+            shared_session.commit()
+        finished(db_latency)
+
+    async def list_handler(update, context):
+        chat_id = update.effective_chat.id
+        if offload:
+            await database.run(database.get_reminder_page, chat_id)
+        else:
+            database.get_reminder_page(shared_session, chat_id)
+        await context.bot.get_chat_administrators(chat_id)
+        finished(list_latency)
+
+    async def light_handler(update, context):
+        # a handler with no db work, e.g. /help, only waits its turn
+        finished(light_latency)
+
+    application = (ApplicationBuilder().token(TOKEN).base_url(api.base_url).job_queue(None)
+                   .concurrent_updates(concurrent).build())
+    application.add_handler(CommandHandler("help", light_handler))
+    application.add_handler(CommandHandler("list", list_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, db_handler))
+    burst = []
+    for i in range(updates):
+        for j, text in enumerate(("awoo", "/list", "/help")):
+            burst.append(Update.de_json(make_update(3 * i + j, -(i % chats) - 1, text), application.bot))
+
+    async with application:
+        await application.start()
+        # latency is measured from the moment the burst arrives, like a page of polled updates
+        start = time.perf_counter()
+        for update in burst:
+            application.update_queue.put_nowait(update)
+        await done.wait()
+        elapsed = time.perf_counter() - start
+        await application.stop()
+    shared_session.close()
+    return {
+        "db_p99_ms": percentile(db_latency, 0.99) * 1000,
+        "list_p99_ms": percentile(list_latency, 0.99) * 1000,
+        "light_p99_ms": percentile(light_latency, 0.99) * 1000,
+        "updates_per_sec": 3 * updates / elapsed,
+    }
+
+
+async def run_all(updates: int, chats: int):
+    api = FakeBotApi(TOKEN)
+    await api.start()
+    api.latency = API_LATENCY
+    try:
+        for label, offload, concurrent in (("on loop, in order", False, 1),
+                                           ("database.run, in order", True, 1),
+                                           (f"database.run, {CONCURRENT_UPDATES} at once", True, CONCURRENT_UPDATES)):
+            result = await simulate(api, updates, chats, offload, concurrent)
+            print(f"{label:28} chatter p99 {result['db_p99_ms']:8.2f} ms | list p99 {result['list_p99_ms']:8.2f} ms | "
+                  f"help p99 {result['light_p99_ms']:8.2f} ms | {result['updates_per_sec']:8.0f} updates/s")
+    finally:
+        await api.stop()
+
+
+def main(updates: int = 300, chats: int = 50):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = db.make_engine(f"sqlite:///{tmp}/chats.db")
+        db.init_db(engine)
+        db.Session.configure(bind=engine)
+        with database.session_scope() as session:
+            for i in range(chats):
+                session.add(db.Chat(chat_id=-i - 1, title=f"chat {i}"))
+        asyncio.run(run_all(updates, chats))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,73 @@
+# messages/sec of generate_message against the old findall/replace version,
+# plus a check that both produce the same text for the same seed.
+# usage: python test/bench_generate_message.py [messages]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import random
+import re
+import time
+
+from functions import compile_templates, generate_message, get_time_of_day
+
+DATA = {
+    "formats": (
+        "%greeting% pack! %reminder%",
+        "Good %tod%, %name%! %greeting% and %reminder%",
+        "%awoo% %greeting% %name%, it's %tod% so %reminder% %emoji%",
+        "%emoji% %emoji% %greeting% friends! Don't forget to %reminder% this %tod%. %awoo%",
+    ),
+    "words": {
+        "greeting": [" Hello ", "Howdy", "Good %tod%", "Hey there ", "Greetings"],
+        "reminder": ["Rise and shine!", " drink some water ", "stretch", " take your meds", "eat a snack "],
+        "name": ["pups", " wolves", "pack ", "floofs"],
+        "awoo": ["Awoo!", "AWOOOO", " awoo~ "],
+        "emoji": ["🐺", "🌕", "🐾 "],
+    },
+}
+
+
+def legacy_generate_message(data: dict):
+    words = data["words"]
+    the_message = str(random.choice(data["formats"]))
+    tod = get_time_of_day()
+    vars_to_replace = re.findall(r'\%[a-z_]+\%', the_message)
+    for index, current_var in enumerate(vars_to_replace):
+        key = str(current_var).replace('%', '')
+        if key == 'tod':
+            selected_word = tod
+        elif key == 'reminder':
+            selected_word = words[key][0] if tod == 'morning' else str(random.choice(words[key][1:])).strip()
+        else:
+            selected_word = str(random.choice(words[key])).strip()
+        if key == 'greeting' and index != 0:
+            selected_word = selected_word.lower()
+        the_message = the_message.replace(current_var, selected_word, 1)
+    return the_message.replace('%tod%', tod)
+
+
+def rate(fn, data: dict, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn(data)
+    return count / (time.perf_counter() - start)
+
+
+def main(count: int = 100000):
+    data = dict(DATA)
+    data["templates"] = compile_templates(data)
+    for seed in range(1000):
+        random.seed(seed)
+        expected = legacy_generate_message(data)
+        random.seed(seed)
+        assert generate_message(data) == expected, seed
+    print(f"before: {rate(legacy_generate_message, data, count):10.0f} messages/sec")
+    print(f"after:  {rate(generate_message, data, count):10.0f} messages/sec")
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
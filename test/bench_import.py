@@ -0,0 +1,37 @@
+# cold start of awoo.py: import time and peak RSS, as shipped and with pandas
+# loaded the way functions.py used to. each run is a fresh interpreter.
+# usage: python test/bench_import.py [runs]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+
+import subprocess
+import time
+
+VARIANTS = {
+    "without pandas": "import awoo",
+    "with pandas": "import pandas; import awoo",
+}
+
+
+def measure(code: str) -> tuple[float, float]:
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=parentdir)
+    _, _, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main(runs: int = 5):
+    for label, code in VARIANTS.items():
+        results = [measure(code) for _ in range(runs)]
+        best = min(r[0] for r in results)
+        rss = max(r[1] for r in results)
+        print(f"{label:15} | import {best * 1000:8.1f} ms (best of {runs}) | peak RSS {rss:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,146 @@
+# end to end load test. runs awoo.py in a scratch directory against
+# fake_bot_api.py and has N group chats send awoo chatter, /remind, /list and
+# /removereminder at a fixed total rate. reports throughput, reply latency
+# percentiles per kind of message and how close one-time reminders fired to
+# the time they were set for. awoo replies aren't debounced unless --awoo-window
+# is given, a held back awoo shows up as never answered.
+# usage: python test/bench_load.py [--chats 50] [--rate 20] [--duration 60] [--remind-in 1] [--awoo-window 0]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import argparse
+import asyncio
+import itertools
+import random
+import re
+import time
+from collections import deque
+
+from fake_bot_api import FakeBotApi, start_bot
+
+TOKEN = "123456:load-test"
+FIRED_RE = re.compile(r"remind you to (lf\d+)\.")
+# kind -> (weight, text), {n} is a number unique to the message
+TRAFFIC = {
+    "awoo": (60, "awoo awoo"),
+    "chatter": (20, "just pack chatter {n}"),
+    "remind": (10, "/remind me in {minutes} minute to lf{n}"),
+    "list": (7, "/list"),
+    "removereminder": (3, "/removereminder"),
+}
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+class LoadStats:
+    """Pairs the bot's messages with the updates that caused them."""
+
+    def __init__(self):
+        # chat_id -> (kind, pushed_at) for updates still waiting on a reply, replies go out in order per chat
+        self.waiting: dict[int, deque] = {}
+        self.latencies: dict[str, list[float]] = {kind: [] for kind in TRAFFIC}
+        # subject -> monotonic time it should fire
+        self.due: dict[str, float] = {}
+        self.firing_errors: list[float] = []
+        self.pushed = 0
+        self.replies = 0
+        self.unexpected = 0
+
+    def expect(self, chat_id: int, kind: str):
+        self.pushed += 1
+        if kind != "chatter":
+            self.waiting.setdefault(chat_id, deque()).append((kind, time.monotonic()))
+
+    def on_send(self, chat_id: int, text: str, params: dict):
+        now = time.monotonic()
+        fired = FIRED_RE.search(text)
+        if fired and fired.group(1) in self.due:
+            self.firing_errors.append(now - self.due.pop(fired.group(1)))
+            return
+        waiting = self.waiting.get(chat_id)
+        if not waiting:
+            self.unexpected += 1
+            return
+        kind, pushed_at = waiting.popleft()
+        self.latencies[kind].append(now - pushed_at)
+        self.replies += 1
+
+    def pending(self) -> int:
+        return sum(len(waiting) for waiting in self.waiting.values()) + len(self.due)
+
+
+async def generate(api: FakeBotApi, stats: LoadStats, chats: int, rate: float, duration: float, remind_in: int):
+    rng = random.Random(1)
+    kinds = list(TRAFFIC)
+    weights = [TRAFFIC[kind][0] for kind in kinds]
+    numbers = itertools.count()
+    started = time.monotonic()
+    for sent in itertools.count():
+        # paced against the start, so a slow push doesn't lower the rate
+        delay = started + sent / rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if time.monotonic() - started >= duration:
+            break
+        chat_id = -1000 - rng.randrange(chats)
+        kind = rng.choices(kinds, weights)[0]
+        n = next(numbers)
+        # a different user each time, two reminders from one user in the same minute would clash
+        api.push_message(chat_id, 2000 + n, f"pup{n}", TRAFFIC[kind][1].format(n=n, minutes=remind_in))
+        stats.expect(chat_id, kind)
+        if kind == "remind":
+            # the bot reads the clock with the seconds kept, so the reminder is due exactly remind_in minutes on
+            stats.due[f"lf{n}"] = time.monotonic() + remind_in * 60
+
+
+async def main(chats: int, rate: float, duration: float, remind_in: int, awoo_window: int):
+    stats = LoadStats()
+    api = FakeBotApi(TOKEN)
+    api.on_send = stats.on_send
+    await api.start()
+    bot, workdir = await start_bot(api, {"AWOO_REPLY_WINDOW": str(awoo_window)})
+    try:
+        await api.wait_polling()
+        print(f"bot is polling, sending {rate}/sec from {chats} chats for {duration:.0f}s")
+        started = time.monotonic()
+        await generate(api, stats, chats, rate, duration, remind_in)
+        # replies, then the last reminders, with some room for the outbox's per chat limits
+        deadline = time.monotonic() + remind_in * 60 + 30
+        while stats.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        elapsed = time.monotonic() - started
+    finally:
+        bot.terminate()
+        await bot.wait()
+        await api.stop()
+
+    print(f"{stats.pushed} updates, {stats.replies} replies, {stats.unexpected} unexpected messages, "
+          f"{stats.pending()} never answered")
+    print(f"throughput: {stats.replies / elapsed:.1f} replies/sec over {elapsed:.0f}s")
+    for kind, latencies in stats.latencies.items():
+        if latencies:
+            print(f"{kind:>15}: n={len(latencies):5} p50 {percentile(latencies, 0.5) * 1000:8.1f}ms "
+                  f"p95 {percentile(latencies, 0.95) * 1000:8.1f}ms p99 {percentile(latencies, 0.99) * 1000:8.1f}ms")
+    errors = stats.firing_errors
+    if errors:
+        print(f"reminder firing error: n={len(errors)} p50 {percentile(errors, 0.5):+.2f}s "
+              f"p99 {percentile(errors, 0.99):+.2f}s min {min(errors):+.2f}s max {max(errors):+.2f}s")
+    print(f"bot log: {os.path.join(workdir, 'bot.log')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=20, help="updates per second over all chats")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of traffic")
+    parser.add_argument("--remind-in", type=int, default=1, help="minutes ahead the /remind commands are set")
+    parser.add_argument("--awoo-window", type=int, default=0, help="seconds awoo replies are debounced over")
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.rate, args.duration, args.remind_in, args.awoo_window))
@@ -0,0 +1,201 @@
+# reminders/sec of parse_reminder against the old version that re-parsed every
+# word with uncompiled patterns, plus a check that both give the same reminder.
+# usage: python test/bench_parse_reminder.py [sentences]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+import models as db
+from constants import DATE_PATTERN_INTL, DATE_PATTERN_US, PACIFIC_TZ, TIME_PATTERN_12H, TIME_PATTERN_24H, \
+    TIME_PATTERN_IN
+from functions import parse_reminder
+
+NOW = datetime(2024, 3, 14, 9, 26, 53, tzinfo=PACIFIC_TZ)
+FILLER = ["yodel", "at", "the", "turtles", "on", "in", "a", "big", "way", "for", "awoo", "pack", "moon", "day"]
+TIMES = ["4:20 pm", "4:20 p.m.", "noon", "midnight", "16:20", "7am", "11 p.m.", "5 minutes", "2 hours", "3 days"]
+DATES = ["tomorrow", "friday", "sunday", "2025-01-06", "12/31", "7/4/2030"]
+
+
+def legacy_parse_time(time_string: str) -> datetime:
+    time_string = time_string.lower().strip()
+    now = NOW
+    match_in = re.search(TIME_PATTERN_IN, time_string)
+    match_12 = re.search(TIME_PATTERN_12H, time_string)
+    match_24 = re.search(TIME_PATTERN_24H, time_string)
+    if re.search(r"midnight", time_string):
+        hours, minutes = 0, 0
+    elif re.search(r"noon", time_string):
+        hours, minutes = 12, 0
+    elif match_in:
+        how_many = int(match_in[1])
+        if how_many < 1:
+            return False
+        units = match_in[2]
+        if units.startswith("min"):
+            now += timedelta(minutes=how_many)
+        elif units.startswith("hour"):
+            now += timedelta(hours=how_many)
+        elif units.startswith("day"):
+            now += timedelta(days=how_many)
+        elif units.startswith("week"):
+            now += timedelta(days=how_many*7)
+        return now
+    elif match_12:
+        hours = int(match_12[1])
+        minutes = int(match_12[2] or 0)
+        am = match_12[3][0] == "a"
+        if hours == 12 and am: hours = 0
+        elif hours < 12 and not am: hours += 12
+    elif match_24:
+        hours = int(match_24[1])
+        minutes = int(match_24[2])
+    else:
+        return False
+    if hours > 23 or minutes > 59: return False
+    add_days = 1 if (hours * 60 + minutes) < (now.hour * 60 + now.minute) else 0
+    return now.replace(hour=hours, minute=minutes, second=0) + timedelta(days=add_days)
+
+
+def legacy_parse_date(date_string: str) -> datetime:
+    date_string = date_string.lower()
+    now = NOW
+    date_match_intl = re.search(DATE_PATTERN_INTL, date_string)
+    date_match_us = re.search(DATE_PATTERN_US, date_string)
+    if date_string.endswith("day"):
+        for i in range(1, 8):
+            check_day = (now + timedelta(days=i))
+            if date_string.lower() == check_day.strftime("%A").lower():
+                return check_day
+        return False
+    elif date_string == "tomorrow":
+        return now + timedelta(days=1)
+    elif date_match_intl != None:
+        y, m, d = int(date_match_intl[1]), int(date_match_intl[2]), int(date_match_intl[3])
+    elif date_match_us:
+        m, d = int(date_match_us[1]), int(date_match_us[2])
+        try:
+            y = int(date_match_us[3])
+        except Exception:
+            y = now.year
+            if now.replace(month=m, day=d) < now:
+                y += 1
+    try: return now.replace(year=y, month=m, day=d)
+    except Exception: return False
+
+
+def legacy_parse_reminder(chat_id: int, from_user: str, args: list[str]) -> db.Reminder:
+    now = NOW
+    reminder = db.Reminder(chat_id=chat_id, when=now, from_user=from_user, target_user=args[0], subject="")
+    indicies = {}
+    when = now
+    keywords = {"at": 2, "in": 2, "on": 1, "tomorrow": 0}
+    skip_next = False
+    for index, word in enumerate([a.lower() for a in args]):
+        if skip_next:
+            skip_next = False
+            continue
+        if word in keywords:
+            cur_kw = word
+            if not word in indicies:
+                indicies[word] = {"index": index, "from": -1, "to": -1, "value": "", "finished": False}
+            if word == "tomorrow":
+                indicies[word] = {"index": index, "from": index, "to": index+1, "value": word, "finished": True}
+                if when.date() == now.date():
+                    when += timedelta(days=1)
+        elif indicies and cur_kw in indicies:
+            if indicies[cur_kw]["finished"]: continue
+            if indicies[cur_kw]["from"] == -1: indicies[cur_kw]["from"] = index
+            indicies[cur_kw]["to"] = index + 1
+            cur_kw_args = args[indicies[cur_kw]["from"]:indicies[cur_kw]["to"]]
+            value = " ".join(cur_kw_args)
+            indicies[cur_kw]["value"] = value
+            d, t = (legacy_parse_date(value), legacy_parse_time(value))
+            greedy = False if index + 1 >= len(args) else legacy_parse_time(value + " " + args[index+1])
+            if cur_kw in ["at", "in"] and (t or greedy):
+                indicies[cur_kw]["finished"] = True
+                if greedy:
+                    t = greedy
+                    skip_next = True
+                    indicies[cur_kw]["to"] += 1
+                if t.date() != now.date() and when.date() == now.date():
+                    when = t
+                else:
+                    when = when.replace(hour=t.hour, minute=t.minute, second=t.second)
+            elif cur_kw == "on" and d:
+                indicies[cur_kw]["finished"] = True
+                when = when.replace(year=d.year, month=d.month, day=d.day)
+            elif cur_kw == "in" and len(cur_kw_args) < 2:
+                pass
+            else:
+                indicies.pop(cur_kw)
+    if not "at" in indicies and not "in" in indicies:
+        return False
+    if reminder.target_user.lower() == "me": reminder.target_user = reminder.from_user
+    else: reminder.target_user = reminder.target_user.lstrip("@")
+    subject_words = args.copy()
+    for key in indicies:
+        i = indicies[key]
+        if i["from"] == -1: i["to"] = i["index"] + 1
+        elif i["to"] == -1: i["to"] = i["from"] + 1
+        for j in range(i["index"], i["to"]):
+            subject_words[j] = ""
+    reminder.subject = " ".join([w for w in subject_words[1:] if w != ""])
+    reminder.when = when
+    reminder.update_job_name()
+    return reminder
+
+
+def make_sentence(rng: random.Random, length: int) -> list[str]:
+    words = ["me" if rng.random() < 0.5 else "@Someone"]
+    while len(words) < length:
+        roll = rng.random()
+        if roll < 0.1:
+            words += ["at"] + rng.choice(TIMES).split()
+        elif roll < 0.15:
+            words += ["in"] + rng.choice(TIMES[-3:]).split()
+        elif roll < 0.2:
+            words += ["on", rng.choice(DATES)]
+        else:
+            words.append(rng.choice(FILLER).upper() if rng.random() < 0.1 else rng.choice(FILLER))
+    return words
+
+
+def make_corpus(count: int, seed: int = 1) -> list[list[str]]:
+    rng = random.Random(seed)
+    # mostly ordinary reminders, some long ones and some where "in" never finds a time
+    corpus = [make_sentence(rng, rng.choice([6, 10, 40, 120])) for _ in range(count)]
+    corpus += [["me", "in"] + ["the"] * n + ["5", "minutes"] for n in range(0, 200, 20)]
+    return corpus
+
+
+def same(a: db.Reminder, b: db.Reminder) -> bool:
+    if not a or not b:
+        return a == b
+    return (a.when, a.target_user, a.subject, a.name) == (b.when, b.target_user, b.subject, b.name)
+
+
+def rate(fn, corpus: list) -> float:
+    start = time.perf_counter()
+    for args in corpus:
+        fn(1, "from", args)
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def main(count: int = 2000):
+    corpus = make_corpus(count)
+    for args in corpus:
+        assert same(parse_reminder(1, "from", args, now=NOW), legacy_parse_reminder(1, "from", args)), args
+    print(f"before: {rate(legacy_parse_reminder, corpus):10.0f} reminders/sec")
+    print(f"after:  {rate(lambda *a: parse_reminder(*a, now=NOW), corpus):10.0f} reminders/sec")
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,83 @@
+# startup cost of scheduling one-time reminders: everything vs the rolling window.
+# usage: python test/bench_reminder_window.py [reminders ...]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from random import Random
+
+from sqlalchemy import create_engine
+from telegram.ext import ApplicationBuilder
+
+import database
+import models as db
+from constants import PACIFIC_TZ, REMINDER_WINDOW_MINUTES
+from scheduler import ReminderScheduler
+
+
+async def noop(context):
+    pass
+
+
+def fill(count: int) -> list[datetime]:
+    rng = Random(count)
+    now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+    # spread over a year, with one in ten due within the first window
+    window = REMINDER_WINDOW_MINUTES - 2
+    rows = [{"id": -1, "title": "bench", "time_zone": "America/Los_Angeles", "stop_armed": False, "reminder_offset": 0}]
+    with database.session_scope() as session:
+        session.execute(db.Chat.__table__.insert(), rows)
+        whens = [now + timedelta(minutes=rng.randrange(2, window if i % 10 == 0 else 365 * 24 * 60))
+                 for i in range(count)]
+        # raw rows skip the model, so the columns it derives from when are filled in the same way here
+        session.execute(db.Reminder.__table__.insert(), [{
+            "chat_id": -1, "name": f"-1_bench_{i}", "when": when, "next_fire": db.next_fire_time(when, False, PACIFIC_TZ),
+            "minute_of_day": when.hour * 60 + when.minute, "from_user": "bench", "from_user_lower": "bench",
+            "target_user": "bench", "target_user_lower": "bench", "subject": "bench", "is_daily": False
+        } for i, when in enumerate(whens)])
+    return whens
+
+
+def measure(windowed: bool, whens: list[datetime]) -> tuple[float, int, float]:
+    application = ApplicationBuilder().token("0:bench").build()
+    tracemalloc.start()
+    start = time.perf_counter()
+    if windowed:
+        window_start, end = ReminderScheduler().advance()
+        reminders = database.run_sync(database.get_onetime_reminders_between, window_start, end)
+    else:
+        reminders = database.run_sync(database.get_reminders, -1, is_daily=False)
+    for reminder in reminders:
+        application.job_queue.run_once(noop, when=reminder.when.replace(tzinfo=PACIFIC_TZ), name=reminder.name,
+                                       data=reminder)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # the window has to pick up exactly what's due in it by when, or the comparison means nothing
+    expected = sum(when < end for when in whens) if windowed else len(whens)
+    assert len(application.job_queue.jobs()) == expected, (len(application.job_queue.jobs()), expected)
+    return elapsed, len(application.job_queue.jobs()), peak / 2**20
+
+
+def main(sizes: list[int]):
+    for count in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{tmp}/chats.db")
+            db.Base.metadata.create_all(engine)
+            db.Session.configure(bind=engine)
+            whens = fill(count)
+            for label, windowed in (("all", False), ("window", True)):
+                elapsed, jobs, peak = measure(windowed, whens)
+                print(f"{count:8} reminders | {label:6} | {elapsed * 1000:9.1f} ms | {jobs:8} jobs | {peak:8.1f} MiB peak")
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
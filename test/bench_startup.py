@@ -0,0 +1,91 @@
+# time-to-first-poll of load_chats against the old per-chat startup loop.
+# usage: python test/bench_startup.py [chats] [reminders]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+os.chdir(parentdir)
+
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from random import Random
+
+from sqlalchemy import create_engine
+from telegram.ext import ApplicationBuilder, ContextTypes
+
+import awoo
+import bulk
+import database
+import models as db
+from constants import PACIFIC_TZ
+from scheduler import DailyBuckets
+
+
+def legacy_purge_past_reminders(session, chat_id: int):
+    chat = database.get_chat(session, chat_id, reminders=True)
+    if chat:
+        now = datetime.now(tz=timezone.utc)
+        for reminder in chat.onetime_reminders:
+            if reminder.next_fire and reminder.next_fire < now:
+                session.delete(reminder)
+
+
+def legacy_load_chats(application):
+    # the startup loop before load_chats went set-based: several round trips and commits per chat
+    chats = database.run_sync(database.get_all_chats)
+    for chat in chats:
+        database.run_sync(database.set_stop_armed, chat_id=chat.id, armed=False)
+        context = ContextTypes.DEFAULT_TYPE(application=application, chat_id=chat.id)
+        database.run_sync(legacy_purge_past_reminders, chat.id)
+        for reminder in database.run_sync(database.get_reminders, chat.id, is_daily=True):
+            awoo.register_reminder(context=context, reminder=reminder, reminder_offset=chat.reminder_offset)
+
+
+def fill(chats: int, reminders: int):
+    rng = Random(chats + reminders)
+    now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+    with database.session_scope() as session:
+        session.execute(db.Chat.__table__.insert(), [{
+            "id": -i - 1, "title": f"chat {i}", "time_zone": "America/Los_Angeles",
+            "stop_armed": i % 10 == 0, "reminder_offset": rng.choice((0, 0, 5, 15))
+        } for i in range(chats)])
+        rows = []
+        # complete rows, next_fire and the other columns the model derives included
+        for i in range(reminders):
+            chat_id = -(i % chats) - 1
+            if i < chats:
+                when = now.replace(hour=rng.randrange(24), minute=rng.randrange(60), second=0)
+                rows.append(bulk.reminder_row(chat_id, when, "bench", now=now))
+            else:
+                when = now + timedelta(minutes=rng.randrange(-30 * 24 * 60, 365 * 24 * 60))
+                rows.append(bulk.reminder_row(chat_id, when, f"bench{i}", "bench", "bench", now=now))
+        session.execute(db.Reminder.__table__.insert(), rows)
+
+
+def main(chats: int = 10000, reminders: int = 100000):
+    logging.disable(logging.INFO)
+    for label, loader in (("set-based", awoo.load_chats), ("per-chat", legacy_load_chats)):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{tmp}/chats.db")
+            db.Base.metadata.create_all(engine)
+            db.Session.configure(bind=engine)
+            fill(chats, reminders)
+            # both loaders fill the same module state
+            awoo.reminder_scheduler.horizon = None
+            awoo.daily_buckets = DailyBuckets()
+            awoo.bucket_jobs.clear()
+            application = ApplicationBuilder().token("0:bench").build()
+            start = time.perf_counter()
+            loader(application)
+            elapsed = time.perf_counter() - start
+            print(f"{label:9} | {chats} chats, {reminders} reminders | time to first poll {elapsed:8.2f} s | "
+                  f"{len(application.job_queue.jobs())} jobs")
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,81 @@
+# next-fire scheduling for thousands of chats spread over many zones, run
+# across a dst change. reports zone lookups/sec with and without the cache and
+# reminders scheduled/sec, and checks every daily firing keeps its wall time.
+# usage: python test/bench_timezones.py [chats]
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, available_timezones
+
+import models as db
+from functions import get_zone
+
+# the saturday before the us spring forward, europe moves two weeks later
+START = datetime(2024, 3, 9, 0, 0, tzinfo=timezone.utc)
+DAYS = 30
+
+
+def make_reminders(chats: int, zones: list[str], seed: int = 1) -> list[tuple[db.Reminder, str]]:
+    rng = random.Random(seed)
+    reminders = []
+    for chat_id in range(chats):
+        zone = rng.choice(zones)
+        when = datetime(2024, 1, 1, rng.randrange(24), rng.randrange(60), tzinfo=get_zone(zone))
+        reminders.append((db.Reminder(chat_id=-chat_id, when=when, from_user="bench"), zone))
+    return reminders
+
+
+def exists(wall: datetime) -> bool:
+    return wall.astimezone(timezone.utc).astimezone(wall.tzinfo).replace(tzinfo=None) == wall.replace(tzinfo=None)
+
+
+def lookups_per_second(lookup, names: list[str]) -> float:
+    start = time.perf_counter()
+    for name in names:
+        lookup(name)
+    return len(names) / (time.perf_counter() - start)
+
+
+def main(chats: int = 5000):
+    zones = sorted(z for z in available_timezones() if "/" in z and not z.startswith(("Etc/", "SystemV/")))
+    zones = random.Random(1).sample(zones, 60)
+    names = [random.Random(i).choice(zones) for i in range(chats * 10)]
+    print(f"zone lookups, uncached: {lookups_per_second(ZoneInfo.no_cache, names[:chats]):10.0f}/sec")
+    # loads the list of known zone names once, like the first /timezone would
+    get_zone("UTC")
+    print(f"zone lookups, cached:   {lookups_per_second(get_zone, names):10.0f}/sec")
+
+    reminders = make_reminders(chats, zones)
+    firings = 0
+    skipped_hour = 0
+    start = time.perf_counter()
+    for reminder, zone in reminders:
+        tz = get_zone(zone)
+        after = START
+        fired = []
+        for _ in range(DAYS):
+            after = reminder.schedule_next(tz, after=after)
+            local = after.astimezone(tz)
+            fired.append(after)
+            if (local.hour, local.minute) != (reminder.when.hour, reminder.when.minute):
+                # only allowed when the wall time doesn't exist that day, a gap can push it past midnight
+                assert any(not exists(datetime.combine(day, reminder.when.time(), tzinfo=tz))
+                           for day in (local.date(), local.date() - timedelta(days=1)))
+                skipped_hour += 1
+            firings += 1
+        # one firing a day, a dst change can only stretch or shrink the gap by a couple of hours
+        assert all(timedelta(hours=22) <= b - a <= timedelta(hours=26) for a, b in zip(fired, fired[1:]))
+    elapsed = time.perf_counter() - start
+    print(f"next fires: {firings / elapsed:10.0f}/sec over {chats} chats in {len(zones)} zones for {DAYS} days")
+    print(f"firings moved out of a skipped dst hour: {skipped_hour}")
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
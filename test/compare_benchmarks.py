@@ -0,0 +1,43 @@
+# compares pytest-benchmark json runs of the base branch and a pull request taken
+# in the same ci job. a shared runner is slower for whole stretches at a time, so
+# each side is run several times, alternating, and each benchmark's best min over
+# its runs is compared. exits 1 when any got slower by more than the threshold.
+# usage: python test/compare_benchmarks.py "base-*.json" "head-*.json" [percent]
+import glob
+import json
+import sys
+
+
+def best_times(pattern: str) -> dict[str, float]:
+    best = {}
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            for bench in json.load(f)["benchmarks"]:
+                best[bench["name"]] = min(best.get(bench["name"], float("inf")), bench["stats"]["min"])
+    if not best:
+        raise ValueError(f"no benchmark runs match {pattern}")
+    return best
+
+
+def compare(base: dict[str, float], head: dict[str, float], percent: float) -> list[str]:
+    regressed = []
+    for name in sorted(head):
+        if name not in base:
+            print(f"{name:28} new")
+            continue
+        change = (head[name] / base[name] - 1) * 100
+        print(f"{name:28} {base[name] * 1e6:12.1f} us -> {head[name] * 1e6:12.1f} us  {change:+6.1f}%")
+        if change > percent:
+            regressed.append(name)
+    return regressed
+
+
+def main(base_pattern: str, head_pattern: str, percent: float = 25):
+    regressed = compare(best_times(base_pattern), best_times(head_pattern), percent)
+    if regressed:
+        print(f"more than {percent:g}% slower: {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], *map(float, sys.argv[3:]))
@@ -0,0 +1,36 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import pytest
+
+import models as db
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Points models.Session at a fresh sqlite file for the duration of a test."""
+    engine = db.make_engine(f"sqlite:///{tmp_path / 'chats.db'}")
+    db.init_db(engine)
+    db.Session.configure(bind=engine)
+    yield engine
+    db.Session.configure(bind=db.engine)
+    engine.dispose()
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # benchmarks only run once in a plain test run, they're timed with --benchmark-only or --benchmark-enable
+    if config.pluginmanager.hasplugin("benchmark") and not config.getoption("benchmark_only"):
+        config.option.benchmark_disable = True
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    # a saved run only needs the summary stats to compare against, not every round or the cpu's flags
+    for bench in output_json["benchmarks"]:
+        bench["stats"].pop("data", None)
+    output_json["machine_info"].get("cpu", {}).pop("flags", None)
@@ -0,0 +1,176 @@
+# a local stand-in for the telegram bot api, enough of it to run the bot with
+# ApplicationBuilder().base_url() pointed here: getMe, getUpdates (long
+# polling), sendMessage and getChatAdministrators. every other method answers
+# true. updates are pushed in by the test or load generator and every message
+# the bot sends is recorded and handed to on_send. start_bot runs awoo.py
+# against it in a scratch directory.
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
+
+parentdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "AwooPackBot", "username": "AwooPackBot"}
+MAX_POLL_SECONDS = 1
+WORDS = {
+    "formats": ["%greeting% pack!"],
+    "words": {"greeting": ["Hello", "Howdy"], "awoo": ["Awoo!", "AWOOOO"]},
+    "validators": {},
+}
+
+
+def user(user_id: int, username: str) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": username, "username": username}
+
+
+def chat(chat_id: int) -> dict:
+    if chat_id < 0:
+        return {"id": chat_id, "type": "group", "title": f"pack {chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": "pup"}
+
+
+class FakeBotApi:
+    def __init__(self, token: str, listen: str = "127.0.0.1", port: int = 0):
+        self.token = token
+        self.listen = listen
+        self.port = port
+        # called with (chat_id, text, params) for every sendMessage, on the event loop
+        self.on_send = None
+        # seconds every call but getUpdates waits before answering, like the round trip to telegram
+        self.latency = 0.0
+        self.sent: list[tuple[float, int, str]] = []
+        self.requests: dict[str, int] = {}
+        self._updates: list[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._polled = asyncio.Event()
+        self._server: asyncio.AbstractServer = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.listen}:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def wait_polling(self, timeout: float = 30):
+        """Waits until the bot has made its first getUpdates call."""
+        await asyncio.wait_for(self._polled.wait(), timeout)
+
+    def push_message(self, chat_id: int, user_id: int, username: str, text: str) -> int:
+        """Queues a message update from a user and returns its message_id."""
+        message_id = next(self._message_ids)
+        message = {"message_id": message_id, "date": int(time.time()), "chat": chat(chat_id),
+                   "from": user(user_id, username), "text": text}
+        if text.startswith("/"):
+            command = text.split(None, 1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self._updates.append({"update_id": next(self._update_ids), "message": message})
+        self._new_updates.set()
+        return message_id
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                _, target, _ = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    if line:
+                        name, _, value = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                result = await self._call(target.rsplit("/", 1)[-1], self._params(headers, body))
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # cancelled covers a long poll still waiting when the server shuts down
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _params(headers: dict, body: bytes) -> dict:
+        if not body:
+            return {}
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body)
+        params = {}
+        # form values are json encoded, except plain strings
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = value if key == "text" else json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def _call(self, method: str, params: dict):
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if self.latency and method != "getUpdates":
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "sendMessage":
+            return self._send_message(params)
+        if method == "getChatAdministrators":
+            return [{"status": "creator", "user": user(1000, "admin"), "is_anonymous": False}]
+        return True
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        self._polled.set()
+        offset = params.get("offset") or 0
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), min(params.get("timeout") or 0, MAX_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:params.get("limit") or 100]
+
+    def _send_message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        text = str(params["text"])
+        self.sent.append((time.monotonic(), chat_id, text))
+        if self.on_send:
+            self.on_send(chat_id, text, params)
+        return {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat(chat_id),
+                "from": BOT_USER, "text": text}
+
+
+async def start_bot(api: FakeBotApi, env: dict = None) -> tuple[asyncio.subprocess.Process, str]:
+    """Starts awoo.py polling api, in a new directory with its messages, a word snapshot and an empty db.
+
+    env adds to or overrides the bot's environment, e.g. AWOO_DB_URL for workers sharing a db. Returns the process
+    and the directory, the bot's output goes to bot.log in there.
+    """
+    workdir = tempfile.mkdtemp(prefix="awoo-")
+    os.makedirs(os.path.join(workdir, "data"))
+    shutil.copy(os.path.join(parentdir, "messages.json"), workdir)
+    with open(os.path.join(workdir, "data", "words.json"), "w") as f:
+        json.dump(WORDS, f)
+    env = dict(os.environ, AWOO_TOKEN=api.token, AWOO_BOT_API_URL=api.base_url, AWOO_METRICS_PORT="0",
+               AWOO_DB_URL=f"sqlite:///{os.path.join(workdir, 'data', 'chats.db')}") | (env or {})
+    with open(os.path.join(workdir, "bot.log"), "w") as log:
+        process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(parentdir, "awoo.py"),
+                                                       cwd=workdir, env=env, stdout=log, stderr=log)
+    return process, workdir
@@ -0,0 +1,91 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+from types import SimpleNamespace
+
+from admin_cache import AdminCache
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, admin_ids: list[int]):
+        self.id = chat_id
+        self.admin_ids = admin_ids
+        self.calls = 0
+
+    async def get_administrators(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return [SimpleNamespace(user=SimpleNamespace(id=user_id)) for user_id in self.admin_ids]
+
+
+class TestAdminCache:
+    def test_lookups_are_cached(self):
+        cache, chat = AdminCache(), FakeChat(-1, [1, 2])
+
+        async def main():
+            return [await cache.is_admin(chat, user_id) for user_id in (1, 2, 3)]
+        assert asyncio.run(main()) == [True, True, False]
+        assert chat.calls == 1
+        assert cache.hit_rate() == 2 / 3
+
+    def test_concurrent_lookups_are_coalesced(self):
+        cache, chat = AdminCache(), FakeChat(-1, [1])
+
+        async def main():
+            return await asyncio.gather(*[cache.is_admin(chat, 1) for _ in range(10)])
+        assert asyncio.run(main()) == [True] * 10
+        assert chat.calls == 1
+
+    def test_ttl_expiry(self):
+        cache, chat = AdminCache(ttl=0), FakeChat(-1, [1])
+
+        async def main():
+            await cache.get(chat)
+            await cache.get(chat)
+        asyncio.run(main())
+        assert chat.calls == 2
+
+    def test_invalidate(self):
+        cache, chat = AdminCache(), FakeChat(-1, [1])
+
+        async def main():
+            assert not await cache.is_admin(chat, 2)
+            chat.admin_ids = [1, 2]
+            cache.invalidate(chat.id)
+            return await cache.is_admin(chat, 2)
+        assert asyncio.run(main())
+        assert chat.calls == 2
+
+    def test_invalidate_during_lookup_is_not_overwritten(self):
+        cache, chat = AdminCache(), FakeChat(-1, [1])
+
+        async def main():
+            lookup = asyncio.ensure_future(cache.get(chat))
+            await asyncio.sleep(0)
+            cache.invalidate(chat.id)
+            await lookup
+            chat.admin_ids = [2]
+            return await cache.get(chat)
+        assert asyncio.run(main()) == frozenset([2])
+
+    def test_invalidate_keeps_no_state(self):
+        cache = AdminCache()
+        for chat_id in range(1000):
+            cache.invalidate(chat_id)
+        assert cache.stats()["size"] == 0
+        assert not cache._pending
+
+    def test_size_bound(self):
+        cache = AdminCache(max_size=2)
+        chats = [FakeChat(-i, [i]) for i in range(1, 4)]
+
+        async def main():
+            for chat in chats:
+                await cache.get(chat)
+        asyncio.run(main())
+        assert cache.stats()["size"] == 2
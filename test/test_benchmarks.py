@@ -0,0 +1,89 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+# timings for the parsing and message hot paths. a plain pytest run only checks these work once,
+# the workflow times them on the base branch and on the pull request in turn, three times each on
+# the same runner, and fails when one got more than 25% slower, see compare_benchmarks.py:
+#   pytest test/test_benchmarks.py --benchmark-only --benchmark-json=head-1.json
+#   python test/compare_benchmarks.py "base-*.json" "head-*.json" 25
+# conftest.py keeps only the summary stats in a saved run
+
+import random
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import functions
+import models as db
+from bench_classifier import make_log, make_trigger_words
+from bench_generate_message import DATA
+from bench_parse_reminder import DATES, NOW, TIMES, make_corpus
+from functions import classify_message, compile_templates, generate_message, get_trigger_words, parse_date, \
+    parse_reminder, parse_time
+
+SEED = 1
+TIME_STRINGS = TIMES + ["in 5 minutes", "in 0 days", "25:00", "4:61 pm", "yodel", "x" * 200, "1 " * 100]
+DATE_STRINGS = DATES + ["13/45", "2024-02-30", "someday", "x" * 200, "1/" * 100]
+
+
+@pytest.fixture(autouse=True)
+def fixed_clock(monkeypatch):
+    monkeypatch.setattr(functions, "get_now", lambda tz=NOW.tzinfo: NOW.astimezone(tz))
+    random.seed(SEED)
+
+
+@pytest.fixture(scope="module")
+def reminder_corpus():
+    return make_corpus(200, seed=SEED)
+
+
+@pytest.fixture(scope="module")
+def reminders():
+    rng = random.Random(SEED)
+    daily = [db.Reminder(1, NOW + timedelta(minutes=rng.randrange(1440)), "from") for _ in range(500)]
+    onetime = [db.Reminder(1, NOW + timedelta(minutes=rng.randrange(525600)), "from", "target", "subject")
+               for _ in range(500)]
+    return daily, onetime
+
+
+def test_parse_time(benchmark):
+    benchmark(lambda: [parse_time(s, now=NOW) for s in TIME_STRINGS])
+
+
+def test_parse_date(benchmark):
+    benchmark(lambda: [parse_date(s, now=NOW) for s in DATE_STRINGS])
+
+
+def test_parse_reminder(benchmark, reminder_corpus):
+    results = benchmark(lambda: [parse_reminder(1, "from", args, now=NOW) for args in reminder_corpus])
+    assert any(results) and not all(results)
+
+
+def test_generate_message(benchmark):
+    data = dict(DATA)
+    data["templates"] = compile_templates(data)
+    benchmark(lambda: [generate_message(data) for _ in range(1000)])
+
+
+def test_format_reminders(benchmark, reminders):
+    daily, onetime = reminders
+    benchmark(lambda: [r.format_string() for r in daily + onetime])
+
+
+def test_sort_reminders(benchmark, reminders):
+    daily, onetime = reminders
+    ordered = benchmark(lambda: (sorted(daily), sorted(onetime)))
+    assert ordered[1][0].when == min(r.when for r in onetime)
+
+
+def test_classify_messages(benchmark):
+    log = make_log(1000, seed=SEED)
+    trigger_words = get_trigger_words(make_trigger_words(100, seed=SEED))
+    kinds = benchmark(lambda: [classify_message(text, trigger_words) for text in log])
+    assert {"awoo", "mention", "trigger", "chatter"} == set(kinds)
@@ -0,0 +1,124 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import bulk
+import database
+import models as db
+from constants import DAILY, ONETIME
+
+LEGACY = {
+    "-1": {"title": "Pack", "time_zone": "America/New_York", "reminder_offset": 5,
+           DAILY: ["07:30", "22:00"],
+           ONETIME: [{"when": "2030-01-02T09:15:00", "from_user": "Pup", "target_user": "Alpha", "subject": "walk"}]},
+    "-2": {"title": "Den", DAILY: [], ONETIME: []},
+}
+
+
+def write_legacy(tmp_path, chats: dict = None) -> str:
+    path = str(tmp_path / "chats.json")
+    with open(path, "w") as f:
+        json.dump(LEGACY if chats is None else chats, f)
+    return path
+
+
+def reminders() -> list:
+    with database.session_scope() as session:
+        return session.query(db.Reminder).order_by(db.Reminder.chat_id, db.Reminder.when).all()
+
+
+class TestJsonStream:
+    @pytest.mark.parametrize("chunk_size", [1, 3, bulk.CHUNK_SIZE])
+    def test_legacy_chats(self, chunk_size):
+        f = io.StringIO(json.dumps(LEGACY, indent=1))
+        assert dict(bulk.iter_legacy_chats(f, chunk_size)) == LEGACY
+
+    def test_empty_and_bad(self):
+        assert list(bulk.iter_legacy_chats(io.StringIO(" { } "))) == []
+        with pytest.raises(ValueError):
+            list(bulk.iter_legacy_chats(io.StringIO("[]")))
+
+
+@pytest.mark.usefixtures("temp_db")
+class TestBulk:
+    def test_import_legacy(self, tmp_path):
+        counts = bulk.import_file(write_legacy(tmp_path))
+        assert counts == {"skipped": 0, "records": 5, "chats": 2, "reminders": 3}
+        chat = database.run_sync(database.get_chat, -1)
+        assert (chat.title, chat.time_zone, chat.reminder_offset) == ("Pack", "America/New_York", 5)
+        daily, _, onetime = reminders()
+        assert daily.is_daily and daily.minute_of_day == 7 * 60 + 30 and daily.from_user == "import"
+        assert not onetime.is_daily and onetime.target_user_lower == "alpha"
+        assert onetime.next_fire == datetime(2030, 1, 2, 14, 15, tzinfo=timezone.utc)
+        assert onetime.name == db.job_name(-1, onetime.when, "Pup", False)
+
+    def test_import_is_resumed_and_not_repeated(self, tmp_path):
+        path = write_legacy(tmp_path)
+        with database.session_scope() as session:
+            database.set_import_progress(session, os.path.abspath(path), 3)
+        counts = bulk.import_file(path, batch=1)
+        # only the onetime reminder and the second chat were left
+        assert counts == {"skipped": 3, "records": 5, "chats": 1, "reminders": 1}
+        assert bulk.import_file(path)["records"] == 5
+        assert len(reminders()) == 1
+
+    def test_indexes_rebuilt(self, tmp_path):
+        bulk.import_file(write_legacy(tmp_path), batch=2)
+        with database.session_scope() as session:
+            assert not database.reminder_indexes_missing(session)
+
+    def test_interrupted_import_rebuilds_indexes(self, tmp_path, monkeypatch):
+        path = write_legacy(tmp_path)
+        calls = []
+
+        def fail_second_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("disk full")
+            return write_batch(*args)
+
+        write_batch = bulk.write_batch
+        monkeypatch.setattr(bulk, "write_batch", fail_second_batch)
+        with pytest.raises(RuntimeError):
+            bulk.import_file(path, batch=2)
+        with database.session_scope() as session:
+            assert database.reminder_indexes_missing(session)
+        monkeypatch.setattr(bulk, "write_batch", write_batch)
+        counts = bulk.import_file(path, batch=2)
+        assert counts["skipped"] == 2 and counts["records"] == 5
+        assert len(reminders()) == 3
+        with database.session_scope() as session:
+            assert not database.reminder_indexes_missing(session)
+
+    def test_export_round_trip(self, tmp_path):
+        bulk.import_file(write_legacy(tmp_path))
+        database.run_sync(database.set_trigger_words, -2, "moon howl")
+        before = [(r.chat_id, r.name, r.when, r.next_fire, r.target_user) for r in reminders()]
+        dump = str(tmp_path / "dump.jsonl")
+        assert bulk.export_file(dump, batch=2) == {"chats": 2, "reminders": 3}
+
+        engine = db.make_engine(f"sqlite:///{tmp_path / 'copy.db'}")
+        db.init_db(engine)
+        db.Session.configure(bind=engine)
+        try:
+            assert bulk.import_file(dump)["reminders"] == 3
+            assert [(r.chat_id, r.name, r.when, r.next_fire, r.target_user) for r in reminders()] == before
+            assert database.run_sync(database.get_chat, -2).trigger_words == "moon howl"
+        finally:
+            engine.dispose()
+
+    def test_reminder_row_matches_model(self):
+        when = datetime.now(tz=timezone.utc).replace(microsecond=0) + timedelta(days=1)
+        row = bulk.reminder_row(-1, when, "Pup", "Alpha", "walk")
+        model = db.Reminder(-1, when, "Pup", "Alpha", "walk")
+        for field in ("name", "next_fire", "is_daily", "minute_of_day", "from_user_lower", "target_user_lower"):
+            assert row[field] == getattr(model, field), field
@@ -0,0 +1,109 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+
+import pytest
+
+import database
+from chat_cache import ChatCache
+
+
+@pytest.mark.usefixtures("temp_db")
+class TestChatCache:
+    def test_reads_are_cached(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=-1, title="Pack")
+        cache = ChatCache()
+
+        async def main():
+            first = await cache.get(-1)
+            second = await cache.get(-1)
+            return first, second
+        first, second = asyncio.run(main())
+        assert first is second
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_missing_chat_is_cached(self):
+        cache = ChatCache()
+
+        async def main():
+            return await cache.get(-1), await cache.set_stop_armed(-1, True)
+        assert asyncio.run(main()) == (None, None)
+        assert cache.misses == 1
+
+    def test_noop_writes_are_skipped(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=-1, title="Pack")
+        cache = ChatCache()
+
+        async def main():
+            for _ in range(10):
+                await cache.set_stop_armed(-1, False)
+            return await cache.flush()
+        assert asyncio.run(main()) == 0
+        assert cache.writes_skipped == 10
+
+    def test_writes_are_batched(self):
+        for chat_id in range(-1, -6, -1):
+            database.run_sync(database.add_chat_if_not_exist, chat_id=chat_id, title="Pack")
+        cache = ChatCache()
+
+        async def main():
+            for chat_id in range(-1, -6, -1):
+                await cache.set_stop_armed(chat_id, True)
+            assert database.run_sync(database.get_chat, -1).stop_armed is False
+            return await cache.flush()
+        assert asyncio.run(main()) == 5
+        assert all(database.run_sync(database.get_chat, i).stop_armed for i in range(-1, -6, -1))
+
+    def test_eviction_keeps_dirty_rows(self):
+        for chat_id in range(-1, -4, -1):
+            database.run_sync(database.add_chat_if_not_exist, chat_id=chat_id, title="Pack")
+        cache = ChatCache(max_size=2)
+
+        async def main():
+            await cache.set_stop_armed(-1, True)
+            await cache.get(-2)
+            await cache.get(-3)
+            assert len(cache) == 2
+            assert (await cache.get(-1)).stop_armed is True
+            return await cache.flush()
+        assert asyncio.run(main()) == 1
+        assert database.run_sync(database.get_chat, -1).stop_armed is True
+
+    def test_delete(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=-1, title="Pack")
+        cache = ChatCache()
+
+        async def main():
+            await cache.set_stop_armed(-1, True)
+            await cache.delete(-1)
+            return await cache.get(-1), await cache.flush()
+        assert asyncio.run(main()) == (None, 0)
+
+    def test_trigger_words_write_through(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=-1, title="Pack")
+        cache = ChatCache()
+
+        async def main():
+            cached = await cache.get(-1)
+            await cache.set_trigger_words(-1, "howl moon")
+            return cached.trigger_words
+        assert asyncio.run(main()) == "howl moon"
+        assert database.run_sync(database.get_chat, -1).trigger_words == "howl moon"
+
+    def test_flush_only_writes_changed_fields(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=-1, title="Pack")
+        cache = ChatCache()
+
+        async def main():
+            await cache.set_stop_armed(-1, True)
+            # a write-through that lands while the cached copy still has the old zone, as when it overlaps a flush
+            await database.run(database.set_time_zone, -1, "Europe/London")
+            return await cache.flush()
+        assert asyncio.run(main()) == 1
+        chat = database.run_sync(database.get_chat, -1)
+        assert (chat.stop_armed, chat.time_zone) == (True, "Europe/London")
@@ -0,0 +1,183 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import database
+import models as db
+from constants import PACIFIC_TZ
+
+
+@pytest.mark.usefixtures("temp_db")
+class TestDatabase:
+    chat_id = -1234
+
+    def test_run_uses_worker_thread(self):
+        async def main():
+            return await database.run(lambda session: threading.current_thread().name)
+        assert asyncio.run(main()).startswith("db")
+
+    def test_add_chat_if_not_exist(self):
+        chat = database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        again = database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Other")
+        assert chat.id == again.id == self.chat_id
+        assert again.title == "Pack"
+        assert chat.reminder_offset == 0
+
+    def test_set_stop_armed(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        database.run_sync(database.set_stop_armed, chat_id=self.chat_id, armed=True)
+        assert database.run_sync(database.get_chat, self.chat_id).stop_armed is True
+        assert database.run_sync(database.set_stop_armed, chat_id=1, armed=True) is None
+
+    def test_detached_chat_has_reminders(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        when = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+        database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=when, from_user="Test"))
+        chat = database.run_sync(database.get_chat, self.chat_id, reminders=True)
+        assert len(chat.reminders) == len(chat.daily_reminders) == 1
+        assert chat.onetime_reminders == []
+
+    def test_past_reminders_are_hidden_then_swept(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+        past = db.Reminder(chat_id=self.chat_id, when=now - timedelta(days=1), from_user="Test",
+                           target_user="Test", subject="past")
+        future = db.Reminder(chat_id=self.chat_id, when=now + timedelta(days=1), from_user="Test",
+                             target_user="Test", subject="future")
+        database.run_sync(database.add_reminder, past)
+        database.run_sync(database.add_reminder, future)
+        page, _, _ = database.run_sync(database.get_reminder_page, self.chat_id)
+        assert [r.subject for r in page] == ["future"]
+        assert database.run_sync(database.delete_past_reminders, now) == 1
+        chat = database.run_sync(database.get_chat, self.chat_id, reminders=True)
+        assert [r.subject for r in chat.onetime_reminders] == ["future"]
+
+    def test_startup_bulk_helpers(self):
+        now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+        for chat_id in (-1, -2):
+            database.run_sync(database.add_chat_if_not_exist, chat_id=chat_id, title="Pack")
+            database.run_sync(database.set_stop_armed, chat_id=chat_id, armed=True)
+            database.run_sync(database.add_reminder, db.Reminder(chat_id=chat_id, when=now, from_user="Test"))
+            database.run_sync(database.add_reminder, db.Reminder(chat_id=chat_id, when=now - timedelta(hours=1),
+                                                                 from_user="Test", target_user="Test", subject="past"))
+        database.run_sync(database.set_reminder_offset, -2, 15)
+        assert database.run_sync(database.disarm_all_chats) == 2
+        assert database.run_sync(database.delete_past_reminders, now) == 2
+        daily = database.run_sync(database.get_daily_reminders)
+        assert sorted(r.chat.reminder_offset for r in daily) == [0, 15]
+        assert not any(c.stop_armed for c in database.run_sync(database.get_all_chats))
+
+    def test_set_time_zone(self):
+        new_york = ZoneInfo("America/New_York")
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        now = datetime.now(tz=PACIFIC_TZ).replace(microsecond=0)
+        daily = db.Reminder(chat_id=self.chat_id, when=now.replace(hour=9, minute=0), from_user="Test")
+        onetime = db.Reminder(chat_id=self.chat_id, when=now + timedelta(days=1), from_user="Test",
+                              target_user="Test", subject="tomorrow")
+        database.run_sync(database.add_reminder, daily)
+        database.run_sync(database.add_reminder, onetime)
+        chat = database.run_sync(database.set_time_zone, self.chat_id, "America/New_York")
+        assert database.run_sync(database.get_chat, self.chat_id).time_zone == "America/New_York"
+        assert chat.daily_reminders[0].next_fire.astimezone(new_york).hour == 9
+        moved = chat.onetime_reminders[0]
+        assert moved.next_fire == onetime.next_fire
+        assert moved.when.hour == onetime.next_fire.astimezone(new_york).hour
+
+    def test_update_next_fires(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        now = datetime.now(tz=timezone.utc).replace(second=0, microsecond=0)
+        missed = db.Reminder(chat_id=self.chat_id, when=now.astimezone(PACIFIC_TZ), from_user="Test")
+        missed.next_fire = now - timedelta(days=2)
+        legacy = db.Reminder(chat_id=self.chat_id, when=(now + timedelta(hours=1)).astimezone(PACIFIC_TZ),
+                             from_user="Test", target_user="Test", subject="legacy")
+        legacy.next_fire = None
+        database.run_sync(database.add_reminder, missed)
+        database.run_sync(database.add_reminder, legacy)
+        assert database.run_sync(database.update_next_fires, now) == 2
+        chat = database.run_sync(database.get_chat, self.chat_id, reminders=True)
+        assert chat.daily_reminders[0].next_fire == now + timedelta(days=1)
+        assert chat.onetime_reminders[0].next_fire == now + timedelta(hours=1)
+
+    def test_reminder_pages(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        start = datetime(2030, 1, 1, tzinfo=PACIFIC_TZ)
+        # set on different days, so date order isn't time of day order
+        for i in range(25):
+            when = start + timedelta(days=i, minutes=(i * 37) % 1440)
+            database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=when, from_user="Test"))
+        for i in range(18):
+            when = start + timedelta(hours=(i * 7) % 50)
+            database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=when, from_user=f"u{i}",
+                                                                 target_user="Test", subject=str(i)))
+        chat = database.run_sync(database.get_chat, self.chat_id, reminders=True)
+        expected = [r.id for r in sorted(chat.daily_reminders)] + [r.id for r in sorted(chat.onetime_reminders)]
+
+        pages, after_id = [], None
+        while True:
+            page, has_before, has_after = database.run_sync(database.get_reminder_page, self.chat_id, after_id=after_id)
+            assert len(page) <= 10 and has_before == bool(pages)
+            pages.append([r.id for r in page])
+            if not has_after:
+                break
+            after_id = page[-1].id
+        assert sum(pages, []) == expected
+        assert [len(p) for p in pages] == [10, 10, 10, 10, 3]
+
+        back, before_id = [], pages[-1][0]
+        while before_id:
+            page, has_before, has_after = database.run_sync(database.get_reminder_page, self.chat_id,
+                                                            before_id=before_id)
+            assert has_after
+            back.insert(0, [r.id for r in page])
+            before_id = page[0].id if has_before else None
+        assert back == pages[:-1]
+
+    def test_reminder_page_restarts_on_a_missing_cursor(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        when = datetime(2030, 1, 1, 9, tzinfo=PACIFIC_TZ)
+        database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=when, from_user="Test"))
+        page, has_before, has_after = database.run_sync(database.get_reminder_page, self.chat_id, after_id=999)
+        assert len(page) == 1 and not has_before and not has_after
+        assert database.run_sync(database.get_reminder_page, 1) == ([], False, False)
+
+    def test_removable_reminders(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        start = datetime(2030, 1, 1, 9, 30, tzinfo=PACIFIC_TZ)
+        for days, from_user, target_user in ((3, "Alpha", "Beta"), (1, "Gamma", "Alpha"), (2, "Gamma", "Delta")):
+            database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=start + timedelta(days=days),
+                                                                 from_user=from_user, target_user=target_user,
+                                                                 subject="walk"))
+        database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=start + timedelta(hours=1),
+                                                             from_user="Alpha", target_user="Alpha", subject="nap"))
+        database.run_sync(database.add_reminder, db.Reminder(chat_id=self.chat_id, when=start, from_user="Alpha"))
+        assert database.run_sync(database.count_reminders, self.chat_id) == {True: 1, False: 4}
+
+        matched, allowed = database.run_sync(database.get_removable_reminders, self.chat_id, "ALPHA", False, 570)
+        assert matched == 3
+        assert [(r.when.day, r.from_user) for r in allowed] == [(2, "Gamma"), (4, "Alpha")]
+        matched, allowed = database.run_sync(database.get_removable_reminders, self.chat_id, "delta", True)
+        assert matched == len(allowed) == 4
+        second = database.run_sync(database.get_removable_reminder, self.chat_id, "alpha", False, 2, 570)
+        assert (second.when.day, second.from_user) == (4, "Alpha")
+        assert database.run_sync(database.get_removable_reminder, self.chat_id, "alpha", False, 3, 570) is None
+        assert database.run_sync(database.get_removable_reminder, self.chat_id, "alpha", False, 0) is None
+
+    def test_match_columns_follow_changes(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=self.chat_id, title="Pack")
+        when = datetime(2030, 1, 1, 9, 30, tzinfo=PACIFIC_TZ)
+        reminder = db.Reminder(chat_id=self.chat_id, when=when, from_user="Alpha", target_user="Beta", subject="walk")
+        assert (reminder.minute_of_day, reminder.from_user_lower, reminder.target_user_lower) == (570, "alpha", "beta")
+        database.run_sync(database.add_reminder, reminder)
+        database.run_sync(database.set_time_zone, self.chat_id, "America/New_York")
+        moved = database.run_sync(database.get_chat, self.chat_id, reminders=True).onetime_reminders[0]
+        assert moved.minute_of_day == 12 * 60 + 30
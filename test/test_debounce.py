@@ -0,0 +1,74 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+
+from debounce import BurstDebouncer
+
+WINDOW = 0.05
+
+
+def run_burst(debouncer: BurstDebouncer, hits: list[tuple[int, int]], wait: float = WINDOW * 3, **settings):
+    """Feeds (chat_id, message_id) hits in and returns which were replied to right away."""
+    async def main():
+        immediate = [debouncer.hit(chat_id, message_id, **settings) for chat_id, message_id in hits]
+        await asyncio.sleep(wait)
+        return immediate
+    return asyncio.run(main())
+
+
+class TestBurstDebouncer:
+    def test_burst_collapses_into_one_scaled_reply(self):
+        bursts = []
+        debouncer = BurstDebouncer(lambda *burst: bursts.append(burst), window=WINDOW, cap=5)
+        immediate = run_burst(debouncer, [(-1, i) for i in range(50)])
+        assert immediate == [True] + [False] * 49
+        assert bursts == [(-1, 5, 49)]
+        assert debouncer.stats() == {"open": 0, "matched": 50, "replies": 2, "sends_saved": 48}
+
+    def test_single_match_has_no_trailing_reply(self):
+        bursts = []
+        debouncer = BurstDebouncer(lambda *burst: bursts.append(burst), window=WINDOW)
+        assert run_burst(debouncer, [(-1, 1), (-2, 2)]) == [True, True]
+        assert bursts == []
+        assert len(debouncer) == 0
+
+    def test_chat_settings(self):
+        bursts = []
+        debouncer = BurstDebouncer(lambda *burst: bursts.append(burst), window=60)
+        # a window of 0 turns debouncing off for the chat
+        assert run_burst(debouncer, [(-1, i) for i in range(3)], wait=0, window=0) == [True] * 3
+        debouncer = BurstDebouncer(lambda *burst: bursts.append(burst), window=60)
+        run_burst(debouncer, [(-1, i) for i in range(3)], window=WINDOW, cap=1)
+        assert bursts == [(-1, 1, 2)]
+
+    def test_chain_keeps_the_window_open(self):
+        bursts = []
+        debouncer = BurstDebouncer(lambda *burst: bursts.append(burst), window=WINDOW)
+
+        async def main():
+            immediate = []
+            for i in range(12):
+                immediate.append(debouncer.hit(-1, i))
+                await asyncio.sleep(WINDOW / 4)
+            await asyncio.sleep(WINDOW * 3)
+            return immediate
+        assert asyncio.run(main()).count(True) == 1
+        assert sum(howls for _, howls, _ in bursts) <= 11 and len(bursts) >= 2
+        assert debouncer.replies == 1 + len(bursts)
+
+    def test_forget(self):
+        bursts = []
+        debouncer = BurstDebouncer(lambda *burst: bursts.append(burst), window=WINDOW)
+
+        async def main():
+            debouncer.hit(-1, 1)
+            debouncer.hit(-1, 2)
+            debouncer.forget(-1)
+            await asyncio.sleep(WINDOW * 2)
+        asyncio.run(main())
+        assert bursts == []
@@ -0,0 +1,65 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import shutil
+
+from telegram import Bot
+
+from fake_bot_api import FakeBotApi, start_bot
+
+TOKEN = "123456:fake"
+
+
+async def with_api(test):
+    api = FakeBotApi(TOKEN)
+    await api.start()
+    try:
+        return await test(api)
+    finally:
+        await api.stop()
+
+
+class TestFakeBotApi:
+    def test_bot_methods(self):
+        async def test(api):
+            async with Bot(TOKEN, base_url=api.base_url) as bot:
+                assert bot.username == "AwooPackBot"
+                message = await bot.send_message(chat_id=-100, text="123")
+                assert message.text == "123" and message.chat.type == "group"
+                admins = await bot.get_chat_administrators(-100)
+                assert admins[0].user.username == "admin"
+            assert [(chat_id, text) for _, chat_id, text in api.sent] == [(-100, "123")]
+        asyncio.run(with_api(test))
+
+    def test_updates_are_polled_in_order(self):
+        async def test(api):
+            async with Bot(TOKEN, base_url=api.base_url) as bot:
+                api.push_message(-100, 7, "pup", "awoo")
+                api.push_message(-100, 7, "pup", "/list")
+                updates = await bot.get_updates(timeout=1)
+                assert [u.message.text for u in updates] == ["awoo", "/list"]
+                assert updates[1].message.entities[0].type == "bot_command"
+                # confirming by offset drops them
+                assert await bot.get_updates(offset=updates[-1].update_id + 1, timeout=0) == ()
+        asyncio.run(with_api(test))
+
+    def test_bot_replies_end_to_end(self):
+        async def test(api):
+            replied = asyncio.Event()
+            api.on_send = lambda chat_id, text, params: replied.set()
+            bot, workdir = await start_bot(api)
+            try:
+                await api.wait_polling(timeout=60)
+                api.push_message(-100, 7, "pup", "awoo")
+                await asyncio.wait_for(replied.wait(), 30)
+            finally:
+                bot.terminate()
+                await bot.wait()
+                shutil.rmtree(workdir)
+            assert api.sent[0][1:] in ((-100, "Awoo!"), (-100, "AWOOOO"))
+        asyncio.run(with_api(test))
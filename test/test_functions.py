@@ -5,11 +5,30 @@ currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import models as db
 from constants import PACIFIC_TZ
-from functions import parse_date, parse_reminder, parse_time
+import functions
+from functions import (
+    classify_message,
+    generate_message,
+    get_trigger_words,
+    get_zone,
+    parse_date,
+    parse_formats_csv,
+    parse_reminder,
+    parse_time,
+    parse_words_csv)
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(request, monkeypatch):
+    # the expected values below are computed at import, so the parser has to see the same clock
+    now = getattr(request.cls, "now", TestParseTime.now)
+    monkeypatch.setattr(functions, "get_now", lambda tz=PACIFIC_TZ: now.astimezone(tz))
 
 
 class TestParseTime:
@@ -107,6 +126,12 @@ class TestParseDate:
         when = self.now - timedelta(days=1)
         assert parse_date(when.strftime("%m/%d")) == when.replace(year=when.year + 1)
 
+    def test_invalid_us_date(self):
+        assert parse_date("13/45") is False
+
+    def test_not_a_date(self):
+        assert parse_date("someday") is False
+
 
 class TestParseReminder:
     chat_id = 1234
@@ -262,3 +287,98 @@ class TestParseReminder:
     def test_invalid_seconds(self):
         reminder_text = "me that I just ran this command in 5 seconds".split(" ")
         assert parse_reminder(chat_id=self.chat_id, from_user=self.from_user, args=reminder_text) is False
+
+    def test_next_fire_follows_parsed_time(self):
+        reminder_text = "me to do a little dance in 5 minutes".split(" ")
+        reminder = parse_reminder(chat_id=self.chat_id, from_user=self.from_user, args=reminder_text)
+        assert reminder.next_fire == parse_time("in 5 minutes").astimezone(timezone.utc)
+
+
+class TestGenerateMessage:
+    data = {
+        "formats": ("%greeting% pack! %reminder%", "Hey, %greeting% %tod%!", "%greeting% %greeting%"),
+        "words": {
+            "greeting": [" Good %tod% ", "Howdy"],
+            "reminder": ["Rise and shine", " drink water "],
+        },
+    }
+
+    def generate(self, monkeypatch, the_format: str, tod: str) -> str:
+        monkeypatch.setattr(functions, "get_time_of_day", lambda tz=None: tod)
+        monkeypatch.setattr(functions, "choice", lambda seq: seq[-1])
+        data = dict(self.data, formats=(the_format,))
+        data["templates"] = functions.compile_templates(data)
+        return generate_message(data)
+
+    def test_first_greeting_keeps_case(self, monkeypatch):
+        assert self.generate(monkeypatch, "%greeting% %greeting%", "evening") == "Howdy howdy"
+
+    def test_morning_reminder(self, monkeypatch):
+        assert self.generate(monkeypatch, "%greeting% pack! %reminder%", "morning") == "Howdy pack! Rise and shine"
+
+    def test_later_reminder_is_stripped(self, monkeypatch):
+        assert self.generate(monkeypatch, "%greeting% pack! %reminder%", "evening") == "Howdy pack! drink water"
+
+    def test_tod_inside_words(self, monkeypatch):
+        monkeypatch.setattr(functions, "get_time_of_day", lambda tz=None: "afternoon")
+        monkeypatch.setattr(functions, "choice", lambda seq: seq[0])
+        data = dict(self.data, formats=("Hey, %greeting% %tod%!",))
+        assert generate_message(data) == "Hey, Good afternoon afternoon!"
+
+
+class TestParseCsv:
+    def test_formats(self):
+        formats = parse_formats_csv('format,notes\n"Hi, %greeting%"\n\n%awoo%,x\n')
+        assert formats == ("Hi, %greeting%", "%awoo%")
+
+    def test_words_skip_unnamed_and_empty(self):
+        words = parse_words_csv("greeting,awoo,,Unnamed: 3\nHello,Awoo!,x,y\nHowdy,,z,\n NaN ,nan,,\n")
+        assert words == {"greeting": ["Hello", "Howdy", " NaN "], "awoo": ["Awoo!"]}
+
+    def test_words_duplicate_and_numeric_columns(self):
+        words = parse_words_csv("dup,dup,num\na,b,1\nc,,2.5\n")
+        assert words == {"dup": ["a", "c"], "dup.1": ["b"], "num": []}
+
+
+class TestGetZone:
+    def test_zones_are_cached(self):
+        assert get_zone("Europe/London") is get_zone("Europe/London")
+        assert get_zone("Europe/London").key == "Europe/London"
+
+    def test_unknown_zone_falls_back(self):
+        assert get_zone("Mars/Olympus_Mons") is PACIFIC_TZ
+        assert get_zone(None) is PACIFIC_TZ
+        assert get_zone("Mars/Olympus_Mons", default=None) is None
+
+    def test_unknown_zones_are_not_cached(self):
+        get_zone("Europe/Paris")
+        size = functions._load_zone.cache_info().currsize
+        for i in range(100):
+            assert get_zone(f"Mars/Crater_{i}") is PACIFIC_TZ
+        assert functions._load_zone.cache_info().currsize == size
+
+
+class TestClassifyMessage:
+    def test_awoo_and_mention(self):
+        assert classify_message("AWOOOO pack") == "awoo"
+        assert classify_message("a0w00 at the moon") == "awoo"
+        assert classify_message("hey @AwooPackBot") == "mention"
+        assert classify_message("awooing isn't a howl") == "chatter"
+        assert classify_message("just chatter") == "chatter"
+
+    def test_first_match_wins(self):
+        assert classify_message("@awoopackbot awoo") == "mention"
+        assert classify_message("awoo @AwooPackBot") == "awoo"
+
+    def test_trigger_words(self):
+        words = get_trigger_words("howl moon")
+        assert classify_message("look at the MOON tonight", words) == "trigger"
+        assert classify_message("moonlight", words) == "chatter"
+        assert classify_message("moon awoo", words) == "trigger"
+        assert classify_message("awoo moon", words) == "awoo"
+        assert classify_message("@AwooPackBot", words) == "mention"
+        assert classify_message("moon", get_trigger_words(None)) == "chatter"
+
+    def test_trigger_words_are_cached(self):
+        assert get_trigger_words("howl moon") is get_trigger_words("howl moon")
+        assert get_trigger_words("Howl  moon") == frozenset({"howl", "moon"})
@@ -0,0 +1,89 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+from datetime import timedelta
+
+import httpx
+import pytest
+from telegram.ext import ApplicationBuilder, CommandHandler
+
+import database
+import metrics
+
+
+class TestHistogram:
+    def test_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", ("kind",), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 3):
+            histogram.observe(value, "a")
+        lines = histogram.render()
+        assert 'test_seconds_bucket{kind="a",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{kind="a",le="1"} 3' in lines
+        assert 'test_seconds_bucket{kind="a",le="+Inf"} 4' in lines
+        assert 'test_seconds_count{kind="a"} 4' in lines
+        assert histogram.count("a") == 4 and histogram.sum("a") == pytest.approx(4.05)
+
+    def test_stats_become_gauges(self):
+        metrics.register_stats("test", lambda: {"depth": 3, "name": "skipped"})
+        text = metrics.render()
+        assert "awoo_test_depth 3.0" in text
+        assert "awoo_test_name" not in text
+
+
+@pytest.mark.usefixtures("temp_db")
+class TestInstrumentation:
+    def test_handler_time_and_queries(self):
+        metrics.instrument_db()
+
+        async def list_command(update, context):
+            await database.run(database.get_all_chats)
+            await database.run(database.get_all_chats, reminders=True)
+
+        application = ApplicationBuilder().token("123:abc").build()
+        application.add_handler(CommandHandler("list", list_command))
+        metrics.instrument_handlers(application)
+        before = metrics.HANDLER_QUERIES.sum("list_command")
+        asyncio.run(application.handlers[0][0].callback(None, None))
+        assert metrics.HANDLER_SECONDS.count("list_command") >= 1
+        # one select for the chats, the reminder relationships find no chats to load
+        assert metrics.HANDLER_QUERIES.sum("list_command") - before == 2
+        assert metrics.DB_QUERY_SECONDS.count("SELECT") >= 2
+
+    def test_job_time_and_lag(self):
+        ran = []
+
+        async def tick_job(context):
+            ran.append(context.job.name)
+
+        async def test():
+            application = ApplicationBuilder().token("123:abc").job_queue(metrics.InstrumentedJobQueue()).build()
+            application.job_queue.run_once(tick_job, when=timedelta(milliseconds=50), name="tick")
+            await application.job_queue.start()
+            await asyncio.sleep(0.3)
+            await application.job_queue.stop()
+        asyncio.run(test())
+        assert ran == ["tick"]
+        assert metrics.JOB_SECONDS.count("tick_job") == 1
+        assert metrics.JOB_LAG_SECONDS.count("tick_job") == 1
+        assert metrics.JOB_LAG_SECONDS.sum("tick_job") < 1
+
+
+class TestMetricsServer:
+    def test_scrape(self):
+        async def test():
+            server = metrics.MetricsServer(listen="127.0.0.1", port=0)
+            await server.start()
+            try:
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{server.port}") as client:
+                    response = await client.get("/metrics")
+                    assert response.status_code == 200
+                    assert "# TYPE awoo_handler_seconds histogram" in response.text
+                    assert (await client.get("/other")).status_code == 404
+            finally:
+                await server.stop()
+        asyncio.run(test())
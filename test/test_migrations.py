@@ -0,0 +1,129 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, inspect
+
+import database
+import models as db
+from constants import DB_THREADS
+
+# the schema as the first release created it
+FIRST_RELEASE_SCHEMA = (
+    "CREATE TABLE chat (id INTEGER NOT NULL, title VARCHAR(255), time_zone VARCHAR(100), stop_armed BOOLEAN, "
+    "reminder_offset INTEGER, PRIMARY KEY (id))",
+    "CREATE TABLE reminder (id INTEGER NOT NULL, chat_id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+    "\"when\" DATETIME NOT NULL, from_user VARCHAR(100), is_daily BOOLEAN, target_user VARCHAR(100), "
+    "subject VARCHAR(255), PRIMARY KEY (id), FOREIGN KEY(chat_id) REFERENCES chat (id))",
+    "CREATE INDEX ix_reminder_chat_id ON reminder (chat_id)",
+    "INSERT INTO chat VALUES (-1, 'pack', 'America/Los_Angeles', 0, 0)",
+    "INSERT INTO reminder VALUES (1, -1, '-1_9_0', '2024-01-01 09:00:00', 'alpha', 1, NULL, NULL)",
+)
+
+
+def index_names(engine) -> set[str]:
+    return {index["name"] for index in inspect(engine).get_indexes("reminder")}
+
+
+class TestMigrations:
+    def test_first_release_database_is_upgraded(self, tmp_path):
+        engine = db.make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as connection:
+            for statement in FIRST_RELEASE_SCHEMA:
+                connection.exec_driver_sql(statement)
+        assert db.init_db(engine) == 0
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA user_version").scalar() == db.SCHEMA_VERSION
+            assert connection.exec_driver_sql("SELECT name FROM reminder").scalar() == "-1_9_0"
+        assert "next_fire" in {column["name"] for column in inspect(engine).get_columns("reminder")}
+        assert "trigger_words" in {column["name"] for column in inspect(engine).get_columns("chat")}
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql(
+                "SELECT minute_of_day, from_user_lower FROM reminder").one() == (540, "alpha")
+        assert index_names(engine) == index_names(self.fresh(tmp_path))
+        assert {"worker", "lease", "firing"} <= set(inspect(engine).get_table_names())
+
+    def test_fresh_database_starts_at_the_last_version(self, tmp_path):
+        engine = self.fresh(tmp_path)
+        assert db.init_db(engine) == db.SCHEMA_VERSION
+        assert {"ix_reminder_name", "ix_reminder_chat_daily_when", "ix_reminder_daily_next_fire"} <= index_names(engine)
+        assert "ix_reminder_chat_id" not in index_names(engine)
+
+    def test_pragmas(self, temp_db):
+        with temp_db.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+
+    def test_connections_are_pooled(self, temp_db):
+        connects = []
+        event.listen(temp_db, "connect", lambda *args: connects.append(args))
+        for _ in range(20):
+            database.run_sync(database.get_chat, -1)
+        # one per db thread at most, each setting the pragmas once
+        assert len(connects) <= DB_THREADS
+
+    def fresh(self, tmp_path):
+        engine = db.make_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+        db.init_db(engine)
+        return engine
+
+
+class TestQueryPlans:
+    now = datetime(2024, 3, 14, 16, 0, tzinfo=timezone.utc)
+
+    @pytest.fixture(autouse=True)
+    def reminders(self, temp_db):
+        self.engine = temp_db
+        with database.session_scope() as session:
+            for chat_id in range(-20, 0):
+                session.add(db.Chat(chat_id=chat_id, title="pack"))
+                session.add(db.Reminder(chat_id=chat_id, when=self.now, from_user="alpha"))
+                session.add(db.Reminder(chat_id=chat_id, when=self.now + timedelta(hours=1), from_user="alpha",
+                                        target_user="beta", subject="walk"))
+
+    def plans(self, fn, *args, **kwargs) -> list[tuple[str, str]]:
+        """Runs fn through database.run_sync and returns (sql, query plan) for every reminder statement it ran."""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if "FROM reminder" in statement or "reminder.name" in statement:
+                statements.append((statement, parameters))
+        event.listen(self.engine, "before_cursor_execute", capture)
+        try:
+            database.run_sync(fn, *args, **kwargs)
+        finally:
+            event.remove(self.engine, "before_cursor_execute", capture)
+        assert statements
+        with self.engine.connect() as connection:
+            return [(statement, " ".join(row[3] for row in connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters))) for statement, parameters in statements]
+
+    def assert_uses(self, index: str, fn, *args, **kwargs):
+        for statement, plan in self.plans(fn, *args, **kwargs):
+            assert index in plan, f"{statement}\n{plan}"
+
+    def test_by_name(self):
+        self.assert_uses("ix_reminder_name", database.get_reminder_by_name, "-5_16_0")
+        self.assert_uses("ix_reminder_name", database.delete_reminder_by_name, "-5_16_0")
+
+    def test_chat_reminders(self):
+        # both (chat_id, is_daily, ...) indexes serve these equally well, sqlite may pick either
+        self.assert_uses("ix_reminder_chat_daily_", database.get_reminders, -5, True)
+        self.assert_uses("ix_reminder_chat_daily_", database.get_chat, -5, reminders=True)
+        self.assert_uses("ix_reminder_chat_daily_", database.get_reminder_page, -5)
+
+    def test_removable_reminders(self):
+        self.assert_uses("ix_reminder_chat_daily_minute", database.get_removable_reminders, -5, "beta", False, 600)
+        self.assert_uses("ix_reminder_chat_daily_minute", database.get_removable_reminder, -5, "beta", False, 1, 600)
+
+    def test_due_and_past_onetime_reminders(self):
+        self.assert_uses("ix_reminder_daily_next_fire", database.get_onetime_reminders_between,
+                         self.now, self.now + timedelta(hours=2))
+        self.assert_uses("ix_reminder_daily_next_fire", database.delete_past_reminders, self.now)
@@ -0,0 +1,169 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import time
+from collections import defaultdict, deque
+
+from telegram.error import BadRequest, RetryAfter
+
+from outbox import PRIORITY_SCHEDULED, Outbox, TokenBucket
+
+
+class FakeBot:
+    """Records sends and raises RetryAfter like telegram when a sliding one second window is exceeded."""
+
+    def __init__(self, global_per_second: int = 1000, chat_per_second: int = 1000, retry_first: set = ()):
+        self.global_per_second = global_per_second
+        self.chat_per_second = chat_per_second
+        self.retry_first = set(retry_first)
+        self.sent = []
+        self.rejected = 0
+        self._global = deque()
+        self._chats = defaultdict(deque)
+
+    def _over(self, window: deque, limit: int, now: float) -> bool:
+        while window and window[0] <= now - 1:
+            window.popleft()
+        return len(window) >= limit
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        if chat_id in self.retry_first:
+            self.retry_first.discard(chat_id)
+            self.rejected += 1
+            raise RetryAfter(1)
+        if self._over(self._global, self.global_per_second, now) or \
+                self._over(self._chats[chat_id], self.chat_per_second, now):
+            self.rejected += 1
+            raise RetryAfter(1)
+        self._global.append(now)
+        self._chats[chat_id].append(now)
+        self.sent.append((chat_id, text))
+        return text
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        return await self.send_message(chat_id, f"{message_id}: {text}")
+
+
+async def run_outbox(outbox: Outbox, bot: FakeBot, messages: list[tuple]):
+    outbox.start(bot)
+    futures = [outbox.send_message(chat_id=chat_id, text=text, **kwargs) for chat_id, text, kwargs in messages]
+    results = await asyncio.gather(*futures)
+    await outbox.stop()
+    return results
+
+
+class TestTokenBucket:
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        for _ in range(2):
+            assert bucket.wait_time() == 0
+            bucket.take()
+        assert 0 < bucket.wait_time() <= 0.1
+
+    def test_for_limit_leaves_room_for_burst(self):
+        bucket = TokenBucket.for_limit(20, 60, 3)
+        assert bucket.capacity + bucket.rate * 60 == 20
+
+
+class TestOutbox:
+    def test_stays_under_chat_limit(self):
+        bot = FakeBot(chat_per_second=20)
+        outbox = Outbox(global_per_second=100, private_per_second=20)
+        messages = [(1, str(i), {}) for i in range(30)]
+        results = asyncio.run(run_outbox(outbox, bot, messages))
+        assert results == [str(i) for i in range(30)]
+        assert bot.rejected == 0
+        assert outbox.stats()["sent"] == 30
+
+    def test_stays_under_global_limit(self):
+        bot = FakeBot(global_per_second=20)
+        outbox = Outbox(global_per_second=20)
+        messages = [(-i, "hi", {}) for i in range(1, 31)]
+        asyncio.run(run_outbox(outbox, bot, messages))
+        assert bot.rejected == 0
+        assert len(bot.sent) == 30
+
+    def test_replies_jump_scheduled_fan_out(self):
+        bot = FakeBot()
+        outbox = Outbox(global_per_second=20, group_per_minute=6000)
+        messages = [(-i, "daily", {"priority": PRIORITY_SCHEDULED}) for i in range(1, 11)]
+        messages.append((-99, "reply", {}))
+        asyncio.run(run_outbox(outbox, bot, messages))
+        assert bot.sent.index((-99, "reply")) == 0
+
+    def test_retry_after_only_holds_back_that_chat(self):
+        bot = FakeBot(retry_first={-1})
+        outbox = Outbox(global_per_second=100, group_per_minute=6000)
+        messages = [(-1, "first", {}), (-1, "second", {})] + [(-2, str(i), {}) for i in range(5)]
+        results = asyncio.run(run_outbox(outbox, bot, messages))
+        assert results[:2] == ["first", "second"]
+        assert [text for chat_id, text in bot.sent[:5]] == [str(i) for i in range(5)]
+        assert outbox.stats()["retry_afters"] == 1
+
+    def test_failed_send_resolves_none(self):
+        class BrokenBot(FakeBot):
+            async def send_message(self, chat_id, text, **kwargs):
+                raise ValueError("nope")
+        outbox = Outbox()
+        assert asyncio.run(run_outbox(outbox, BrokenBot(), [(1, "hi", {})])) == [None]
+        assert outbox.stats()["failed"] == 1
+        assert outbox.queue_depth() == 0
+
+    def test_edits_share_the_chat_limit(self):
+        async def test():
+            outbox.start(bot)
+            sent = outbox.send_message(chat_id=1, text="page 1")
+            edited = outbox.edit_message_text(chat_id=1, message_id=5, text="page 2")
+            results = await asyncio.gather(sent, edited)
+            await outbox.stop()
+            return results
+        bot = FakeBot(chat_per_second=2)
+        outbox = Outbox(global_per_second=100, private_per_second=2)
+        assert asyncio.run(test()) == ["page 1", "5: page 2"]
+        assert bot.rejected == 0 and outbox.stats()["sent"] == 2
+
+    def test_edit_not_modified_is_not_a_failure(self):
+        class SamePageBot(FakeBot):
+            async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+                raise BadRequest("Message is not modified: specified new message content and reply markup are "
+                                 "exactly the same as a current content and reply markup of the message")
+
+        async def test():
+            outbox.start(SamePageBot())
+            result = await outbox.edit_message_text(chat_id=1, message_id=5, text="page 2")
+            await outbox.stop()
+            return result
+        outbox = Outbox()
+        assert asyncio.run(test()) is True
+        assert outbox.stats()["failed"] == 0 and outbox.queue_depth() == 0
+
+    def test_stop_drains_the_queue(self):
+        async def test():
+            outbox.start(bot)
+            futures = [outbox.send_message(chat_id=1, text=str(i)) for i in range(5)]
+            await outbox.stop()
+            return [f.result() for f in futures]
+        bot = FakeBot()
+        outbox = Outbox(private_per_second=10, burst=1)
+        assert asyncio.run(test()) == [str(i) for i in range(5)]
+        assert len(bot.sent) == 5
+
+    def test_stop_gives_up_after_timeout(self):
+        async def test():
+            outbox.start(FakeBot())
+            futures = [outbox.send_message(chat_id=1, text=str(i)) for i in range(5)]
+            started = time.monotonic()
+            await outbox.stop(timeout=0.2)
+            return time.monotonic() - started, [f.result() for f in futures]
+        # one message a second, so only the first goes out before the timeout
+        outbox = Outbox(private_per_second=1, burst=1)
+        elapsed, results = asyncio.run(test())
+        assert elapsed < 1
+        assert results == ["0", None, None, None, None]
+        assert outbox.queue_depth() == 0
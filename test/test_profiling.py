@@ -0,0 +1,67 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import logging
+
+import database
+from profiling import HandlerProfiler, SlowQueryLog
+
+
+def busy_work():
+    return sum(i * i for i in range(20000))
+
+
+async def slow_command(update, context):
+    busy_work()
+    await asyncio.sleep(0)
+
+
+class TestHandlerProfiler:
+    def test_disabled_does_nothing(self, tmp_path):
+        profiler = HandlerProfiler(enabled=False, threshold_ms=0, directory=str(tmp_path))
+        asyncio.run(profiler.wrap(slow_command)(None, None))
+        assert profiler.stats() == {"enabled": 0, "profiled": 0, "saved": 0}
+        assert profiler.dump() is None
+
+    def test_slow_update_is_saved(self, tmp_path):
+        profiler = HandlerProfiler(enabled=True, threshold_ms=0, directory=str(tmp_path))
+        asyncio.run(profiler.wrap(slow_command)(None, None))
+        saved = os.listdir(tmp_path)
+        assert len(saved) == 1 and saved[0].startswith("slow_command-") and saved[0].endswith(".prof")
+
+    def test_fast_update_only_counts_towards_totals(self, tmp_path):
+        profiler = HandlerProfiler(enabled=True, threshold_ms=60000, directory=str(tmp_path))
+        for _ in range(3):
+            asyncio.run(profiler.wrap(slow_command)(None, None))
+        assert profiler.stats() == {"enabled": 1, "profiled": 3, "saved": 0}
+        assert "busy_work" in profiler.top()
+        with open(profiler.dump()) as f:
+            assert "busy_work" in f.read()
+
+    def test_toggle(self):
+        profiler = HandlerProfiler(enabled=False)
+        assert profiler.toggle() is True
+        assert profiler.toggle() is False
+
+
+class TestSlowQueryLog:
+    def test_logs_sql_and_parameters(self, temp_db, caplog):
+        slow_queries = SlowQueryLog(threshold_ms=0)
+        slow_queries.install(temp_db)
+        with caplog.at_level(logging.WARNING):
+            database.run_sync(database.get_chat, -1001234)
+        assert slow_queries.stats()["slow"] >= 1
+        assert any("FROM chat" in r.message and "-1001234" in r.message for r in caplog.records)
+
+    def test_fast_queries_are_quiet(self, temp_db, caplog):
+        slow_queries = SlowQueryLog(threshold_ms=60000)
+        slow_queries.install(temp_db)
+        with caplog.at_level(logging.WARNING):
+            database.run_sync(database.get_chat, -1001234)
+        assert slow_queries.stats()["slow"] == 0
+        assert not caplog.records
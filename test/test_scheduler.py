@@ -0,0 +1,145 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import database
+import models as db
+from constants import PACIFIC_TZ
+from scheduler import DailyBuckets, ReminderScheduler
+
+
+class TestReminderScheduler:
+    now = datetime.now(PACIFIC_TZ).replace(microsecond=0)
+
+    def test_nothing_in_window_before_first_page(self):
+        assert not ReminderScheduler().in_window(self.now)
+
+    def test_advance_ranges_are_contiguous(self):
+        scheduler = ReminderScheduler(window=timedelta(hours=1))
+        first = scheduler.advance(self.now)
+        second = scheduler.advance(self.now + timedelta(minutes=15))
+        assert first == (None, self.now + timedelta(hours=1))
+        assert second == (first[1], self.now + timedelta(hours=1, minutes=15))
+
+    def test_horizon_never_moves_back(self):
+        scheduler = ReminderScheduler(window=timedelta(hours=1))
+        scheduler.advance(self.now)
+        assert scheduler.advance(self.now - timedelta(hours=2)) == (scheduler.horizon, scheduler.horizon)
+
+    def test_in_window_accepts_naive_db_values(self):
+        scheduler = ReminderScheduler(window=timedelta(hours=1))
+        scheduler.advance(self.now)
+        assert scheduler.in_window((self.now + timedelta(minutes=30)).replace(tzinfo=None))
+        assert not scheduler.in_window(self.now + timedelta(hours=2))
+
+
+@pytest.mark.usefixtures("temp_db")
+class TestOnetimeRemindersBetween:
+    now = datetime.now(PACIFIC_TZ).replace(microsecond=0)
+
+    def test_range_query(self):
+        database.run_sync(database.add_chat_if_not_exist, chat_id=-1, title="Pack")
+        for hours in (1, 2, 3):
+            database.run_sync(database.add_reminder, db.Reminder(
+                chat_id=-1, when=self.now + timedelta(hours=hours), from_user="Test",
+                target_user="Test", subject=f"in {hours}"
+            ))
+        database.run_sync(database.add_reminder, db.Reminder(chat_id=-1, when=self.now, from_user="Test"))
+        first = database.run_sync(database.get_onetime_reminders_between, None, self.now + timedelta(hours=2))
+        rest = database.run_sync(database.get_onetime_reminders_between, self.now + timedelta(hours=2),
+                                 self.now + timedelta(days=1))
+        assert [r.subject for r in first] == ["in 1"]
+        assert [r.subject for r in rest] == ["in 2", "in 3"]
+
+
+class TestNextFire:
+    new_york = ZoneInfo("America/New_York")
+
+    def daily(self, hour: int, minute: int = 0) -> db.Reminder:
+        return db.Reminder(chat_id=-1, when=datetime(2024, 1, 1, hour, minute, tzinfo=self.new_york), from_user="Test")
+
+    def firings(self, reminder: db.Reminder, after: datetime, count: int) -> list[datetime]:
+        fired = [reminder.schedule_next(self.new_york, after=after)]
+        for _ in range(count - 1):
+            fired.append(reminder.schedule_next(self.new_york, after=fired[-1]))
+        return [f.astimezone(self.new_york) for f in fired]
+
+    def test_daily_keeps_wall_time_across_spring_forward(self):
+        fired = self.firings(self.daily(9), datetime(2024, 3, 9, 12, tzinfo=timezone.utc), 3)
+        assert [(f.day, f.hour) for f in fired] == [(9, 9), (10, 9), (11, 9)]
+        assert fired[1].astimezone(timezone.utc) - fired[0].astimezone(timezone.utc) == timedelta(hours=23)
+
+    def test_daily_in_skipped_hour_fires_once_after_the_gap(self):
+        fired = self.firings(self.daily(2, 30), datetime(2024, 3, 9, 12, tzinfo=timezone.utc), 3)
+        assert [(f.day, f.hour, f.minute) for f in fired] == [(10, 3, 30), (11, 2, 30), (12, 2, 30)]
+
+    def test_daily_in_repeated_hour_fires_once(self):
+        fired = self.firings(self.daily(1, 30), datetime(2024, 11, 2, 12, tzinfo=timezone.utc), 3)
+        assert [f.day for f in fired] == [3, 4, 5]
+        assert fired[1].astimezone(timezone.utc) - fired[0].astimezone(timezone.utc) == timedelta(hours=25)
+
+    def test_next_fire_is_utc(self):
+        reminder = db.Reminder(chat_id=-1, when=datetime(2024, 7, 1, 17, tzinfo=self.new_york), from_user="Test",
+                               target_user="Test", subject="soon")
+        assert reminder.next_fire == datetime(2024, 7, 1, 21, tzinfo=timezone.utc)
+        assert reminder.next_fire.tzinfo is timezone.utc
+
+
+class TestDailyBuckets:
+    now = datetime(2024, 7, 1, 12, tzinfo=timezone.utc)
+
+    def daily(self, chat_id: int, hour: int, minute: int = 0) -> db.Reminder:
+        reminder = db.Reminder(chat_id=chat_id, when=datetime(2024, 1, 1, hour, minute, tzinfo=timezone.utc),
+                               from_user="Test")
+        reminder.schedule_next(timezone.utc, after=self.now)
+        return reminder
+
+    def test_same_minute_shares_a_bucket(self):
+        buckets = DailyBuckets()
+        minutes = {buckets.add(self.daily(chat_id, 13, 5), tz=timezone.utc) for chat_id in range(-50, 0)}
+        assert minutes == {13 * 60 + 5}
+        assert buckets.stats() == {"buckets": 1, "reminders": 50}
+
+    def test_remove_reports_emptied_bucket(self):
+        buckets = DailyBuckets()
+        a, b = self.daily(-1, 13), self.daily(-2, 13)
+        buckets.add(a)
+        buckets.add(b)
+        assert buckets.remove(a.name) is None
+        assert buckets.remove(b.name) == 13 * 60
+        assert buckets.remove(b.name) is None
+        assert not buckets.minutes() and a.name not in buckets
+
+    def test_offset_stays_in_range_and_after_now(self):
+        buckets = DailyBuckets()
+        for chat_id in range(-200, 0):
+            reminder = self.daily(chat_id, 12, 10)
+            buckets.add(reminder, offset=30, now=self.now)
+            fire_at = buckets.get(reminder.name).fire_at
+            assert self.now <= fire_at < reminder.next_fire + timedelta(minutes=30)
+            assert buckets.get(reminder.name) in buckets.pop_due(fire_at.hour * 60 + fire_at.minute, fire_at)
+
+    def test_pop_due_leaves_later_days(self):
+        buckets = DailyBuckets()
+        today, tomorrow = self.daily(-1, 13), self.daily(-2, 13)
+        tomorrow.schedule_next(timezone.utc, after=tomorrow.next_fire)
+        buckets.add(today)
+        buckets.add(tomorrow)
+        due = buckets.pop_due(13 * 60, self.now.replace(hour=13))
+        assert [entry.reminder for entry in due] == [today]
+        assert tomorrow.name in buckets and today.name not in buckets
+
+    def test_remove_chats(self):
+        buckets = DailyBuckets()
+        for chat_id, hour in ((-1, 13), (-1, 14), (-2, 14)):
+            buckets.add(self.daily(chat_id, hour))
+        assert buckets.remove_chats([-1]) == {13 * 60}
+        assert buckets.chat_ids() == {-2}
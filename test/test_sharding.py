@@ -0,0 +1,138 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import multiprocessing
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import create_engine
+
+import database
+import models as db
+from sharding import ShardLeases
+
+NOW = datetime(2024, 3, 14, 16, 0, tzinfo=timezone.utc)
+SHARDS = 16
+
+
+def worker(path: str, owner: str, rounds: int, barrier, results):
+    """One bot process: renews its leases a few times, then tries to send every firing of the day."""
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+    db.Session.configure(bind=engine)
+    leases = ShardLeases(owner=owner, shard_count=SHARDS, workers=4)
+    barrier.wait()
+    for _ in range(rounds):
+        database.run_sync(leases.renew)
+        barrier.wait()
+    sent = [name for name in (f"job_{i}" for i in range(100)) if database.run_sync(leases.claim, name, "2024-03-14")]
+    results.put((owner, sorted(leases.owned), sent))
+
+
+@pytest.mark.usefixtures("temp_db")
+class TestShardLeases:
+    def test_single_worker_owns_everything(self):
+        leases = ShardLeases(owner="a", shard_count=SHARDS, workers=1)
+        assert all(leases.owns(chat_id) for chat_id in (-1001234, 0, 42))
+        assert database.run_sync(leases.renew) == (set(), set())
+        assert database.run_sync(leases.claim, "job", "2024-03-14")
+        assert database.run_sync(leases.claim, "job", "2024-03-14")
+
+    def test_second_worker_gets_half(self):
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        b = ShardLeases(owner="b", shard_count=SHARDS, workers=2)
+        assert database.run_sync(a.renew, now=NOW) == (set(range(SHARDS)), set())
+        # everything is leased to a, so b has to wait for a to give some up
+        assert database.run_sync(b.renew, now=NOW) == (set(), set())
+        gained, lost = database.run_sync(a.renew, now=NOW)
+        assert not gained and len(lost) == SHARDS // 2
+        gained, _ = database.run_sync(b.renew, now=NOW)
+        assert gained == lost
+        assert a.owned.isdisjoint(b.owned) and a.owned | b.owned == set(range(SHARDS))
+        assert all(a.owns(chat_id) != b.owns(chat_id) for chat_id in range(-50, 50))
+
+    def test_crashed_worker_is_taken_over(self):
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        b = ShardLeases(owner="b", shard_count=SHARDS, workers=2)
+        database.run_sync(a.renew, now=NOW)
+        database.run_sync(b.renew, now=NOW)
+        assert not b.owned
+        # a stops renewing
+        later = NOW + a.ttl + timedelta(seconds=1)
+        gained, _ = database.run_sync(b.renew, now=later)
+        assert gained == set(range(SHARDS))
+
+    def test_release_frees_shards_right_away(self):
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        b = ShardLeases(owner="b", shard_count=SHARDS, workers=2)
+        database.run_sync(a.renew, now=NOW)
+        database.run_sync(a.release)
+        assert database.run_sync(b.renew, now=NOW)[0] == set(range(SHARDS))
+
+    def test_firing_is_claimed_once(self):
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        b = ShardLeases(owner="b", shard_count=SHARDS, workers=2)
+        today, tomorrow = database.firing_key(NOW), database.firing_key(NOW + timedelta(days=1))
+        assert database.run_sync(a.claim, "job", today) is True
+        assert database.run_sync(b.claim, "job", today) is False
+        assert database.run_sync(b.claim, "job", tomorrow) is True
+        assert database.run_sync(database.purge_firings, NOW + timedelta(hours=1)) == 1
+
+    def test_two_firings_on_one_utc_date(self):
+        # europe/london 00:30 fires at 00:30 utc, then the clocks go forward and it fires at 23:30 utc the same date
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        london = ZoneInfo("Europe/London")
+        first = db.next_fire_time(time(0, 30), True, london, after=datetime(2026, 3, 28, 12, 0, tzinfo=timezone.utc))
+        second = db.next_fire_time(time(0, 30), True, london, after=first)
+        assert first.date() == second.date()
+        assert database.run_sync(a.claim, "job", database.firing_key(first)) is True
+        assert database.run_sync(a.claim, "job", database.firing_key(second)) is True
+
+    def test_updates_are_forwarded_to_the_owner(self):
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        b = ShardLeases(owner="b", shard_count=SHARDS, workers=2)
+        # the same handover as test_second_worker_gets_half
+        for leases in (a, b, a, b):
+            database.run_sync(leases.renew, now=NOW)
+        theirs = next(chat_id for chat_id in range(-1, -SHARDS * 2, -1) if b.owns(chat_id))
+        other = next(chat_id for chat_id in range(-1, -SHARDS * 2, -1) if a.owns(chat_id))
+        for i in range(3):
+            database.run_sync(a.forward, theirs, f"update {i}")
+        database.run_sync(b.forward, other, "back to a")
+        assert database.run_sync(b.take_forwarded) == ["update 0", "update 1", "update 2"]
+        # each one is handed out once
+        assert database.run_sync(b.take_forwarded) == []
+        assert database.run_sync(a.take_forwarded) == ["back to a"]
+
+    def test_forwarded_updates_wait_for_an_owner(self):
+        a = ShardLeases(owner="a", shard_count=SHARDS, workers=2)
+        b = ShardLeases(owner="b", shard_count=SHARDS, workers=2)
+        database.run_sync(a.renew, now=NOW)
+        database.run_sync(a.forward, -1, "while a owned it")
+        database.run_sync(a.release)
+        database.run_sync(b.renew, now=NOW)
+        assert database.run_sync(b.take_forwarded, limit=10) == ["while a owned it"]
+
+    def test_processes_split_shards_and_fire_once(self, tmp_path):
+        path = tmp_path / "chats.db"
+        db.Base.metadata.create_all(create_engine(f"sqlite:///{path}"))
+        context = multiprocessing.get_context("spawn")
+        owners = ["w0", "w1", "w2", "w3"]
+        barrier = context.Barrier(len(owners))
+        results = context.Queue()
+        processes = [context.Process(target=worker, args=(str(path), owner, 4, barrier, results)) for owner in owners]
+        for process in processes:
+            process.start()
+        reported = [results.get(timeout=60) for _ in owners]
+        for process in processes:
+            process.join(timeout=10)
+        owned = [set(shards) for _, shards, _ in reported]
+        assert sum(len(shards) for shards in owned) == SHARDS
+        assert set().union(*owned) == set(range(SHARDS))
+        assert all(len(shards) == SHARDS // len(owners) for shards in owned)
+        sent = [name for _, _, names in reported for name in names]
+        assert sorted(sent) == sorted(f"job_{i}" for i in range(100))
@@ -0,0 +1,106 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import pytest
+
+from sheet_data import SheetData
+
+SHEETS = {
+    "Formats": "format\n%greeting% pack!\nGood %tod%!\n",
+    "Words": "greeting,awoo,Unnamed: 2\nHello,Awoo!,x\nHowdy,,\n",
+}
+
+
+class SheetHandler(BaseHTTPRequestHandler):
+    """Serves the sheets as csv with an ETag, answering 304 when the client already has it."""
+    sheets = SHEETS
+    requests = []
+
+    def do_GET(self):
+        sheet = parse_qs(urlparse(self.path).query)["sheet"][0]
+        etag = f'"{sheet}-{hash(self.sheets[sheet])}"'
+        self.requests.append((sheet, self.headers.get("If-None-Match")))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = self.sheets[sheet].encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sheet_server():
+    SheetHandler.requests = []
+    SheetHandler.sheets = dict(SHEETS)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SheetHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/{{sheet_id}}?sheet={{sheet}}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestSheetData:
+    def test_refresh_parses_and_snapshots(self, sheet_server, tmp_path):
+        sheet_data = SheetData(snapshot_path=str(tmp_path / "words.json"), url=sheet_server)
+        assert asyncio.run(sheet_data.refresh()) is True
+        assert sheet_data.data["formats"] == ("%greeting% pack!", "Good %tod%!")
+        assert sheet_data.data["words"] == {"greeting": ["Hello", "Howdy"], "awoo": ["Awoo!"]}
+        assert "templates" in sheet_data.data
+
+        from_disk = SheetData(snapshot_path=str(tmp_path / "words.json"), url="http://127.0.0.1:9/unreachable")
+        assert from_disk.load_snapshot() is True
+        assert from_disk.data == sheet_data.data
+
+    def test_unchanged_sheet_is_not_downloaded(self, sheet_server, tmp_path):
+        sheet_data = SheetData(snapshot_path=str(tmp_path / "words.json"), url=sheet_server)
+        asyncio.run(sheet_data.refresh())
+        data = sheet_data.data
+        assert asyncio.run(sheet_data.refresh()) is False
+        assert sheet_data.data is data
+        assert all(etag for _, etag in SheetHandler.requests[2:])
+
+    def test_changed_sheet_swaps_data(self, sheet_server, tmp_path):
+        sheet_data = SheetData(snapshot_path=str(tmp_path / "words.json"), url=sheet_server)
+        asyncio.run(sheet_data.refresh())
+        SheetHandler.sheets["Formats"] = "format\nNew %greeting%\n"
+        assert asyncio.run(sheet_data.refresh()) is True
+        assert sheet_data.data["formats"] == ("New %greeting%",)
+        assert sheet_data.data["words"]["greeting"] == ["Hello", "Howdy"]
+
+    def test_concurrent_refreshes_share_one_fetch(self, sheet_server, tmp_path):
+        sheet_data = SheetData(snapshot_path=str(tmp_path / "words.json"), url=sheet_server)
+
+        async def main():
+            return await asyncio.gather(*[sheet_data.refresh() for _ in range(5)])
+        assert asyncio.run(main()) == [True] * 5
+        assert len(SheetHandler.requests) == 2
+
+    def test_unreachable_sheet_keeps_data(self, sheet_server, tmp_path):
+        sheet_data = SheetData(snapshot_path=str(tmp_path / "words.json"), url=sheet_server)
+        asyncio.run(sheet_data.refresh())
+        data = sheet_data.data
+        sheet_data.url = "http://127.0.0.1:9/{sheet_id}?sheet={sheet}"
+        with pytest.raises(httpx.HTTPError):
+            asyncio.run(sheet_data.refresh())
+        assert sheet_data.data is data
+
+    def test_missing_snapshot(self, tmp_path):
+        assert SheetData(snapshot_path=str(tmp_path / "missing.json")).load_snapshot() is False
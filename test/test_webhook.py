@@ -0,0 +1,177 @@
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+
+import asyncio
+import json
+import shutil
+import subprocess
+import time
+
+import httpx
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+from webhook import SECRET_HEADER, WebhookServer, make_ssl_context, register_webhook, run_webhook
+
+SECRET = "s3cret"
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": -100, "type": "group", "title": "pack"},
+            "from": {"id": 7, "is_bot": False, "first_name": "pup"},
+            "text": "awoo",
+        },
+    }
+
+
+@pytest.fixture
+def self_signed(tmp_path):
+    if not shutil.which("openssl"):
+        pytest.skip("needs openssl to make a certificate")
+    cert, key = str(tmp_path / "cert.pem"), str(tmp_path / "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+async def with_server(test, verify=True, **kwargs):
+    # never initialized, so nothing here talks to telegram
+    application = ApplicationBuilder().token("123:abc").build()
+    server = WebhookServer(application, SECRET, listen="127.0.0.1", port=0, path="/hook", **kwargs)
+    await server.start()
+    scheme = "https" if server.ssl_context else "http"
+    try:
+        async with httpx.AsyncClient(base_url=f"{scheme}://127.0.0.1:{server.port}", verify=verify) as client:
+            return await test(client, server, application.update_queue)
+    finally:
+        await server.stop()
+
+
+class TestWebhookServer:
+    def test_update_is_queued(self):
+        async def test(client, server, queue):
+            response = await client.post("/hook", json=make_update(1), headers={SECRET_HEADER: SECRET})
+            assert response.status_code == 200
+            update = queue.get_nowait()
+            assert isinstance(update, Update)
+            assert update.effective_message.text == "awoo"
+        asyncio.run(with_server(test))
+
+    def test_wrong_secret_is_rejected(self):
+        async def test(client, server, queue):
+            assert (await client.post("/hook", json=make_update(1))).status_code == 403
+            assert (await client.post("/hook", json=make_update(1), headers={SECRET_HEADER: "nope"})).status_code == 403
+            assert queue.empty()
+            assert server.stats()["rejected"] == 2
+        asyncio.run(with_server(test))
+
+    def test_bad_requests(self):
+        async def test(client, server, queue):
+            headers = {SECRET_HEADER: SECRET}
+            assert (await client.post("/other", json=make_update(1), headers=headers)).status_code == 404
+            assert (await client.get("/hook", headers=headers)).status_code == 405
+            assert (await client.post("/hook", content=b"{not json", headers=headers)).status_code == 400
+            assert queue.empty()
+        asyncio.run(with_server(test))
+
+    def test_https(self, self_signed):
+        async def test(client, server, queue):
+            response = await client.post("/hook", json=make_update(1), headers={SECRET_HEADER: SECRET})
+            assert response.status_code == 200
+            assert queue.get_nowait().update_id == 1
+        cert, key = self_signed
+        asyncio.run(with_server(test, verify=cert, ssl_context=make_ssl_context(cert, key)))
+
+    def test_full_queue_asks_telegram_to_retry(self):
+        async def test(client, server, queue):
+            headers = {SECRET_HEADER: SECRET}
+            statuses = [(await client.post("/hook", json=make_update(i), headers=headers)).status_code
+                        for i in range(3)]
+            assert statuses == [200, 200, 503]
+            assert queue.qsize() == 2
+        asyncio.run(with_server(test, max_pending=2))
+
+    def test_throughput_and_ack_latency(self):
+        count, connections = 2000, 20
+
+        async def test(client, server, queue):
+            async def post_many(first: int):
+                # a bare keep-alive connection like telegram's, so the client isn't what gets measured
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+                statuses = []
+                for i in range(first, count, connections):
+                    body = json.dumps(make_update(i)).encode()
+                    writer.write(f"POST /hook HTTP/1.1\r\nHost: bot\r\n{SECRET_HEADER}: {SECRET}\r\n"
+                                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+                    statuses.append(int((await reader.readuntil(b"\r\n\r\n")).split()[1]))
+                writer.close()
+                return statuses
+            start = time.perf_counter()
+            results = await asyncio.gather(*[post_many(i) for i in range(connections)])
+            elapsed = time.perf_counter() - start
+            stats = server.stats()
+            print(f"{count / elapsed:.0f} requests/sec, ack p50 {stats['ack_p50'] * 1000:.2f}ms "
+                  f"p99 {stats['ack_p99'] * 1000:.2f}ms")
+            assert all(status == 200 for statuses in results for status in statuses)
+            assert queue.qsize() == count
+            assert sorted(queue.get_nowait().update_id for _ in range(count)) == list(range(count))
+        asyncio.run(with_server(test, max_pending=count))
+
+
+class FakeBot:
+    def __init__(self, url: str = ""):
+        self.url = url
+        self.set_calls = 0
+
+    async def get_webhook_info(self):
+        return type("WebhookInfo", (), {"url": self.url})
+
+    async def set_webhook(self, url, certificate=None, **kwargs):
+        self.url = url
+        self.set_calls += 1
+        self.certificate = certificate.read() if certificate else None
+
+
+class TestRegisterWebhook:
+    def test_lone_worker_always_registers(self):
+        bot = FakeBot("https://pack.example/hook")
+        assert asyncio.run(register_webhook(bot, "https://pack.example/hook", SECRET))
+        assert bot.set_calls == 1
+
+    def test_certificate_is_uploaded(self, self_signed):
+        cert, _ = self_signed
+        bot = FakeBot()
+        asyncio.run(register_webhook(bot, "https://pack.example/hook", SECRET, cert=cert))
+        with open(cert, "rb") as f:
+            assert bot.certificate == f.read()
+
+    def test_shared_webhook_is_registered_once(self):
+        bot = FakeBot()
+        for _ in range(3):
+            asyncio.run(register_webhook(bot, "https://pack.example/hook", SECRET, shared=True))
+        assert bot.set_calls == 1
+
+    def test_workers_need_a_shared_secret(self):
+        application = ApplicationBuilder().token("123:abc").build()
+        try:
+            run_webhook(application, url="https://pack.example/hook", secret_token="", workers=2)
+        except ValueError as e:
+            assert "AWOO_WEBHOOK_SECRET" in str(e)
+        else:
+            raise AssertionError("expected a ValueError")
+
+    def test_https_needs_cert_and_key(self):
+        application = ApplicationBuilder().token("123:abc").build()
+        with pytest.raises(ValueError, match="AWOO_WEBHOOK_KEY"):
+            run_webhook(application, url="https://pack.example/hook", secret_token=SECRET, cert="cert.pem", key="")
@@ -0,0 +1,216 @@
+# receives updates from telegram over https posts instead of long polling. the
+# receiver only checks the secret token, decodes the update and puts it on the
+# application's update queue, so telegram gets its 200 before any handler runs.
+# it serves https itself when given a certificate and key (AWOO_WEBHOOK_CERT and
+# AWOO_WEBHOOK_KEY), otherwise plain http, which must sit behind a reverse proxy
+# that terminates tls.
+# several workers share one webhook: one url in front of them all and the same
+# secret, registered by whichever starts first. see sharding.py for how updates
+# reach the worker that owns their chat.
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import secrets
+import signal
+import ssl
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from telegram import Update
+
+import metrics
+from constants import (
+    WEBHOOK_CERT,
+    WEBHOOK_KEY,
+    WEBHOOK_LISTEN,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_MAX_PENDING,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WORKER_COUNT
+)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_BYTES = 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class WebhookServer:
+    def __init__(self, application, secret_token: str, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = "/", max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+                 max_pending: int = WEBHOOK_MAX_PENDING, ssl_context: ssl.SSLContext = None):
+        self.application = application
+        self.secret_token = secret_token.encode()
+        self.listen = listen
+        self.port = port
+        self.path = path or "/"
+        self.max_pending = max_pending
+        self.ssl_context = ssl_context
+        self._connections = asyncio.Semaphore(max_connections)
+        self._server: asyncio.AbstractServer = None
+        self._acks = deque(maxlen=1000)
+        self.received = 0
+        self.rejected = 0
+        self.busy = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port, ssl=self.ssl_context)
+        # port 0 picks a free one, which the tests rely on
+        self.port = self._server.sockets[0].getsockname()[1]
+        scheme = "https" if self.ssl_context else "http"
+        logging.info(f"Listening for webhook updates on {scheme}://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async with self._connections:
+            try:
+                while await self._handle_request(reader, writer):
+                    pass
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ssl.SSLError, ValueError):
+                pass
+            finally:
+                writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Answers one request on a connection. Returns False when the connection should be closed."""
+        head = await reader.readuntil(b"\r\n\r\n")
+        started = time.monotonic()
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        method, target, version = request_line.split(" ", 2)
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        if length > MAX_BODY_BYTES:
+            await self._respond(writer, 413, False)
+            return False
+        body = await reader.readexactly(length)
+        status = self._accept(method, target, headers, body)
+        await self._respond(writer, status, keep_alive)
+        if status == 200:
+            self._acks.append(time.monotonic() - started)
+        return keep_alive
+
+    def _accept(self, method: str, target: str, headers: dict, body: bytes) -> int:
+        if urlparse(target).path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self.secret_token):
+            self.rejected += 1
+            return 403
+        queue = self.application.update_queue
+        if queue.qsize() >= self.max_pending:
+            # telegram retries anything that isn't a 2xx, so let it hold on to the update for now
+            self.busy += 1
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except ValueError:
+            return 400
+        if not update:
+            return 400
+        queue.put_nowait(update)
+        self.received += 1
+        return 200
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode())
+        await writer.drain()
+
+    def stats(self) -> dict:
+        acks = sorted(self._acks)
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "busy": self.busy,
+            "queue_depth": self.application.update_queue.qsize(),
+            "ack_p50": acks[len(acks) // 2] if acks else 0,
+            "ack_p99": acks[min(len(acks) - 1, int(len(acks) * 0.99))] if acks else 0,
+        }
+
+
+def make_ssl_context(cert: str, key: str) -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def register_webhook(bot, url: str, secret_token: str, allowed_updates: list[str] = None,
+                           shared: bool = False, cert: str = None) -> bool:
+    """Points telegram at url. A shared webhook that's already there is left alone, so only one worker sets it.
+    The certificate is uploaded so telegram will trust it if it's self-signed."""
+    if shared and (await bot.get_webhook_info()).url == url:
+        return False
+    with open(cert, "rb") if cert else contextlib.nullcontext() as certificate:
+        await bot.set_webhook(url, secret_token=secret_token, allowed_updates=allowed_updates,
+                              max_connections=WEBHOOK_MAX_CONNECTIONS, certificate=certificate)
+    return True
+
+
+async def serve(application, server: WebhookServer = None, on_start=None):
+    """Runs the application until SIGINT or SIGTERM, taking updates from server if there is one."""
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        if server:
+            await server.start()
+        if on_start:
+            await on_start()
+        await application.start()
+        await stop.wait()
+        if server:
+            await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application, url: str = WEBHOOK_URL, secret_token: str = WEBHOOK_SECRET,
+                allowed_updates: list[str] = None, workers: int = WORKER_COUNT, cert: str = WEBHOOK_CERT,
+                key: str = WEBHOOK_KEY):
+    """Serves the application from a WebhookServer until SIGINT or SIGTERM, in place of run_polling."""
+    if not url:
+        raise ValueError("Webhook mode needs a public url, set AWOO_WEBHOOK_URL")
+    if bool(cert) != bool(key):
+        raise ValueError("Serving https needs both AWOO_WEBHOOK_CERT and AWOO_WEBHOOK_KEY")
+    ssl_context = make_ssl_context(cert, key) if cert else None
+    if not ssl_context:
+        logging.info("Serving the webhook over plain http, a reverse proxy in front has to terminate tls")
+    shared = workers > 1
+    if shared and not secret_token:
+        raise ValueError("Workers share one webhook, set the same AWOO_WEBHOOK_SECRET on each")
+    # telegram sends the secret back with every update, so a fresh one per run is fine for a lone worker
+    secret_token = secret_token or secrets.token_urlsafe(32)
+
+    async def main():
+        server = WebhookServer(application, secret_token, path=urlparse(url).path, ssl_context=ssl_context)
+        metrics.register_stats("webhook", server.stats)
+        await serve(application, server, lambda: register_webhook(application.bot, url, secret_token,
+                                                                  allowed_updates, shared, cert or None))
+
+    asyncio.run(main())
+
+
+def run_forwarded(application):
+    """Runs a worker that doesn't hear from telegram itself, only the updates the receiving worker forwards."""
+    asyncio.run(serve(application))